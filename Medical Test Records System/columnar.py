@@ -0,0 +1,198 @@
+import ast
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:  # the bundle is written and read with the array module; NumPy only maps it
+    numpy = None
+
+BUNDLE_FORMAT = "mtrs-columns"
+BUNDLE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+NO_TIME = -2 ** 63  # stands for a missing time in the int64 time columns
+
+# .npy (format 1.0) files: magic, header length, header padded so the data starts aligned
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_HEADER_SIZE = 128  # fixed, so a streamed column's length can be filled in at the end
+TYPECODES = {"<i8": "q", "<i4": "i", "<f8": "d", "|i1": "b"}  # .npy dtype -> array typecode
+
+# result_kind column: how to turn the float64 result back into the stored value;
+# a TEXT result's stored value is its text in the manifest, whatever number the column holds
+FLOAT, INTEGER, TEXT = 0, 1, 2
+RESULT_KINDS = ("float", "integer", "text")
+
+
+def npy_header(dtype, length):
+    header = f"{{'descr': '{dtype}', 'fortran_order': False, 'shape': ({length},), }}"
+    header += " " * (NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class ColumnWriter:
+    """Streams one typed column into a .npy file; its length goes into the header on close."""
+
+    def __init__(self, path, dtype):
+        self.dtype = dtype
+        self.typecode = TYPECODES[dtype]
+        self.length = 0
+        self.values = array(self.typecode)
+        self.file = open(path, 'wb')
+        self.file.write(bytes(NPY_HEADER_SIZE))
+
+    def append(self, value):
+        self.values.append(value)
+        if len(self.values) >= 65536:
+            self.flush()
+
+    def flush(self):
+        if sys.byteorder == "big":
+            self.values.byteswap()  # .npy columns are little-endian
+        self.values.tofile(self.file)
+        self.length += len(self.values)
+        self.values = array(self.typecode)
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.length))
+        self.file.close()
+
+
+def read_column(path):
+    """A .npy column as a list (read through a memory map when NumPy is available)."""
+    if numpy is not None:
+        return numpy.load(path, mmap_mode='r').tolist()
+    with open(path, 'rb') as file:
+        if file.read(len(NPY_MAGIC)) != NPY_MAGIC:
+            raise ValueError(f"{path} is not a version 1.0 .npy file")
+        length, = struct.unpack("<H", file.read(2))
+        header = ast.literal_eval(file.read(length).decode("latin1"))
+        values = array(TYPECODES[header["descr"]])
+        values.frombytes(file.read())
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+
+def result_number(text):
+    # The float64 of a result text: its number when it parses ('13.40' -> 13.4), NaN otherwise
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def result_kind(value):
+    # Stored values are floats or ints when they print back as their text, strings otherwise
+    if value.__class__ is float:
+        return FLOAT
+    if value.__class__ is int and abs(value) < 2 ** 53:  # exact as a float64
+        return INTEGER
+    return TEXT
+
+
+def write_bundle(directory, records):
+    """Write the records as typed columns plus a manifest to directory; returns the record count.
+
+    Test names, units and statuses are dictionary-encoded int32 codes, times are
+    int64 epoch minutes (NO_TIME when missing), results float64 (NaN unless
+    numeric) and patient IDs int64. The few values those types cannot hold
+    exactly are kept as text in the manifest as well: results that are not
+    numeric or whose number prints differently ('13.40'), dates in
+    non-canonical spellings and patient IDs that are not 7 digits.
+    """
+    os.makedirs(directory, exist_ok=True)
+    dtypes = {"patient_id": "<i8", "record_id": "<i8", "test_name": "<i4", "unit": "<i4", "status": "<i4",
+              "result_value": "<f8", "result_kind": "|i1", "test_time": "<i8", "result_time": "<i8"}
+    writers = {name: ColumnWriter(os.path.join(directory, f"{name}.npy"), dtype) for name, dtype in dtypes.items()}
+    dictionaries = {"test_name": {}, "unit": {}, "status": {}}
+    patient_texts = {}  # patient IDs that are not 7 digits; stored as -1 - their position here
+    texts = {"result_value": {}, "test_date_time": {}, "result_date_time": {}}
+
+    (patient_ids, record_ids, test_names, units, statuses, values, kinds, test_times,
+     result_times) = (writers[name].append for name in dtypes)
+    names, unit_codes, status_codes = dictionaries["test_name"], dictionaries["unit"], dictionaries["status"]
+    position = 0
+    try:
+        for record in records:
+            patient_id = record.patient_id
+            if len(patient_id) == 7 and patient_id.isdigit():
+                patient_ids(int(patient_id))
+            else:
+                patient_ids(-1 - patient_texts.setdefault(patient_id, len(patient_texts)))
+            record_ids(record.record_id or 0)
+            test_names(names.setdefault(record.test_name, len(names)))
+            units(unit_codes.setdefault(record.unit, len(unit_codes)))
+            statuses(status_codes.setdefault(record.status, len(status_codes)))
+
+            value = record._value
+            kind = result_kind(value)
+            kinds(kind)
+            if kind == TEXT:
+                # The number still goes in the column, for anything reading it with NumPy
+                values(result_number(value))
+                texts["result_value"][position] = str(value)
+            else:
+                values(value)
+
+            test_times(NO_TIME if record.test_time is None else record.test_time)
+            result_times(NO_TIME if record.result_time is None else record.result_time)
+            if record._test_text is not None:
+                texts["test_date_time"][position] = record._test_text
+            if record._result_text is not None:
+                texts["result_date_time"][position] = record._result_text
+            position += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    columns = {name: {"file": f"{name}.npy", "dtype": dtype} for name, dtype in dtypes.items()}
+    columns["patient_id"]["texts"] = list(patient_texts)
+    for name, codes in dictionaries.items():
+        columns[name]["dictionary"] = list(codes)
+    columns["result_kind"]["kinds"] = list(RESULT_KINDS)
+    manifest = {
+        "format": BUNDLE_FORMAT, "version": BUNDLE_VERSION, "records": position,
+        "time_unit": "minutes since 1970-01-01 00:00", "missing_time": NO_TIME,
+        "columns": columns, "texts": texts
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as file:
+        json.dump(manifest, file, indent=1)
+    return position
+
+
+def read_bundle(directory):
+    """Yield one (patient_id, test_name, unit, status, value, test_time, result_time, test_text,
+    result_text) tuple per record of a bundle written by write_bundle, in TestRecord.restore() order.
+    """
+    with open(os.path.join(directory, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    if manifest.get("format") != BUNDLE_FORMAT or manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"{directory} is not a version {BUNDLE_VERSION} column bundle")
+    columns = manifest["columns"]
+    data = {name: read_column(os.path.join(directory, column["file"])) for name, column in columns.items()}
+    texts = {name: {int(position): text for position, text in values.items()}
+             for name, values in manifest["texts"].items()}
+
+    patient_texts = columns["patient_id"]["texts"]
+    names, units, statuses = (columns[name]["dictionary"] for name in ("test_name", "unit", "status"))
+    value_texts, test_texts, result_texts = texts["result_value"], texts["test_date_time"], texts["result_date_time"]
+    for position, (patient_id, name, unit, status, value, kind, test_time, result_time) in enumerate(zip(
+            data["patient_id"], data["test_name"], data["unit"], data["status"], data["result_value"],
+            data["result_kind"], data["test_time"], data["result_time"])):
+        if kind == INTEGER:
+            value = int(value)
+        elif kind == TEXT:
+            value = value_texts[position]
+        yield (
+            f"{patient_id:07d}" if patient_id >= 0 else patient_texts[-1 - patient_id],
+            names[name], units[unit], statuses[status], value,
+            None if test_time == NO_TIME else test_time,
+            None if result_time == NO_TIME else result_time,
+            test_texts.get(position), result_texts.get(position)
+        )
@@ -0,0 +1,156 @@
+import math
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; without it queries use the record indexes only
+    numpy = None
+
+from reports import TURNAROUND_BIN_EDGES, VALUE_BIN_EDGES, Distribution, TDigest
+
+HAVE_NUMPY = numpy is not None
+
+
+def parse_value(text):
+    # Non-numeric results become NaN, which fails every comparison
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class RecordColumns:
+    """NumPy column view of the loaded records, for vectorized filters and statistics.
+
+    Copied out of a RecordTable's columns, in test-time order: strings and
+    patient IDs keep the table's codes, times become float epoch minutes (-inf
+    for an unknown test time, NaN for a missing result time) and non-numeric
+    results are NaN.
+    """
+
+    def __init__(self, table, rows, no_time, version=None):
+        # rows: the table rows of the records, already in test-time order; no_time: the table's unknown time
+        self.table = table
+        self.rows = numpy.array(rows, numpy.int64)
+        self.version = version  # RecordIndex.version the view was built from
+        self.patient_codes = table.patient_codes
+        self.name_codes = self.status_codes = table.string_codes
+
+        def column(values, dtype):
+            return numpy.array(values, dtype)[self.rows]
+
+        self.patients = column(table.patients, numpy.int32)
+        self.names = column(table.names, numpy.int32)
+        self.statuses = column(table.statuses, numpy.int32)
+        self.values = column(table.values, numpy.float64)
+
+        test_times = column(table.test_times, numpy.int64)
+        self.test_times = test_times.astype(numpy.float64)
+        self.test_times[test_times == no_time] = -math.inf
+        result_times = column(table.result_times, numpy.int64)
+        self.result_times = result_times.astype(numpy.float64)
+        self.result_times[result_times == no_time] = math.nan
+        self.compute_turnaround()
+
+    def records(self, positions):
+        """The TestRecords at these positions of the view."""
+        return map(self.table.record, self.rows[positions].tolist())
+
+    def compute_turnaround(self):
+        # Minutes from test to result; NaN when either time is unknown
+        with numpy.errstate(invalid='ignore'):
+            self.turnaround = self.result_times - self.test_times
+        self.turnaround[~numpy.isfinite(self.turnaround)] = math.nan
+
+    def __len__(self):
+        return len(self.rows)
+
+    def range_arrays(self, test_ranges):
+        # Per test-name code: lower bound, upper bound and their inclusiveness (NaN = no bound)
+        size = len(self.name_codes)
+        low, high = numpy.full(size, math.nan), numpy.full(size, math.nan)
+        low_inclusive, high_inclusive = numpy.zeros(size, bool), numpy.zeros(size, bool)
+        for name, code in self.name_codes.items():
+            bounds = test_ranges.get(name)
+            if bounds is None:
+                continue
+            min_range, min_inclusive, max_range, max_inclusive = bounds
+            if min_range is not None:
+                low[code], low_inclusive[code] = min_range, min_inclusive
+            if max_range is not None:
+                high[code], high_inclusive[code] = max_range, max_inclusive
+        return low, low_inclusive, high, high_inclusive
+
+    def select(self, patient_id=None, test_name=None, status=None, start_time=None, end_time=None,
+               test_ranges=None, min_turnaround=None, max_turnaround=None):
+        """Positions of the records matching every given criterion, in test-time and record ID order;
+        test_ranges selects abnormal results."""
+        # In test-time order a date range is a slice
+        low, high = 0, len(self.rows)
+        if start_time is not None:
+            low = int(numpy.searchsorted(self.test_times, start_time, 'left'))
+            high = int(numpy.searchsorted(self.test_times, end_time, 'right'))
+        mask = numpy.ones(max(high - low, 0), bool)
+
+        for value, codes, column in ((patient_id, self.patient_codes, self.patients),
+                                     (test_name, self.name_codes, self.names),
+                                     (status, self.status_codes, self.statuses)):
+            if value is not None:
+                code = codes.get(value)
+                if code is None:
+                    return numpy.empty(0, numpy.intp)
+                mask &= column[low:high] == code
+
+        if test_ranges is not None:
+            range_low, low_inclusive, range_high, high_inclusive = self.range_arrays(test_ranges)
+            names, values = self.names[low:high], self.values[low:high]
+            bound = range_low[names]
+            below = numpy.where(low_inclusive[names], values < bound, values <= bound)
+            bound = range_high[names]
+            above = numpy.where(high_inclusive[names], values > bound, values >= bound)
+            mask &= below | above
+
+        # NaN (no result yet) fails both comparisons
+        if min_turnaround is not None:
+            mask &= self.turnaround[low:high] >= min_turnaround
+        if max_turnaround is not None:
+            mask &= self.turnaround[low:high] <= max_turnaround
+
+        return numpy.flatnonzero(mask) + low
+
+    def distribution(self, values, edges):
+        # A reports.Distribution filled by vectorized reductions, so a report gives the same
+        # kind of numbers (and the same t-digest quantile estimates) whichever path computed it
+        distribution = Distribution(edges)
+        values = numpy.sort(values[~numpy.isnan(values)])
+        count = len(values)
+        if count:
+            stats = distribution.stats
+            stats.count, stats.minimum, stats.maximum = count, float(values[0]), float(values[-1])
+            stats.mean = float(values.mean())
+            stats.m2 = float(((values - stats.mean) ** 2).sum())
+
+            # t-digest centroids in one go: the sorted values are cut where the arcsine scale of
+            # TDigest.compress() crosses a whole unit
+            digest = distribution.digest
+            scale = digest.compression / (2 * math.pi)
+            cuts = numpy.floor(scale * numpy.arcsin(2 * (numpy.arange(count) + 0.5) / count - 1)).astype(numpy.int64)
+            cuts -= cuts[0]
+            weights = numpy.bincount(cuts)
+            sums = numpy.bincount(cuts, values)
+            used = weights > 0
+            distribution.digest = TDigest.from_centroids((sums[used] / weights[used]).tolist(),
+                                                         weights[used].tolist(), stats.minimum, stats.maximum,
+                                                         digest.compression)
+        counts = numpy.bincount(numpy.searchsorted(numpy.asarray(edges, numpy.float64), values, 'right'),
+                                minlength=len(edges) + 1)
+        distribution.histogram.counts = counts.tolist()
+        return distribution.as_dict()
+
+    def statistics(self, positions, value_edges=VALUE_BIN_EDGES, turnaround_edges=TURNAROUND_BIN_EDGES):
+        """Summary row for the selected records, shaped like a GroupedReport row without grouping."""
+        return {
+            "group": {},
+            "records": len(positions),
+            "result_value": self.distribution(self.values[positions], value_edges),
+            "turnaround": self.distribution(self.turnaround[positions], turnaround_edges)
+        }
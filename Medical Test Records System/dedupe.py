@@ -0,0 +1,155 @@
+import hashlib
+import heapq
+import math
+import os
+import struct
+import tempfile
+from array import array
+
+DUPLICATE_POLICIES = ("count", "skip", "reject")
+DEDUPE_MAX_ENTRIES = 1000000  # content digests the file job keeps in memory at once
+DIGEST_SIZE = 16
+PARTITION_ENTRY = struct.Struct(f"<{DIGEST_SIZE}sQ")  # (content digest, line number)
+MIN_LINE_BYTES = 40  # shortest plausible record line, to over- rather than underestimate the line count
+
+
+def content_digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+class DuplicateIndex:
+    """Content hashes of the loaded records, counting how many records share each content.
+
+    A hash only says a record may be a duplicate; callers confirm a hit by
+    comparing the contents of that patient's records.
+    """
+
+    def __init__(self, key):
+        self.key = key        # record -> content tuple; equal tuples mean duplicate records
+        self.counts = {}      # hash of a content -> loaded records with it
+        self.duplicates = 0   # records beyond the first with their content
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, record):
+        return hash(self.key(record)) in self.counts
+
+    def add(self, record):
+        content = hash(self.key(record))
+        count = self.counts.get(content, 0)
+        self.counts[content] = count + 1
+        if count:
+            self.duplicates += 1
+
+    def add_many(self, records):
+        counts = self.counts
+        for content in map(hash, map(self.key, records)):
+            count = counts.get(content, 0)
+            counts[content] = count + 1
+            if count:
+                self.duplicates += 1
+
+    def remove(self, record):
+        content = hash(self.key(record))
+        count = self.counts.get(content)
+        if count is None:
+            return
+        if count == 1:
+            del self.counts[content]
+        else:
+            self.counts[content] = count - 1
+            self.duplicates -= 1
+
+    def clear(self):
+        self.counts = {}
+        self.duplicates = 0
+
+
+def dedupe_file(source, target, content, max_entries=DEDUPE_MAX_ENTRIES):
+    """Copy source to target without the lines whose content appeared earlier in the file.
+
+    content(line) gives the text to compare, or None for a line that is copied
+    as is. The first copy of each line is kept, in file order. Files too large to
+    hold max_entries digests in memory are split by digest into temporary
+    partitions that are deduplicated one at a time. Returns (kept, dropped).
+    """
+    partitions = math.ceil(os.path.getsize(source) / MIN_LINE_BYTES / max_entries)
+    if partitions <= 1:
+        return dedupe_in_memory(source, target, content)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(target))) as work:
+        # Pass 1: spread (digest, line number) over the partitions by digest
+        files = [open(os.path.join(work, f"{number}.part"), 'wb') for number in range(partitions)]
+        try:
+            with open(source, 'r') as file:
+                for line_number, line in enumerate(file):
+                    text = content(line)
+                    if text is not None:
+                        digest = content_digest(text)
+                        files[int.from_bytes(digest[:8], 'little') % partitions].write(
+                            PARTITION_ENTRY.pack(digest, line_number))
+        finally:
+            for part in files:
+                part.close()
+
+        # Pass 2: each partition holds every copy of its contents, so it can be deduplicated alone;
+        # the line numbers of the later copies come out ascending
+        duplicate_files = []
+        for number in range(partitions):
+            seen, duplicates = set(), array('Q')
+            with open(os.path.join(work, f"{number}.part"), 'rb') as part:
+                for digest, line_number in PARTITION_ENTRY.iter_unpack(part.read()):
+                    if digest in seen:
+                        duplicates.append(line_number)
+                    else:
+                        seen.add(digest)
+            os.remove(part.name)
+            duplicate_files.append(os.path.join(work, f"{number}.dup"))
+            with open(duplicate_files[-1], 'wb') as file:
+                duplicates.tofile(file)
+
+        # Pass 3: copy the file, skipping the duplicate line numbers merged from every partition
+        dropped = heapq.merge(*map(read_line_numbers, duplicate_files))
+        next_dropped = next(dropped, None)
+        kept = removed = 0
+        with open(source, 'r') as file, open(target, 'w') as output:
+            for line_number, line in enumerate(file):
+                if line_number == next_dropped:
+                    next_dropped = next(dropped, None)
+                    removed += 1
+                    continue
+                output.write(line)
+                kept += 1
+        return kept, removed
+
+
+def dedupe_in_memory(source, target, content):
+    seen = set()
+    kept = removed = 0
+    with open(source, 'r') as file, open(target, 'w') as output:
+        for line in file:
+            text = content(line)
+            if text is not None:
+                digest = content_digest(text)
+                if digest in seen:
+                    removed += 1
+                    continue
+                seen.add(digest)
+            output.write(line)
+            kept += 1
+    return kept, removed
+
+
+def read_line_numbers(path, batch=65536):
+    # Stream one partition's duplicate line numbers without reading the whole file
+    with open(path, 'rb') as file:
+        while True:
+            numbers = array('Q')
+            try:
+                numbers.fromfile(file, batch)
+            except EOFError:
+                pass  # the last, partial batch
+            if not numbers:
+                return
+            yield from numbers
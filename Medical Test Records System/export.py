@@ -0,0 +1,136 @@
+import gzip
+import heapq
+import itertools
+import os
+import tempfile
+
+try:
+    import bz2
+except ImportError:  # Python builds without libbz2 still export uncompressed or with gzip
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+EXPORT_HEADER = "Patient ID,Test Name,Test Date and Time,Result Value,Unit,Status,Result Date and Time\n"
+EXPORT_BATCH_LINES = 10000  # lines formatted and written at a time, about 700 KB
+SORT_RUN_ITEMS = 200000  # items sorted in memory at a time before a run spills to a temporary file
+
+# Standard library codecs by name: (file extension, open for binary writing)
+COMPRESSIONS = {"gzip": (".gz", lambda path: gzip.open(path, 'wb', compresslevel=6))}
+if bz2 is not None:
+    COMPRESSIONS["bz2"] = (".bz2", lambda path: bz2.open(path, 'wb'))
+if lzma is not None:
+    COMPRESSIONS["xz"] = (".xz", lambda path: lzma.open(path, 'wb'))
+
+
+def compression_for(filename):
+    # The codec the file extension names, or None for plain text
+    for name, (extension, _) in COMPRESSIONS.items():
+        if filename.endswith(extension):
+            return name
+    return None
+
+
+def sorted_in_runs(items, key, dump, load, run_size=SORT_RUN_ITEMS):
+    """Yield items sorted by key, holding at most about two runs of run_size items in memory.
+
+    Every full run is sorted and spilled to a temporary file, one dump(item) line
+    per item, and the runs are merged back with load(line); items that fit in one
+    run are sorted in memory and yielded as they are.
+    """
+    items = iter(items)
+    run = sorted(itertools.islice(items, run_size), key=key)
+    runs = []
+    try:
+        while True:
+            following = sorted(itertools.islice(items, run_size), key=key)
+            if not following:
+                break
+            file = tempfile.TemporaryFile('w+', encoding='utf-8')
+            runs.append(file)
+            file.writelines(dump(item) + '\n' for item in run)
+            file.seek(0)
+            run = following
+        spilled = ((load(line.rstrip('\n')) for line in file) for file in runs)
+        yield from heapq.merge(*spilled, run, key=key)
+    finally:
+        for file in runs:
+            file.close()
+
+
+def part_name(filename, number):
+    # export.csv.gz -> export.0001.csv.gz
+    directory, name = os.path.split(filename)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, f"{stem}.{number:04d}{dot}{extensions}")
+
+
+class ExportWriter:
+    """Writes export lines to one file, or to numbered part files of part_records lines each.
+
+    Lines are joined and written EXPORT_BATCH_LINES at a time, through a
+    standard library codec when compression is set ('gzip', 'bz2' or 'xz').
+    Every file starts with the header, so each part can be read on its own.
+    """
+
+    def __init__(self, filename, compression=None, part_records=None, header=EXPORT_HEADER):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}; use one of: {', '.join(COMPRESSIONS)}")
+        self.filename = filename
+        self.compression = compression
+        self.part_records = part_records
+        self.header = header.encode()
+        self.file = None
+        self.in_part = 0   # lines in the current file
+        self.files = []    # names of the files written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open_part(self):
+        name = self.filename
+        if self.part_records:
+            name = part_name(self.filename, len(self.files) + 1)
+        if self.compression is None:
+            self.file = open(name, 'wb')
+        else:
+            self.file = COMPRESSIONS[self.compression][1](name)
+        self.files.append(name)
+        self.file.write(self.header)
+        self.in_part = 0
+
+    def close_part(self):
+        self.file.close()
+        self.file = None
+        self.in_part = 0
+
+    def write(self, lines):
+        """Write an iterable of newline-terminated lines; returns how many were written."""
+        lines = iter(lines)
+        written = 0
+        while True:
+            size = EXPORT_BATCH_LINES
+            if self.part_records:
+                size = min(size, self.part_records - self.in_part)
+            batch = list(itertools.islice(lines, size))
+            if not batch:
+                return written
+            if self.file is None:
+                self.open_part()
+            self.file.write(''.join(batch).encode())
+            self.in_part += len(batch)
+            written += len(batch)
+            if self.part_records and self.in_part >= self.part_records:
+                self.close_part()
+
+    def close(self):
+        # An export without records still gets its file with the header
+        if self.file is None and not self.files:
+            self.open_part()
+        if self.file is not None:
+            self.close_part()
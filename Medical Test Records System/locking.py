@@ -0,0 +1,123 @@
+import contextlib
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+LOCK_STATE = struct.Struct("<QQQQ")  # generation, version, next free record ID, journal end
+OLD_LOCK_STATE = struct.Struct("<QQQ")  # lock files written before the journal end was kept
+JOURNAL_END_UNKNOWN = 2 ** 64 - 1
+
+
+class DatasetLock:
+    """Advisory lock and change counters shared by the processes using one dataset.
+
+    The lock file holds the record file generation (bumped when it is
+    rewritten), the version (bumped by every commit), the next free record
+    ID and where the journal ended after the last commit. Writers hold the exclusive lock only while committing and loads hold
+    the shared one, so nobody waits longer than one commit. Without fcntl
+    (Windows) both modes take msvcrt's exclusive lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.depth = 0         # nested acquisitions by this process
+        self.exclusive = False
+
+    def open(self):
+        if self.file is None:
+            # Opened once and kept: closing any descriptor of the file would drop an fcntl lock
+            self.file = open(self.path, 'a+b')
+
+    def close(self):
+        if self.file is not None and not self.depth:
+            self.file.close()
+            self.file = None
+
+    def acquire(self, exclusive):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        elif msvcrt is not None:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    return
+                except OSError:
+                    pass  # LK_LOCK gives up after about 10 seconds; keep waiting
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextlib.contextmanager
+    def hold(self, exclusive):
+        self.open()
+        if self.depth == 0:
+            self.acquire(exclusive)
+            self.exclusive = exclusive or fcntl is None
+        elif exclusive and not self.exclusive:
+            # Upgrading is not atomic with flock: another writer may commit in between
+            self.acquire(True)
+            self.exclusive = True
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+                self.acquire(False)
+                self.exclusive = False
+            return
+
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.release()
+                self.exclusive = False
+
+    def shared(self):
+        return self.hold(False)
+
+    def locked(self):
+        return self.hold(True)
+
+    def read_state(self):
+        """[generation, version, next record ID, journal end]; zeros for a new lock file.
+
+        The journal end of an older lock file is JOURNAL_END_UNKNOWN. Call while holding the lock.
+        """
+        self.file.seek(0)
+        data = self.file.read(LOCK_STATE.size)
+        if len(data) == LOCK_STATE.size:
+            return list(LOCK_STATE.unpack(data))
+        if len(data) == OLD_LOCK_STATE.size:
+            return list(OLD_LOCK_STATE.unpack(data)) + [JOURNAL_END_UNKNOWN]
+        return [0, 0, 0, 0]
+
+    def write_state(self, state, sync=False):
+        """Store the counters; call while holding the exclusive lock.
+
+        Only record ID reservations need sync: a lost reservation would hand IDs
+        out twice, while the versions only matter to processes that a system
+        crash ends anyway.
+        """
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(LOCK_STATE.pack(*state))
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
@@ -0,0 +1,3893 @@
+import bisect
+import contextlib
+import copy
+import functools
+import gc
+import hashlib
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from _datetime import datetime, date
+
+from columnar import read_bundle, write_bundle
+from columns import HAVE_NUMPY, RecordColumns, parse_value
+from dedupe import DEDUPE_MAX_ENTRIES, DUPLICATE_POLICIES, DuplicateIndex, dedupe_file
+from export import ExportWriter, compression_for, sorted_in_runs
+from locking import DatasetLock
+from query import QUERY_DEFAULTS, Query, compile_matcher
+from query_cache import MISSING, QueryCache
+from reports import GroupedReport
+from shards import map_shards, shard_files, shard_of, stored_shard_count
+from snapshot import read_sections, write_sections
+from sla import SlaMonitor
+from storage import STORAGE_ENGINES, RecordStore, SqliteRecordStore, storage_for
+
+VALID_STATUSES = ("Pending", "Completed", "Reviewed")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Binary snapshot cache: header (magic, source size, source mtime, source
+# digest) followed by fixed-layout column and index sections (see snapshot.py)
+SNAPSHOT_MAGIC = b"MTRSNAP4"
+SNAPSHOT_HEADER = struct.Struct("<8sQQ16s")
+NO_TIME = -2 ** 63  # stands for None in the int64 time columns
+VALUE_FLOAT, VALUE_INT, VALUE_OTHER = 0, 1, 2  # how a stored result reads back (RecordTable.kinds)
+
+# Patient offset index for lazy loading, keyed like the snapshot cache
+OFFSET_INDEX_MAGIC = b"MTRIDX04"
+
+# Records added since the date order was last used are inserted one by one up to this many, else merged in
+DATE_INSERT_MAX = 64
+ID_ARRAY_SLACK = 1 << 20  # record IDs the ID index covers beyond twice the record count
+ROW_TYPE = 'i'  # typecode of the arrays of rows and positions: 4 bytes each, for up to 2**31 - 1 records
+
+# Queries whose best index still leaves this many candidates use the NumPy column view,
+# or without it the worker processes when more than one query worker is configured
+COLUMN_SCAN_MIN = 20000
+SHARD_SCAN_MIN = 100000
+RECORD_ID_BLOCK = 100  # record IDs a process reserves from the shared counter at a time
+JOURNAL_ENTRY_BYTES = 64  # rough size of a journal entry, to turn entry counts into journal sizes
+
+
+class ConflictError(RuntimeError):
+    """Raised when a batch is not saved because another process changed the same records first."""
+
+
+@functools.lru_cache(maxsize=65536)
+def epoch_days(day_text):
+    # Dates repeat across many records, so each distinct day is converted once
+    year, month, day = day_text.split('-')
+    if not (year.isdigit() and month.isdigit() and day.isdigit()):
+        raise ValueError(day_text)
+    return date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+
+
+def to_epoch_minutes(date_time_str):
+    """Parse 'YYYY-MM-DD HH:MM' (zero padding optional) into minutes since 1970-01-01, or None."""
+    if not date_time_str:
+        return None
+    try:
+        day_part, time_part = date_time_str.strip().split(' ')
+        hour, minute = time_part.split(':')
+        if not (hour.isdigit() and minute.isdigit()):
+            return None
+        hour, minute = int(hour), int(minute)
+        if hour > 23 or minute > 59:
+            return None
+        return (epoch_days(day_part) * 24 + hour) * 60 + minute
+    except ValueError:
+        return None
+
+
+def now_minutes():
+    # The current local time in epoch minutes, comparable with the record times
+    now = datetime.now()
+    return ((now.toordinal() - EPOCH_ORDINAL) * 24 + now.hour) * 60 + now.minute
+
+
+def turnaround_minutes(text):
+    # Catalog turnaround 'DD-hh-mm' in minutes, or None when malformed
+    try:
+        days, hours, minutes = (int(part) for part in text.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    return (days * 24 + hours) * 60 + minutes
+
+
+def is_canonical_date_time(text):
+    # True for exactly 'YYYY-MM-DD HH:MM'; only call this on text that parsed
+    return len(text) == 16 and text[4] == '-' and text[7] == '-' and text[10] == ' ' and text[13] == ':'
+
+
+def date_range_minutes(start_date, end_date):
+    # 'YYYY-MM-DD' bounds cover the whole of both days; full timestamps are used as given
+    start = to_epoch_minutes(start_date if ' ' in start_date.strip() else start_date + ' 00:00')
+    end = to_epoch_minutes(end_date if ' ' in end_date.strip() else end_date + ' 23:59')
+    return start, end
+
+
+###############################################################
+# Validation rules, kept at module level so import worker processes can use them
+
+def is_valid_patient_id(patient_id):
+    return len(patient_id) == 7 and patient_id.isdigit()
+
+
+def is_numeric(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def date_time_error(date_time_str):
+    """Return why the 'YYYY-MM-DD HH:MM' text is invalid, or None when it is valid."""
+    # Check if the input is in the correct format
+    if len(date_time_str) != 16 or date_time_str[10] != ' ' or date_time_str[13] != ':':
+        return "Invalid Date and Time format. Please use YYYY-MM-DD HH:MM."
+
+    # Extract year, month, day, hour, minute from the input
+    try:
+        year = int(date_time_str[:4])
+        month = int(date_time_str[5:7])
+        day = int(date_time_str[8:10])
+        hour = int(date_time_str[11:13])
+        minute = int(date_time_str[14:16])
+    except ValueError:
+        return "Invalid Date and Time format. Please use YYYY-MM-DD HH:MM."
+
+    # Validate year (basic check)
+    if year < 1:
+        return "Invalid Date and Time. The year must be a positive number."
+
+    # Validate month
+    if month < 1 or month > 12:
+        return "Invalid Date and Time. The month must be between 01 and 12."
+
+    # Validate day (taking into account the maximum days in a month)
+    days_in_month = [31, 29 if (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)) else 28, 31, 30, 31, 30,
+                     31, 31, 30, 31, 30, 31]
+    if day < 1 or day > days_in_month[month - 1]:
+        return "Invalid Date and Time. The day must be valid for the given month."
+
+    # Validate hour
+    if hour < 0 or hour > 23:
+        return "Invalid Date and Time. The hour must be between 00 and 23."
+
+    # Validate minute
+    if minute < 0 or minute > 59:
+        return "Invalid Date and Time. The minute must be between 00 and 59."
+
+    try:
+        # Parse the input date and time to check format and validity
+        input_date_time = datetime.strptime(date_time_str, "%Y-%m-%d %H:%M")
+
+        # Check if the date is in the future
+        if input_date_time > datetime.now():
+            return "Invalid Date and Time. The date cannot be in the future."
+
+        # If all validations pass, there is no error
+        return None
+
+    except ValueError:
+        return "Invalid Date and Time. Please use a valid date in the format YYYY-MM-DD HH:MM."
+
+
+def validate_import_row(line, valid_statuses):
+    """Check one 'ID,name,date,value,unit,status,result date' line.
+
+    Returns (fields, None) for a valid row, or (None, reason) for a rejected one.
+    The status may be in any case; the fields have its valid spelling.
+    """
+    row = [field.strip() for field in line.strip().split(',')]
+
+    # Ensure that there are exactly the expected fields in the row
+    if len(row) != 7:
+        return None, f"Expected 7 fields, found {len(row)}"
+
+    patient_id, test_name, test_date_time, result_value, unit, status, result_date_time = row
+    if not is_valid_patient_id(patient_id):
+        return None, "Invalid Patient ID. It should be exactly 7 digits."
+    if not test_name:
+        return None, "Invalid Test Name. It cannot be empty."
+    error = date_time_error(test_date_time)
+    if error:
+        return None, f"Test date: {error}"
+    if not is_numeric(result_value):
+        return None, "Invalid Result Value. It should be a numeric value."
+    if not unit:
+        return None, "Invalid Results Unit. It cannot be empty."
+    status = next((valid for valid in valid_statuses if valid.lower() == status.lower()), None)
+    if status is None:
+        return None, f"Invalid Status. It should be one of {', '.join(repr(s) for s in valid_statuses)}."
+    if result_date_time:
+        error = date_time_error(result_date_time)
+        if error:
+            return None, f"Result date: {error}"
+    return (patient_id, test_name, test_date_time, result_value, unit, status, result_date_time or None), None
+
+
+def validate_import_chunk(lines, valid_statuses):
+    # Runs in a worker process; plain tuples keep the pickled results small
+    return [validate_import_row(line, valid_statuses) for line in lines]
+
+
+###############################################################
+# The system a sharded query runs on and the candidate records its plan
+# picked; forked pool workers inherit them instead of receiving the records
+shard_system = None
+shard_candidates = None
+
+
+def run_shard(start, stop, query, group_by=None):
+    """Evaluate a planned query on the candidates from start to stop in a pool worker.
+
+    Returns the positions of the matching candidates for a filter, or the
+    slice's GroupedReport when group_by is given.
+    """
+    matches = shard_system.record_matcher(**query)
+    if group_by is not None:
+        report = GroupedReport(group_by)
+        for record in filter(matches, itertools.islice(shard_candidates, start, stop)):
+            report.add(record)
+        return report
+    return [position for position in range(start, stop) if matches(shard_candidates[position])]
+
+
+@contextlib.contextmanager
+def paused_gc():
+    """Suspend the cyclic garbage collector while creating many acyclic objects."""
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def durable_replace(temp_file, target):
+    """Rename temp_file over target once its data is on disk, so a crash leaves the old or the new file."""
+    with open(temp_file, 'rb') as file:
+        os.fsync(file.fileno())
+    os.replace(temp_file, target)
+    # Make the rename itself durable where directories can be synced (not on Windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        directory = os.open(os.path.dirname(os.path.abspath(target)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+def file_identity(path):
+    # (device, inode, size, mtime) tell an append (same file, larger) from a rewrite; None if missing
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def journal_block(entries):
+    # Several entries are framed as a block, applied on replay only if it was written completely
+    return "B\n" + ''.join(entry + '\n' for entry in entries) + journal_block_end(entries) + '\n'
+
+
+def journal_block_end(entries):
+    body = ''.join(entry + '\n' for entry in entries)
+    return f"E\t{len(entries)}\t{zlib.crc32(body.encode())}"
+
+
+@functools.lru_cache(maxsize=65536)
+def day_text(epoch_day):
+    # The inverse of epoch_days, cached the same way
+    day = date.fromordinal(EPOCH_ORDINAL + epoch_day)
+    return f"{day.year:04d}-{day.month:02d}-{day.day:02d}"
+
+
+MINUTE_TEXTS = tuple(f"{hour:02d}:{minute:02d}" for hour in range(24) for minute in range(60))
+
+
+def format_minutes(minutes):
+    """Inverse of to_epoch_minutes, giving the zero-padded 'YYYY-MM-DD HH:MM' text."""
+    days, minute_of_day = divmod(minutes, 1440)
+    return f"{day_text(days)} {MINUTE_TEXTS[minute_of_day]}"
+
+
+def compact_number(text):
+    # Keep numbers as int/float when that converts back to the exact same text
+    try:
+        number = float(text) if '.' in text else int(text)
+    except (TypeError, ValueError):
+        return text
+    return number if str(number) == text else text
+
+
+def split_record_id(text):
+    """Split the trailing ' #<id>' off a record line: (rest of the line, record ID or None)."""
+    head, marker, tail = text.rpartition(' #')
+    if marker and tail.isdigit():
+        return head, int(tail)
+    return text, None  # written before records had IDs
+
+
+def record_content(line):
+    # What the deduplication compares: the line without its record ID, or None for a blank line
+    line = line.strip()
+    return split_record_id(line)[0] if line else None
+
+
+def time_key(record):
+    # Sort key of a record by test time; records whose time cannot be parsed come first
+    return record.test_time if record.test_time is not None else NO_TIME
+
+
+def bucket_positions(codes, count):
+    # Positions of each code in a dictionary-encoded column, in position order
+    buckets = [array(ROW_TYPE) for _ in range(count)]
+    for position, code in enumerate(codes):
+        buckets[code].append(position)
+    return buckets
+
+
+def split_buckets(keys, counts, positions):
+    # Inverse of bucket_positions() concatenated: key -> array of positions
+    buckets, start = {}, 0
+    for key, count in zip(keys, counts):
+        if count:
+            buckets[key] = positions[start:start + count]
+        start += count
+    return buckets
+
+
+def in_record_order(records):
+    # Records sorted by test time, as a patient keeps them, in full result order:
+    # only records tested at the same time are sorted, by record ID
+    for _, tied in itertools.groupby(records, key=time_key):
+        tied = list(tied)
+        if len(tied) > 1:
+            tied.sort(key=record_order)
+        yield from tied
+
+
+def record_order(record):
+    # The order query results come in: by test time, then by record ID
+    return time_key(record), record.record_id or 0
+
+
+def record_fields(patient_id, test_name, test_date_time, result_value, unit, status, result_date_time=None,
+                  record_id=None):
+    """A record's fields in TestRecord.restore() order, with the times parsed once.
+
+    Timestamps are kept as epoch minutes; the original text is kept only when
+    it differs from the zero-padded form (e.g. '2024-03-2 07:30').
+    """
+    test_time = to_epoch_minutes(test_date_time)
+    result_time = to_epoch_minutes(result_date_time) if result_date_time else None
+    # Names, units and statuses repeat across millions of rows, so share one copy
+    return [patient_id, sys.intern(test_name), sys.intern(unit), sys.intern(status), compact_number(result_value),
+            test_time, result_time,
+            None if test_time is not None and is_canonical_date_time(test_date_time) else test_date_time,
+            None if result_time is not None and is_canonical_date_time(result_date_time) else result_date_time or None,
+            record_id]
+
+
+class RecordTable:
+    """Records stored column by column, one typed array per field; a record is a row.
+
+    Test names, units and statuses are interned once in a string table and
+    stored as 4-byte codes, and patient IDs likewise. Results are float64 with
+    a kind byte saying whether they read back as a float or an int; times and
+    record IDs are int64, with NO_TIME and 0 for none. What a column cannot
+    hold exactly (a result that is not a number, a date not in zero-padded
+    form) is kept in a dict by row. A row takes about 50 bytes, where a record
+    object with its field objects took several hundred.
+
+    Rows never move, so a TestRecord can point at its row. A deleted record's
+    row is released and filled again by a later record.
+    """
+
+    def __init__(self):
+        self.patient_ids = []         # patient code -> patient ID
+        self.patient_codes = {}       # patient ID -> patient code
+        self.strings = []             # code -> test name, unit or status
+        self.string_codes = {}        # test name, unit or status -> code
+        self.patients = array('i')    # per row: patient code
+        self.names = array('i')       # test name code
+        self.units = array('i')       # unit code
+        self.statuses = array('i')    # status code
+        self.values = array('d')      # the result as a number, NaN when it is not one
+        self.kinds = array('b')       # VALUE_FLOAT, VALUE_INT or VALUE_OTHER: how the result reads back
+        self.other_values = {}        # row -> result kept as given, for VALUE_OTHER
+        self.test_times = array('q')  # epoch minutes, NO_TIME for none
+        self.result_times = array('q')
+        self.record_ids = array('q')  # 0 for none
+        self.test_texts = {}          # row -> test date text, when not in zero-padded form
+        self.result_texts = {}        # row -> result date text, likewise
+        self.free = set()             # released rows, filled again before the table grows
+
+    def __len__(self):
+        return len(self.names)
+
+    def code(self, text):
+        code = self.string_codes.get(text)
+        if code is None:
+            text = sys.intern(text)
+            code = self.string_codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+
+    def patient_code(self, patient_id):
+        code = self.patient_codes.get(patient_id)
+        if code is None:
+            code = self.patient_codes[patient_id] = len(self.patient_ids)
+            self.patient_ids.append(patient_id)
+        return code
+
+    def append(self, fields):
+        """Store a record's fields, in TestRecord.restore() order, in a released row or a new one; returns the row."""
+        if self.free:
+            row = self.free.pop()
+            self.write(row, fields)
+            return row
+        patient_id, test_name, unit, status, value, test_time, result_time, test_text, result_text, record_id = fields
+        row = len(self.names)
+        self.patients.append(self.patient_code(patient_id))
+        self.names.append(self.code(test_name))
+        self.units.append(self.code(unit))
+        self.statuses.append(self.code(status))
+        if value.__class__ is float:
+            self.values.append(value)
+            self.kinds.append(VALUE_FLOAT)
+        else:
+            self.values.append(0.0)
+            self.kinds.append(VALUE_FLOAT)
+            self.set_value(row, value)
+        self.test_times.append(NO_TIME if test_time is None else test_time)
+        self.result_times.append(NO_TIME if result_time is None else result_time)
+        self.record_ids.append(record_id or 0)
+        if test_text is not None:
+            self.test_texts[row] = test_text
+        if result_text is not None:
+            self.result_texts[row] = result_text
+        return row
+
+    def write(self, row, fields):
+        # Overwrite every field of a row
+        patient_id, test_name, unit, status, value, test_time, result_time, test_text, result_text, record_id = fields
+        self.patients[row] = self.patient_code(patient_id)
+        self.names[row] = self.code(test_name)
+        self.units[row] = self.code(unit)
+        self.statuses[row] = self.code(status)
+        self.set_value(row, value)
+        self.test_times[row] = NO_TIME if test_time is None else test_time
+        self.result_times[row] = NO_TIME if result_time is None else result_time
+        self.record_ids[row] = record_id or 0
+        set_text(self.test_texts, row, test_text)
+        set_text(self.result_texts, row, result_text)
+
+    def extend(self, other):
+        """Add every row of another table; returns the rows they got here, in the other table's row order."""
+        if self.free:
+            return array(ROW_TYPE, map(self.append, map(other.fields, range(len(other)))))
+        start = len(self.names)
+        strings = list(map(self.code, other.strings))
+        patients = list(map(self.patient_code, other.patient_ids))
+        self.patients.extend(map(patients.__getitem__, other.patients))
+        for column, codes in ((self.names, other.names), (self.units, other.units), (self.statuses, other.statuses)):
+            column.extend(map(strings.__getitem__, codes))
+        for column, values in ((self.values, other.values), (self.kinds, other.kinds),
+                               (self.test_times, other.test_times), (self.result_times, other.result_times),
+                               (self.record_ids, other.record_ids)):
+            column.extend(values)
+        for texts, other_texts in ((self.other_values, other.other_values), (self.test_texts, other.test_texts),
+                                   (self.result_texts, other.result_texts)):
+            texts.update((row + start, text) for row, text in other_texts.items())
+        return range(start, len(self.names))
+
+    def release(self, rows):
+        """Mark rows whose records were deleted as free to fill again."""
+        self.free.update(rows)
+
+    def set_value(self, row, value):
+        # value as compact_number() gives it: a float, an int, or text
+        if value.__class__ is float:
+            self.values[row], self.kinds[row] = value, VALUE_FLOAT
+        elif value.__class__ is int and abs(value) < 2 ** 53:  # exact as a float
+            self.values[row], self.kinds[row] = value, VALUE_INT
+        else:
+            self.values[row], self.kinds[row] = parse_value(value), VALUE_OTHER
+            self.other_values[row] = value
+            return
+        if self.other_values:
+            self.other_values.pop(row, None)
+
+    def value(self, row):
+        kind = self.kinds[row]
+        if kind == VALUE_FLOAT:
+            return self.values[row]
+        return int(self.values[row]) if kind == VALUE_INT else self.other_values[row]
+
+    def fields(self, row):
+        """The row's fields in TestRecord.restore() order."""
+        test_time, result_time = self.test_times[row], self.result_times[row]
+        return (self.patient_ids[self.patients[row]], self.strings[self.names[row]], self.strings[self.units[row]],
+                self.strings[self.statuses[row]], self.value(row), None if test_time == NO_TIME else test_time,
+                None if result_time == NO_TIME else result_time, self.test_texts.get(row),
+                self.result_texts.get(row), self.record_ids[row] or None)
+
+    def record(self, row):
+        """The TestRecord of a row."""
+        record = TestRecord.__new__(TestRecord)
+        record._table, record._row, record._fields = self, row, None
+        return record
+
+    def records(self, rows):
+        return list(map(self.record, rows))
+
+
+def set_text(texts, row, text):
+    # Keep a row's text in one of the sparse text dicts, or drop it for None
+    if text is None:
+        texts.pop(row, None)
+    else:
+        texts[row] = text
+
+
+def coded_field(index, column):
+    """A TestRecord property for a field stored as a code into RecordTable.strings."""
+
+    def get(record):
+        table = record._table
+        if table is None:
+            return record._fields[index]
+        return table.strings[getattr(table, column)[record._row]]
+
+    def set(record, text):
+        table = record._table
+        if table is None:
+            record._fields[index] = sys.intern(text)
+        else:
+            getattr(table, column)[record._row] = table.code(text)
+
+    return property(get, set)
+
+
+def time_field(index, column):
+    """A TestRecord property for an epoch-minute time, None when unknown."""
+
+    def get(record):
+        table = record._table
+        if table is None:
+            return record._fields[index]
+        time = getattr(table, column)[record._row]
+        return None if time == NO_TIME else time
+
+    def set(record, time):
+        table = record._table
+        if table is None:
+            record._fields[index] = time
+        else:
+            getattr(table, column)[record._row] = NO_TIME if time is None else time
+
+    return property(get, set)
+
+
+def text_field(index, column):
+    """A TestRecord property for a text kept in one of the RecordTable dicts by row, None for none."""
+
+    def get(record):
+        table = record._table
+        if table is None:
+            return record._fields[index]
+        return getattr(table, column).get(record._row)
+
+    def set(record, text):
+        table = record._table
+        if table is None:
+            record._fields[index] = text
+        else:
+            set_text(getattr(table, column), record._row, text)
+
+    return property(get, set)
+
+
+class TestRecord:
+    """One test result, readable like the old record dicts.
+
+    A record added to a patient is a view of its row in a RecordTable and
+    holds nothing else; a record built on its own (or read from a database
+    row) keeps its fields in a list until a patient adds it, which moves them
+    into the patient's table. Two views of the same row are the same record.
+    """
+
+    __slots__ = ('_table', '_row', '_fields')
+
+    FIELDS = ('test_name', 'test_date_time', 'result_value', 'unit', 'status', 'result_date_time')
+    DERIVED_FIELDS = ('patient_id', 'test_time', 'result_time', 'turnaround', 'record_id')  # readable, not settable
+
+    @classmethod
+    def restore(cls, patient_id, test_name, unit, status, value, test_time, result_time, test_text, result_text,
+                record_id=None):
+        """Rebuild a record from already-parsed fields, as stored in the snapshot cache."""
+        record = cls.__new__(cls)
+        record._table, record._row = None, -1
+        record._fields = [patient_id, test_name, unit, status, value, test_time, result_time, test_text,
+                          result_text, record_id]
+        return record
+
+    def __init__(self, patient_id, test_name, test_date_time, result_value, unit, status, result_date_time=None,
+                 record_id=None):
+        self._table, self._row = None, -1
+        self._fields = record_fields(patient_id, test_name, test_date_time, result_value, unit, status,
+                                     result_date_time, record_id)
+
+    # The stored fields, in restore() order
+    test_name = coded_field(1, 'names')
+    unit = coded_field(2, 'units')
+    status = coded_field(3, 'statuses')
+    test_time = time_field(5, 'test_times')
+    result_time = time_field(6, 'result_times')
+    _test_text = text_field(7, 'test_texts')
+    _result_text = text_field(8, 'result_texts')
+
+    @property
+    def patient_id(self):
+        table = self._table
+        return self._fields[0] if table is None else table.patient_ids[table.patients[self._row]]
+
+    @patient_id.setter
+    def patient_id(self, patient_id):
+        if self._table is None:
+            self._fields[0] = patient_id
+        else:
+            self._table.patients[self._row] = self._table.patient_code(patient_id)
+
+    @property
+    def _value(self):
+        # The result as compact_number() gives it: a float, an int, or the text
+        return self._fields[4] if self._table is None else self._table.value(self._row)
+
+    @_value.setter
+    def _value(self, value):
+        if self._table is None:
+            self._fields[4] = value
+        else:
+            self._table.set_value(self._row, value)
+
+    @property
+    def record_id(self):
+        """Stable unique ID, kept in the record file."""
+        return self._fields[9] if self._table is None else self._table.record_ids[self._row] or None
+
+    @record_id.setter
+    def record_id(self, record_id):
+        if self._table is None:
+            self._fields[9] = record_id
+        else:
+            self._table.record_ids[self._row] = record_id or 0
+
+    def fields(self):
+        """The record's fields in restore() order."""
+        return tuple(self._fields) if self._table is None else self._table.fields(self._row)
+
+    def texts(self):
+        """patient_id plus the FIELDS as text, the way the record file spells them, read in one go."""
+        patient_id, test_name, unit, status, value, test_time, result_time, test_text, result_text, _ = self.fields()
+        if test_text is None:
+            test_text = format_minutes(test_time)
+        if result_text is None and result_time is not None:
+            result_text = format_minutes(result_time)
+        return (patient_id, test_name, test_text, value if value.__class__ is str else str(value), unit, status,
+                result_text)
+
+    def row_in(self, table):
+        """The record's row if it is in table, else -1."""
+        return self._row if self._table is table else -1
+
+    def attach(self, table):
+        """Make the record a view of a row of table, moving its fields there unless it is there already; returns
+        the row."""
+        if self._table is not table or self._row in table.free:
+            row = table.append(self.fields())
+            self._table, self._row, self._fields = table, row, None
+        return self._row
+
+    def __eq__(self, other):
+        if self._table is None or other.__class__ is not TestRecord:
+            return self is other
+        return self._table is other._table and self._row == other._row
+
+    def __hash__(self):
+        return id(self) if self._table is None else hash((id(self._table), self._row))
+
+    @property
+    def test_date_time(self):
+        text = self._test_text
+        return text if text is not None else format_minutes(self.test_time)
+
+    @test_date_time.setter
+    def test_date_time(self, text):
+        self.test_time = test_time = to_epoch_minutes(text)
+        self._test_text = None if test_time is not None and is_canonical_date_time(text) else text
+
+    @property
+    def result_date_time(self):
+        text = self._result_text
+        if text is not None:
+            return text
+        result_time = self.result_time
+        return format_minutes(result_time) if result_time is not None else None
+
+    @result_date_time.setter
+    def result_date_time(self, text):
+        self.result_time = result_time = to_epoch_minutes(text) if text else None
+        canonical = result_time is not None and is_canonical_date_time(text)
+        self._result_text = None if canonical or not text else text
+
+    @property
+    def result_value(self):
+        value = self._value
+        return value if value.__class__ is str else str(value)
+
+    @result_value.setter
+    def result_value(self, text):
+        self._value = compact_number(text)
+
+    @property
+    def turnaround(self):
+        """Minutes from test to result, or None while either time is unknown."""
+        test_time, result_time = self.test_time, self.result_time
+        if test_time is None or result_time is None:
+            return None
+        return result_time - test_time
+
+    def numeric_value(self):
+        """Return the result as a float, raising ValueError when it is not numeric."""
+        return float(self._value)
+
+    def content_key(self):
+        # Every stored field but the record ID; records with equal keys are duplicates
+        return self.fields()[:9]
+
+    # Mapping-style access used by the display, export and save code
+    def __getitem__(self, key):
+        if key in self.FIELDS or key in self.DERIVED_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS or key in self.DERIVED_FIELDS
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def copy(self):
+        """Return the record as a plain dict, including patient_id, the parsed times and the turnaround."""
+        record = {key: getattr(self, key) for key in self.FIELDS}
+        for key in self.DERIVED_FIELDS:
+            record[key] = getattr(self, key)
+        return record
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class Patient:
+    """A patient's test records: rows of a RecordTable, kept sorted by test time.
+
+    An indexed patient's rows are in the index's table, which every indexed
+    patient shares; a patient without an index (lazy mode, reads without
+    loading) has a table of its own.
+    """
+
+    __slots__ = ('patient_id', 'rows', 'table', 'index')
+
+    def __init__(self, patient_id, index=None):
+        self.patient_id = patient_id
+        self.rows = array(ROW_TYPE)  # start with no records, kept sorted by test time
+        self.index = index  # shared RecordIndex kept in sync with the rows
+        self.table = index.table if index is not None else RecordTable()
+
+    @property
+    def test_records(self):
+        """The records, sorted by test time, in a new list."""
+        return self.table.records(self.rows)
+
+    def add_test_record(self, test_name, test_date_time, result_value, unit, status, result_date_time=None,
+                        record_id=None):
+        # Times are parsed once here so filters and reports never re-parse the text
+        row = self.table.append(record_fields(self.patient_id, test_name, test_date_time, result_value, unit,
+                                              status, result_date_time, record_id))
+        self._link_row(row)
+        return self.table.record(row)
+
+    def add_record(self, record):
+        """Add a record built beforehand, e.g. to check it for duplicates first."""
+        self._link_row(record.attach(self.table))
+        return record
+
+    def add_restored_records(self, records):
+        """Add records that are already sorted by test time, as the database returns them."""
+        self.add_rows(array(ROW_TYPE, [record.attach(self.table) for record in records]))
+
+    def add_rows(self, rows):
+        """Add rows of the patient's table that are already sorted by test time, as a loaded shard has them."""
+        times = self.table.test_times
+        if self.rows and rows and times[rows[0]] < times[self.rows[-1]]:
+            for row in rows:
+                self._link_row(row)
+            return
+        self.rows.extend(rows)
+        if self.index is not None:
+            self.index.add_rows(rows)
+
+    def _link_row(self, row):
+        # Insert after any record with the same test time to keep insertion order stable
+        rows, times = self.rows, self.table.test_times
+        key = times[row]
+        if not rows or times[rows[-1]] <= key:
+            rows.append(row)
+        else:
+            rows.insert(bisect.bisect_right(rows, key, key=times.__getitem__), row)
+        if self.index is not None:
+            self.index.add(row)
+
+    def _unlink(self, record):
+        # Returns the record's row, or -1 when it is not one of this patient's
+        row = record.row_in(self.table)
+        if row < 0:
+            return row
+        rows, times = self.rows, self.table.test_times
+        key = times[row]
+        position = bisect.bisect_left(rows, key, key=times.__getitem__)
+        end = bisect.bisect_right(rows, key, key=times.__getitem__)
+        while position < end:
+            if rows[position] == row:
+                del rows[position]
+                break
+            position += 1
+        if self.index is not None:
+            self.index.remove(row)
+        return row
+
+    def get_records_by_date_range(self, start_date, end_date):
+        start, end = date_range_minutes(start_date, end_date)
+        if start is None or end is None:
+            return []
+        return self.records_between(start, end)
+
+    def records_between(self, start_time, end_time):
+        # The records tested between two epoch-minute bounds, found by bisect
+        times = self.table.test_times
+        low = bisect.bisect_left(self.rows, start_time, key=times.__getitem__)
+        high = bisect.bisect_right(self.rows, end_time, key=times.__getitem__)
+        return self.table.records(self.rows[low:high])
+
+    def update_test_record(self, test_name, **kwargs):
+        for record in [record for record in self.test_records if record["test_name"] == test_name]:
+            self.update_record(record, **kwargs)
+
+    def update_record(self, record, **kwargs):
+        # Take the record out of the sorted rows and indexes while its keys change; it keeps its row
+        self._unlink(record)
+        for key, value in kwargs.items():
+            if key in TestRecord.FIELDS:
+                record[key] = value
+        self.add_record(record)
+
+    def delete_record(self, record):
+        # The record still reads its fields until another record fills the row
+        row = self._unlink(record)
+        if row >= 0:
+            self.table.release((row,))
+
+    def get_records_by_status(self, status):
+        matching_records2 = []
+        for record in self.test_records:
+            if record["status"] == status:
+                matching_records2.append(record)
+                return matching_records2
+
+
+###############################################################
+class RecordIndex:
+    """Secondary indexes over every loaded record, used by the filter query planner.
+
+    The records are rows of one RecordTable, shared with the indexed
+    patients. The indexes hold positions, in arrays of 4 bytes per entry, in a
+    list of those rows in the order they were added (self.rows). Adding a
+    record appends to them and removing one leaves a -1 hole in the list,
+    which the indexes skip; the list is compacted once half of it is holes.
+    An updated record is removed and added again: it gets a new position but
+    keeps its row. The date order takes in the records added since it was
+    last used when a date query or the column view needs it: a few by
+    insertion, more by one sort. A test name or status bucket is kept in date
+    order the same way once queried.
+    """
+
+    def __init__(self):
+        self.table = RecordTable()     # the records
+        self.rows = array(ROW_TYPE)         # position -> table row, -1 where a record was removed
+        self.holes = 0                 # -1 entries in self.rows
+        self.id_positions = array(ROW_TYPE)  # record ID -> position of its record, -1 for none
+        self.sparse_ids = {}           # record ID -> position, for IDs far beyond the others
+        self.highest_id = 0            # highest record ID ever indexed
+        self.by_test_name = {}         # test name -> array of positions, in insertion order
+        self.by_status = {}            # status -> array of positions, in insertion order
+        self.date_order = array(ROW_TYPE)   # positions sorted by test time
+        self.date_keys = array('q')    # test times parallel to date_order, for bisect
+        self.dated = 0                 # records before this position are in the date order
+        self.bucket_orders = {}        # (field, value) -> (positions, test times, bucket entries taken in),
+                                       # a bucket sorted like the date order once it was queried
+        self.version = 0  # bumped on every change, so derived views know they are stale
+        self.monitor = None  # SlaMonitor of the pending tests, kept in sync once built
+        self.duplicates = None  # DuplicateIndex of the record contents, kept in sync once built
+        self.cache = None    # QueryCache told about every changed record
+
+    def __len__(self):
+        return len(self.rows) - self.holes
+
+    def __iter__(self):
+        # The records in insertion order
+        return self.live(range(len(self.rows)))
+
+    def add(self, row):
+        self.version += 1
+        if self.monitor is not None or self.duplicates is not None or self.cache is not None:
+            record = self.table.record(row)
+            if self.monitor is not None:
+                self.monitor.add(record)
+            if self.duplicates is not None:
+                self.duplicates.add(record)
+            if self.cache is not None:
+                self.cache.record_changed(record.patient_id, record.test_name)
+        self._append(row)
+
+    def add_rows(self, rows):
+        # Same as add() for each row, with the lookups hoisted out of the loop
+        self.version += 1
+        table = self.table
+        if self.monitor is not None or self.duplicates is not None or self.cache is not None:
+            records = table.records(rows)
+            if self.monitor is not None:
+                self.monitor.add_many(records)
+            if self.duplicates is not None:
+                self.duplicates.add_many(records)
+            if self.cache is not None:
+                for record in records:
+                    self.cache.record_changed(record.patient_id, record.test_name)
+        start = len(self.rows)
+        self.rows.extend(rows)
+        id_positions, by_test_name, by_status = self.id_positions, self.by_test_name, self.by_status
+        strings, names, statuses, record_ids = table.strings, table.names, table.statuses, table.record_ids
+        for position, row in enumerate(rows, start):
+            record_id = record_ids[row]
+            if record_id:
+                if 0 < record_id < len(id_positions) and record_id <= self.highest_id:
+                    id_positions[record_id] = position
+                else:
+                    self.set_id(record_id, position)
+                    id_positions = self.id_positions
+            test_name = strings[names[row]]
+            bucket = by_test_name.get(test_name)
+            if bucket is None:
+                bucket = by_test_name[test_name] = array(ROW_TYPE)
+            bucket.append(position)
+            status = strings[statuses[row]]
+            bucket = by_status.get(status)
+            if bucket is None:
+                bucket = by_status[status] = array(ROW_TYPE)
+            bucket.append(position)
+
+    def restore(self, table, record_ids, date_order, date_keys, by_test_name, by_status):
+        """Fill an empty index with a table whose rows are its positions, and the IDs (0 for none), date order
+        and buckets saved with them."""
+        self.version += 1
+        self.table = table
+        self.rows = array(ROW_TYPE, range(len(table)))
+        if self.monitor is not None:
+            self.monitor.add_many(self)
+        if self.duplicates is not None:
+            self.duplicates.add_many(self)
+        if self.cache is not None:
+            self.cache.clear()
+        self.date_order, self.date_keys, self.dated = date_order, date_keys, len(table)
+        self.by_test_name, self.by_status = by_test_name, by_status
+        self.bucket_orders = {}
+        highest_id = max(record_ids, default=0)
+        if 0 <= min(record_ids, default=0) and highest_id < 2 * len(table) + ID_ARRAY_SLACK:
+            id_positions = self.id_positions = array(ROW_TYPE, itertools.repeat(-1, highest_id + 1))
+            for position, record_id in enumerate(record_ids):
+                id_positions[record_id] = position
+            id_positions[0] = -1  # records without an ID
+            self.highest_id = highest_id
+        else:
+            for position, record_id in enumerate(record_ids):
+                if record_id:
+                    self.set_id(record_id, position)
+
+    def _append(self, row):
+        position = len(self.rows)
+        self.rows.append(row)
+        table = self.table
+        record_id = table.record_ids[row]
+        if record_id:
+            self.set_id(record_id, position)
+        for buckets, text in ((self.by_test_name, table.strings[table.names[row]]),
+                              (self.by_status, table.strings[table.statuses[row]])):
+            bucket = buckets.get(text)
+            if bucket is None:
+                bucket = buckets[text] = array(ROW_TYPE)
+            bucket.append(position)
+
+    def set_id(self, record_id, position):
+        # Record IDs are handed out in sequence, so an array indexed by ID stays dense;
+        # an ID far beyond the others (e.g. edited into the file) goes to a dict instead.
+        # position -1 forgets the ID
+        positions = self.id_positions
+        if record_id >= len(positions):
+            if record_id >= 2 * len(self.rows) + ID_ARRAY_SLACK or record_id < 0:
+                if position < 0:
+                    self.sparse_ids.pop(record_id, None)
+                else:
+                    self.sparse_ids[record_id] = position
+                    self.highest_id = max(self.highest_id, record_id)
+                return
+            # Grow geometrically, taking in the sparse IDs that fit now
+            size = max(record_id + 1, 2 * len(positions))
+            positions.extend(itertools.repeat(-1, size - len(positions)))
+            for sparse_id in [sparse_id for sparse_id in self.sparse_ids if sparse_id < size]:
+                positions[sparse_id] = self.sparse_ids.pop(sparse_id)
+        positions[record_id] = position
+        if position >= 0:
+            self.highest_id = max(self.highest_id, record_id)
+
+    def id_position(self, record_id):
+        if 0 <= record_id < len(self.id_positions):
+            return self.id_positions[record_id]
+        return self.sparse_ids.get(record_id, -1)
+
+    def get(self, record_id):
+        """The record with this ID, or None."""
+        position = self.id_position(record_id)
+        return self.table.record(self.rows[position]) if position >= 0 else None
+
+    def register_ids(self, records):
+        """Make records that were added without an ID findable by the ones they have now."""
+        numbered = {record.row_in(self.table) for record in records}
+        record_ids = self.table.record_ids
+        for position, row in enumerate(self.rows):
+            if row in numbered:
+                self.set_id(record_ids[row], position)
+
+    def max_record_id(self):
+        # New IDs start above it; one whose record was removed is not handed out again
+        return self.highest_id
+
+    def position(self, row):
+        # Where the row is in self.rows, or -1: found by its record's ID, or by a scan for
+        # a record without one (only one read before IDs existed, until number_records() runs)
+        record_id = self.table.record_ids[row]
+        if record_id:
+            position = self.id_position(record_id)
+            if position >= 0 and self.rows[position] == row:
+                return position
+        try:
+            return self.rows.index(row)
+        except ValueError:
+            return -1
+
+    def remove(self, row):
+        position = self.position(row)
+        if position < 0:
+            return
+        self.version += 1
+        if self.monitor is not None or self.duplicates is not None or self.cache is not None:
+            record = self.table.record(row)
+            if self.monitor is not None:
+                self.monitor.remove(record)
+            if self.duplicates is not None:
+                self.duplicates.remove(record)
+            if self.cache is not None:
+                self.cache.record_changed(record.patient_id, record.test_name)
+        # The indexes keep the position until the next compaction and skip it meanwhile
+        self.rows[position] = -1
+        self.holes += 1
+        record_id = self.table.record_ids[row]
+        if record_id and self.id_position(record_id) == position:
+            self.set_id(record_id, -1)
+        if self.holes > 1024 and self.holes * 2 > len(self.rows):
+            self.compact()
+
+    def compact(self):
+        # Drop the holes and renumber the positions in every index; amortized over the removals
+        self.version += 1
+        rows = self.rows
+        renumbered = array(ROW_TYPE, itertools.repeat(-1, len(rows)))
+        live = 0
+        for position, row in enumerate(rows):
+            if row >= 0:
+                renumbered[position] = live
+                live += 1
+
+        def renumber(positions):
+            return array(ROW_TYPE, [renumbered[position] for position in positions if rows[position] >= 0])
+
+        self.by_test_name = {name: bucket for name, positions in self.by_test_name.items()
+                             if (bucket := renumber(positions))}
+        self.by_status = {status: bucket for status, positions in self.by_status.items()
+                          if (bucket := renumber(positions))}
+        dated = [index for index, position in enumerate(self.date_order) if rows[position] >= 0]
+        self.date_order = array(ROW_TYPE, [renumbered[self.date_order[index]] for index in dated])
+        self.date_keys = array('q', [self.date_keys[index] for index in dated])
+        self.dated = sum(1 for row in rows[:self.dated] if row >= 0)
+        self.id_positions = array(ROW_TYPE, [position if position < 0 else renumbered[position]
+                                        for position in self.id_positions])
+        self.sparse_ids = {record_id: renumbered[position] for record_id, position in self.sparse_ids.items()
+                           if position >= 0}
+        self.rows = array(ROW_TYPE, [row for row in rows if row >= 0])
+        self.holes = 0
+        self.bucket_orders = {}  # sorted again from the renumbered buckets when next queried
+
+    def clear(self):
+        self.version += 1
+        if self.monitor is not None:
+            self.monitor.clear()
+        if self.duplicates is not None:
+            self.duplicates.clear()
+        if self.cache is not None:
+            self.cache.clear()
+        self.table = RecordTable()
+        self.rows = array(ROW_TYPE)
+        self.holes = 0
+        self.id_positions = array(ROW_TYPE)
+        self.sparse_ids = {}
+        self.highest_id = 0
+        self.by_test_name = {}
+        self.by_status = {}
+        self.date_order = array(ROW_TYPE)
+        self.date_keys = array('q')
+        self.dated = 0
+        self.bucket_orders = {}
+
+    def live(self, positions):
+        # The records at these positions, skipping removed ones
+        rows, record = self.rows, self.table.record
+        return (record(rows[position]) for position in positions if rows[position] >= 0)
+
+    def with_test_name(self, test_name):
+        return self.live(self.by_test_name.get(test_name, ()))
+
+    def with_status(self, status):
+        return self.live(self.by_status.get(status, ()))
+
+    def sort_dates(self):
+        # Take the records added since the date order was last used into it
+        added = range(self.dated, len(self.rows))
+        self.dated = len(self.rows)
+        self.date_order, self.date_keys = self.take_in(self.date_order, self.date_keys, added)
+
+    def take_in(self, order, keys, added):
+        """Take the positions added into order, positions sorted by record_order(), and keys, their test times.
+
+        A few are inserted, more are merged in by one sort. Returns the new (order, keys).
+        """
+        rows, test_times, record_ids = self.rows, self.table.test_times, self.table.record_ids
+        if self.holes:
+            added = [position for position in added if rows[position] >= 0]
+        if len(added) <= DATE_INSERT_MAX:
+            for position in added:
+                row = rows[position]
+                key, record_id = test_times[row], record_ids[row]
+                at = bisect.bisect_right(keys, key)
+                # Records tested at the same time go by record ID
+                while at and keys[at - 1] == key:
+                    other = rows[order[at - 1]]
+                    if other >= 0 and record_ids[other] <= record_id:
+                        break
+                    at -= 1
+                keys.insert(at, key)
+                order.insert(at, position)
+            return order, keys
+
+        # Sort by record ID, then stably by test time, so records tested at the same time go by ID
+        order, keys = list(order), list(keys)
+        if self.holes:
+            kept = [index for index, position in enumerate(order) if rows[position] >= 0]
+            order, keys = [order[index] for index in kept], [keys[index] for index in kept]
+        order.extend(added)
+        keys.extend(map(test_times.__getitem__, map(rows.__getitem__, added)))
+        order_ids = list(map(record_ids.__getitem__, map(rows.__getitem__, order)))
+        sorted_indexes = sorted(range(len(keys)), key=order_ids.__getitem__)
+        sorted_indexes.sort(key=keys.__getitem__)
+        return (array(ROW_TYPE, map(order.__getitem__, sorted_indexes)),
+                array('q', map(keys.__getitem__, sorted_indexes)))
+
+    def ordered_bucket(self, field, value):
+        """The records with this test name or status, in date order (see record_order()).
+
+        The sorted bucket is kept and takes in the records added to the bucket since it was last queried.
+        """
+        positions = (self.by_test_name if field == "test_name" else self.by_status).get(value, array(ROW_TYPE))
+        order, keys, taken = self.bucket_orders.get((field, value), (array(ROW_TYPE), array('q'), 0))
+        order, keys = self.take_in(order, keys, positions[taken:])
+        self.bucket_orders[field, value] = (order, keys, len(positions))
+        return self.live(order)
+
+    def date_bounds(self, start_time, end_time):
+        # Positions in the date order of the records tested between the two epoch-minute bounds
+        self.sort_dates()
+        low = bisect.bisect_left(self.date_keys, start_time)
+        high = bisect.bisect_right(self.date_keys, end_time)
+        return low, high
+
+    def records_in_date_range(self, start_time, end_time):
+        # In date order, read lazily from a copy of the range's positions
+        low, high = self.date_bounds(start_time, end_time)
+        return self.live(self.date_order[low:high])
+
+    def date_rows(self):
+        """The table row of every record, sorted by test time and then record ID (see record_order())."""
+        self.sort_dates()
+        rows = array(ROW_TYPE, map(self.rows.__getitem__, self.date_order))
+        return array(ROW_TYPE, filter((0).__le__, rows)) if self.holes else rows
+
+    def iter_date_order(self):
+        # Every record in date order; the date order is only brought up to date once iterated
+        self.sort_dates()
+        yield from self.live(self.date_order)
+
+
+###############################################################
+class LazyPatientStore:
+    """Dict-like view of the patients that parses a patient's lines only when first accessed.
+
+    The record file is memory-mapped and located through a patient -> line
+    offsets index; at most max_patients parsed patients stay in memory.
+    Journal entries newer than the record file are kept per patient and
+    applied on materialization, so evicting a patient never loses changes.
+    """
+
+    def __init__(self, system, max_patients, record_file=None):
+        self.system = system
+        self.max_patients = max_patients
+        self.record_file = record_file or system.record_file  # one shard's file, for a sharded dataset
+        self.offset_index_file = self.record_file + ".idx"
+        self.offsets = {}             # patient id -> array of line offsets in the record file
+        self.max_record_id = 0        # highest record ID in the record file, counting the numbered lines
+        self.missing_ids = array('q')  # offsets of the lines written before IDs existed, in file order
+        self.first_missing_id = 1     # the ID the first of those lines is given (see number_records())
+        self.pending = {}             # patient id -> journal entries not yet in the record file
+        self.known = {}               # every patient id, in file order (used as an ordered set)
+        self.size = 0                 # bytes of the record file the offsets cover
+        self.cache = OrderedDict()    # materialized patients, least recently used first
+        self.mapped = None
+        self.file = None
+
+    def open(self):
+        """Map the record file and load (or rebuild) its patient offset index."""
+        self.close()
+        self.offsets, self.max_record_id, self.missing_ids = self.load_offsets() or self.build_offsets()
+        # Lines without an ID are numbered in file order after the highest ID, as a full load does
+        self.first_missing_id = self.max_record_id + 1
+        self.max_record_id += len(self.missing_ids)
+        self.pending = {}
+        self.cache.clear()
+        self.known = dict.fromkeys(self.offsets)
+        self.map_file()
+
+    def map_file(self):
+        self.close()
+        try:
+            self.file = open(self.record_file, 'rb')
+            if os.fstat(self.file.fileno()).st_size:
+                self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            print(f"File {self.record_file} not found.")
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def build_offsets(self):
+        offsets = {}
+        position = max_record_id = 0
+        missing_ids = array('q')
+        try:
+            with open(self.record_file, 'rb') as file:
+                for line in file:
+                    if line.strip():
+                        patient_id = line.split(b': ', 1)[0].decode()
+                        offsets.setdefault(patient_id, array('q')).append(position)
+                        _, marker, record_id = line.rstrip().rpartition(b' #')
+                        if marker and record_id.isdigit():
+                            max_record_id = max(max_record_id, int(record_id))
+                        else:
+                            missing_ids.append(position)
+                    position += len(line)
+        except FileNotFoundError:
+            self.size = 0
+            return offsets, max_record_id, missing_ids
+        self.size = position
+
+        # Persist the index so the next start skips this scan: the patients' offsets one after another
+        try:
+            header = SNAPSHOT_HEADER.pack(OFFSET_INDEX_MAGIC, *self.system.snapshot_key(self.record_file))
+            temp_file = self.offset_index_file + ".tmp"
+            write_sections(temp_file, header, {
+                "patient_ids": list(offsets), "counts": array('q', map(len, offsets.values())),
+                "offsets": array('q', itertools.chain.from_iterable(offsets.values())),
+                "missing_ids": missing_ids, "max_record_id": array('q', [max_record_id])
+            })
+            os.replace(temp_file, self.offset_index_file)
+        except OSError:
+            print("Warning: Could not write the patient offset index.")
+        return offsets, max_record_id, missing_ids
+
+    def load_offsets(self):
+        try:
+            key = self.system.snapshot_key(self.record_file)
+            sections = read_sections(self.offset_index_file, SNAPSHOT_HEADER.pack(OFFSET_INDEX_MAGIC, *key))
+            if sections is None:
+                return None
+            offsets, start = {}, 0
+            all_offsets = sections["offsets"]
+            for patient_id, count in zip(sections["patient_ids"], sections["counts"]):
+                offsets[patient_id] = all_offsets[start:start + count]
+                start += count
+            result = offsets, sections["max_record_id"][0], sections["missing_ids"]
+        except (OSError, ValueError, KeyError, IndexError, struct.error):
+            return None
+        self.size = key[0]
+        return result
+
+    def missing_id(self, offset):
+        # The ID of the line at offset among those without one, or None for a line appended since
+        number = bisect.bisect_left(self.missing_ids, offset)
+        if number < len(self.missing_ids) and self.missing_ids[number] == offset:
+            return self.first_missing_id + number
+        return None
+
+    def add_lines(self, data):
+        """Index the lines appended to the record file, data being the complete ones after self.size."""
+        position = self.size
+        for line in data.splitlines(keepends=True):
+            if line.strip():
+                patient_id = line.split(b': ', 1)[0].decode()
+                self.offsets.setdefault(patient_id, array('q')).append(position)
+                self.known.setdefault(patient_id)
+                self.cache.pop(patient_id, None)  # parsed before the line existed
+                record_id = split_record_id(line.rstrip().decode())[1]
+                if record_id is not None:
+                    self.max_record_id = max(self.max_record_id, record_id)
+            position += len(line)
+        self.size = position
+        self.map_file()  # the old mapping ends where the file used to
+
+    def add_pending(self, patient_id, entry):
+        self.pending.setdefault(patient_id, []).append(entry)
+        self.known.setdefault(patient_id)
+
+    def materialize(self, patient_id):
+        # Lazy patients are never in a RecordIndex: lazy mode has none, and a lookup store
+        # of a system without loaded records must not fill the system's
+        patient = Patient(patient_id)
+        for offset in self.offsets.get(patient_id, ()):
+            end = self.mapped.find(b'\n', offset)
+            line = self.mapped[offset:end if end >= 0 else len(self.mapped)].decode()
+            _, *fields, record_id = self.system.parse_record_line(line)
+            patient.add_test_record(*fields, record_id if record_id is not None else self.missing_id(offset))
+        for entry in self.pending.get(patient_id, ()):
+            self.system.apply_journal_entry(entry, patient)
+        if self is self.system.patients:
+            self.system.drop_duplicates([patient])
+        return patient
+
+    def __getitem__(self, patient_id):
+        patient = self.cache.get(patient_id)
+        if patient is not None:
+            self.cache.move_to_end(patient_id)
+            return patient
+        if patient_id not in self.known:
+            raise KeyError(patient_id)
+        patient = self.materialize(patient_id)
+        self[patient_id] = patient
+        return patient
+
+    def __setitem__(self, patient_id, patient):
+        self.known.setdefault(patient_id)
+        self.cache[patient_id] = patient
+        self.cache.move_to_end(patient_id)
+        while len(self.cache) > self.max_patients:
+            self.cache.popitem(last=False)
+
+    def get(self, patient_id, default=None):
+        try:
+            return self[patient_id]
+        except KeyError:
+            return default
+
+    def __contains__(self, patient_id):
+        return patient_id in self.known
+
+    def __len__(self):
+        return len(self.known)
+
+    def __iter__(self):
+        return iter(list(self.known))
+
+    def keys(self):
+        return list(self.known)
+
+    def values(self):
+        # Patients are parsed one at a time; the LRU bound keeps memory flat
+        for patient_id in list(self.known):
+            yield self[patient_id]
+
+    def items(self):
+        for patient_id in list(self.known):
+            yield patient_id, self[patient_id]
+
+
+###############################################################
+class TextRecordStore(RecordStore):
+    """The text format: the record file (or its shards), the journal and the snapshot cache.
+
+    Mutations are appended to the journal as entries and folded back into the
+    record file by a rewrite; see MedicalTestSystem for the files' names and
+    locking. Without loaded records, single patients and queries are read
+    through one LazyPatientStore per record file, with the journal's entries
+    pending on them.
+    """
+
+    def __init__(self, system):
+        super().__init__(system)
+        self.lookup_stores = None  # read single patients while nothing is loaded, per shard
+
+    def load(self):
+        system = self.system
+        if system.lazy:
+            system.load_lazy_records()
+            return
+        if system.shard_count > 1:
+            system.load_shard_records()
+            return
+
+        identity = file_identity(system.record_file)
+        if system.load_snapshot():
+            system.files_seen[system.record_file] = identity
+            system.replay_journal()
+            system.finish_record_ids()
+            system.drop_duplicates(system.patients.values())
+            system.records_loaded = True
+            return
+
+        missing_ids = []  # records of lines written before IDs existed, in file order
+        try:
+            file = open(system.record_file, 'r')
+            try:
+                for line in file:
+                    patient_id, test_name, test_date_time, result_value, unit, status, result_date_time, \
+                        record_id = system.parse_record_line(line)
+
+                    # Add the test record to the patient's record, adding the patient if needed
+                    record = system.get_or_create_patient(patient_id).add_test_record(
+                        test_name, test_date_time, result_value, unit, status, result_date_time, record_id
+                    )
+                    if record_id is None:
+                        missing_ids.append(record)
+                    system.snapshot_records += 1
+                system.remember_record_file(file.buffer.tell())
+            finally:
+                file.close()
+            # Cache the parsed file so the next start can skip parsing (once it has every ID)
+            if not missing_ids:
+                system.write_snapshot()
+        except FileNotFoundError:
+            print(f"File {system.record_file} not found.")
+            system.files_seen.pop(system.record_file, None)
+        system.number_records(missing_ids)
+
+        # Apply the changes made since the last snapshot
+        system.replay_journal()
+        system.finish_record_ids()
+        system.drop_duplicates(system.patients.values())
+        system.records_loaded = True
+
+    def select(self, query, planned):
+        # The record files and journal are read one patient at a time, only the patient's own
+        # lines when the query names one, and the matches sorted in bounded runs
+        system = self.system
+        patient_id = planned[id(query)]['patient_id'] if query.operator is None else None
+        records = self.scan(None if patient_id is None else [patient_id])
+        yield from system.sort_records(filter(system.query_matcher(query, planned), records))
+
+    def scan(self, patient_ids=None):
+        """Yield the records of the record files and journal without loading them, one patient at a time.
+
+        patient_ids limits the scan to those patients. As loading does, the skip
+        and reject policies leave out copies of a patient's earlier records.
+        """
+        system = self.system
+        if patient_ids is None:
+            patient_ids = itertools.chain.from_iterable(list(store.known) for store in self.open_lookup_stores())
+        for patient_id in patient_ids:
+            records = system.stored_records(patient_id)
+            if system.duplicate_policy != "count":
+                seen = set()
+                records = [record for record in records
+                           if not (record.content_key() in seen or seen.add(record.content_key()))]
+            yield from records
+
+    def patient_records(self, patient_id):
+        system = self.system
+        stored = self.open_lookup_stores()[system.patient_shard(patient_id)].get(patient_id)
+        return stored.test_records if stored is not None else []
+
+    def open_lookup_stores(self):
+        # One lazy store per record file, with the journal's entries pending, for reads without loading
+        system = self.system
+        if self.lookup_stores is None:
+            self.lookup_stores = [LazyPatientStore(system, 1000, path) for path in system.shard_files]
+            for store in self.lookup_stores:
+                if os.path.exists(store.record_file):
+                    store.open()
+            for entry in system.read_journal():
+                entry_patient_id = system.journal_patient_id(entry)
+                self.lookup_stores[system.patient_shard(entry_patient_id)].add_pending(entry_patient_id, entry)
+        return self.lookup_stores
+
+    def add_committed(self, entries):
+        # The lookup stores see the rows as journal entries, so later duplicate checks still do
+        if self.lookup_stores is None:
+            return
+        for entry in entries:
+            patient_id = self.system.journal_patient_id(entry)
+            store = self.lookup_stores[self.system.patient_shard(patient_id)]
+            store.add_pending(patient_id, entry)
+            store.cache.pop(patient_id, None)
+
+    def fetch_record(self, record_id, patient_id=None):
+        # The files cannot be searched by ID without reading them, so the records are loaded
+        # (in lazy mode only the offset index, and patient_id then saves a scan of every patient)
+        self.system.load_records()
+        return self.system.record_by_id(record_id, patient_id)
+
+    def commit(self, entries):
+        system = self.system
+        if system.records_loaded and (not system.use_journal or system.ids_unsaved):
+            # The record file is rewritten instead, also to save IDs given to old lines on load;
+            # without the records in memory it can only be journaled
+            system.save_records()
+            return False
+
+        # One write and one fsync; several entries go in a block so a torn write is ignored as a whole
+        data = (entries[0] + '\n' if len(entries) == 1 else journal_block(entries)).encode()
+        with open(system.journal_file, 'a+b') as file:
+            size = file.seek(0, os.SEEK_END)
+            if system.journal_checked is None or system.journal_checked[0] != size:
+                system.check_journal_tail(file, size)  # changed since this process last read it
+            valid_end = system.journal_checked[1]
+            if valid_end < size:
+                file.truncate(valid_end)  # what a crash left half-written
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        end = valid_end + len(data)
+        system.journal_checked = (end, end)
+        if system.records_loaded:
+            system.journal_offset = end
+        system.bump_version(journal_end=end)
+        if not system.records_loaded:
+            system.check_journal_size(end)
+        return True
+
+    def apply_changes(self, changed):
+        # Parse the lines appended to the record files, then the new part of the journal
+        system = self.system
+        for path, _ in changed:
+            system.load_record_tail(path)
+        entries = list(system.read_journal(system.journal_offset))
+        system.apply_journal_entries(entries)
+        system.journal_entries += len(entries)
+        system.journal_offset = system.journal_checked[1]
+
+    def changed_files(self):
+        # A rewrite shows as another inode, fewer bytes, or the same size with a new mtime
+        system = self.system
+        changed = []
+        for path in system.shard_files:
+            seen, current = system.files_seen.get(path), file_identity(path)
+            if current != seen:
+                appended = seen is not None and current is not None and current[:2] == seen[:2] and current[2] > seen[2]
+                changed.append((path, appended))
+        return changed
+
+    def rewrite(self):
+        # Write a new file and swap it in, so a lazy store can keep reading the old one meanwhile
+        system = self.system
+        if system.shard_count > 1:
+            system.save_shards()
+            return
+        temp_file = system.record_file + ".tmp"
+        file = open(temp_file, 'w')
+        try:
+            count = 0
+            for patient in system.patients.values():
+                for record in patient.test_records:
+                    file.write(system.format_record_line(patient.patient_id, record) + '\n')
+                    count += 1
+        finally:
+            file.close()
+        durable_replace(temp_file, system.record_file)
+
+        # The snapshot now contains every journaled change
+        system.snapshot_records = count
+        system.ids_unsaved = False
+        system.clear_journal()
+        system.bump_version(rewritten=True, journal_end=0)
+        if system.lazy:
+            system.patients.open()
+        system.remember_record_file(system.patients.size if system.lazy else None)
+        system.write_snapshot()
+
+    def compact(self):
+        system = self.system
+        if not system.records_loaded:
+            print("Records must be loaded before compacting the journal.")
+            return
+        if system.journal_entries or system.ids_unsaved:
+            system.save_records()
+
+    def dedupe(self, max_entries):
+        system = self.system
+        if os.path.exists(system.journal_file) and os.path.getsize(system.journal_file):
+            # Journal entries may refer to a dropped copy by its record ID
+            print("Compact the journal before removing duplicates.")
+            return None
+        paths = [path for path in system.shard_files if os.path.exists(path)]
+        if not paths:
+            print(f"File {system.record_file} not found.")
+            return None
+
+        # A patient's records are all in one shard, so each shard is deduplicated on its own
+        kept = dropped = 0
+        with system.lock.locked():
+            for path in paths:
+                temp_file = path + ".tmp"
+                shard_kept, shard_dropped = dedupe_file(path, temp_file, record_content, max_entries)
+                durable_replace(temp_file, path)
+                kept += shard_kept
+                dropped += shard_dropped
+            system.bump_version(rewritten=True)
+        return kept, dropped
+
+    def max_record_id(self):
+        # The offset index knows each file's highest ID, the journal the rest
+        system = self.system
+        max_record_id = 0
+        for path in system.shard_files:
+            store = system.patients if system.lazy else LazyPatientStore(system, 0, path)
+            _, file_max_record_id, missing_ids = store.load_offsets() or store.build_offsets()
+            max_record_id = max(max_record_id, file_max_record_id + len(missing_ids))
+        for entry in system.read_journal():
+            record_id = split_record_id(entry)[1]
+            if record_id is not None:
+                max_record_id = max(max_record_id, record_id)
+        return max_record_id
+
+
+###############################################################
+class MedicalTestSystem:
+
+    def __init__(self, record_file, test_file, use_journal=True, lazy=False, max_cached_patients=10000,
+                 query_workers=1, duplicates="count", storage=None, shards=None, load_threads=None):
+        if duplicates not in DUPLICATE_POLICIES:
+            raise ValueError(f"Unknown duplicate policy {duplicates!r}; use one of: {', '.join(DUPLICATE_POLICIES)}")
+        storage = storage or storage_for(record_file)
+        if storage not in STORAGE_ENGINES:
+            raise ValueError(f"Unknown storage {storage!r}; use one of: {', '.join(STORAGE_ENGINES)}")
+        if storage != "text" and lazy:
+            raise ValueError("Lazy mode reads the text record format only.")
+        stored_shards = stored_shard_count(record_file) if storage == "text" else None
+        if shards is None:
+            shards = stored_shards or 1
+        if shards < 1:
+            raise ValueError("The number of shards must be at least 1.")
+        if stored_shards is not None and shards != stored_shards:
+            raise ValueError(f"{record_file} is stored in {stored_shards} shards, not {shards}; "
+                             f"export and import the records to change that.")
+        if shards > 1 and (lazy or storage != "text"):
+            raise ValueError("Shards split the text record file; they cannot be used with lazy mode or a database.")
+        self.record_file = record_file
+        self.test_file = test_file
+
+        # In lazy mode patients are parsed from the mapped record file on first
+        # access; the global indexes would need every record, so there are none
+        self.lazy = lazy
+        self.patients = LazyPatientStore(self, max_cached_patients) if lazy else {}
+        self.index = None if lazy else RecordIndex()
+        self.tests = {}
+        self.test_ranges = None  # compiled reference ranges, built on first use
+        self.test_turnarounds = None  # expected turnaround minutes per test, built on first use
+        self.valid_statuses = set(VALID_STATUSES)
+
+        # Write-ahead journal: mutations are appended here instead of rewriting
+        # the whole record file, and folded back into it by compact_records()
+        self.use_journal = use_journal or lazy  # evicted patients are rebuilt from the journal
+        self.journal_file = record_file + ".journal"
+        self.journal_entries = 0
+        self.snapshot_records = 0
+        self.compact_min_entries = 1000
+        self.records_loaded = False
+        self.next_record_id = None  # next ID of the block reserved from the shared counter
+        self.record_id_limit = None
+        self.record_id_floor = None  # highest ID seen in the files plus one, if known
+        self.ids_unsaved = False  # records were numbered in memory; the next write saves their IDs
+
+        # Other processes may share the dataset: writers commit under the exclusive lock and
+        # bump the version in the lock file, so stale copies are noticed and brought up to date
+        self.lock = DatasetLock(record_file + ".lock")
+        self.seen_state = None  # (generation, version) the loaded records reflect
+        self.journal_offset = 0  # bytes of the journal applied to the loaded records
+        self.files_seen = {}  # file_identity() of each loaded record file, with the bytes read as size
+
+        # What happens to a record whose content repeats a stored one: it is kept and counted,
+        # dropped quietly ("skip") or dropped with a message ("reject")
+        self.duplicate_policy = duplicates
+        self.batch_entries = None  # journal entries of the open batch(), written when it ends
+        self.journal_checked = None  # (size, end of the complete entries) of the journal when last read
+
+        # Where the records are kept: the text record file, journal and snapshot cache, or a database
+        self.store = SqliteRecordStore(self, record_file) if storage == "sqlite" else TextRecordStore(self)
+
+        # The record file, or its shards by patient ID (see shards.py), each rewritten only when its
+        # patients changed; the journal, lock and record ID counter are shared by all shards
+        self.shard_count = shards
+        self.shard_files = shard_files(record_file, shards)
+        self.dirty_shards = set()  # shards with changes not yet written to their file
+        self.split_pending = False  # the single record file was loaded and is to be written out as shards
+        # Parsing holds the GIL, so by default shards load on parallel threads only where there is none
+        if load_threads is None:
+            load_threads = 1 if getattr(sys, "_is_gil_enabled", lambda: True)() else min(shards, os.cpu_count() or 1)
+        self.load_threads = load_threads
+
+        # Binary snapshot of the record file, used instead of parsing it when fresh
+        self.use_snapshot_cache = not lazy and storage == "text"
+        self.snapshot_file = record_file + ".cache"
+
+        # NumPy column view for large scans, rebuilt when the index changes
+        self.use_columns = HAVE_NUMPY and not lazy
+        self.columns = None
+
+        # Worker processes for large scans and reports, sharded by patient ID
+        self.query_workers = query_workers
+
+        # Recent filter and report results; the index invalidates them as records change
+        self.query_cache = None if lazy else QueryCache()
+        if self.index is not None:
+            self.index.cache = self.query_cache
+
+    def load_test(self):
+        try:
+            file = open(self.test_file, 'r')
+            try:
+                for line in file:
+                    parts = line.strip().split('; ')
+                    if len(parts) != 4:
+                        print(f"Warning: Skipping unwanted lines: {line.strip()}")
+                        continue
+                    name, range_values, unit, turnaround_time = parts
+                    self.tests[name] = {
+                        "range": range_values,
+                        "unit": unit,
+                        "turnaround_time": turnaround_time,
+                        "bounds": self.compile_range(range_values),
+                        "turnaround_minutes": turnaround_minutes(turnaround_time)
+                    }
+            finally:
+                file.close()
+        except FileNotFoundError:
+            print(f"File {self.test_file} not found.")
+
+        # The compiled tables and the overdue-test deadlines are derived from self.tests
+        self.test_ranges = None
+        self.test_turnarounds = None
+        if self.index is not None:
+            self.index.monitor = None
+        if self.query_cache is not None:
+            self.query_cache.catalog_changed()
+
+    def reload_tests(self):
+        """Re-read the catalog after it was changed on disk."""
+        self.tests = {}
+        self.load_test()
+
+    def get_or_create_patient(self, patient_id):
+        patient = self.patients.get(patient_id)
+        if patient is None:
+            patient = self.patients[patient_id] = Patient(patient_id, self.index)
+        return patient
+
+    def format_record_line(self, patient_id, record, with_id=True):
+        # Build the "ID: name, date, value, unit, status[, result date][ #record ID]" line
+        _, test_name, test_date_time, result_value, unit, status, result_date_time = record.texts()
+        line = f"{patient_id}: {test_name}, {test_date_time}, {result_value}, {unit}, {status}"
+        if result_date_time:
+            line += f", {result_date_time}"
+        if with_id and record.record_id is not None:
+            line += f" #{record.record_id}"
+        return line
+
+    def parse_record_line(self, line):
+        # Split the patient ID from the rest of the details, and the record ID from their end
+        patient_id, test_details = line.strip().split(': ', 1)
+        test_details, record_id = split_record_id(test_details)
+
+        # Split the test details into individual components
+        details = test_details.split(', ')
+
+        # Handle optional result_date_time if provided
+        result_date_time = details[5] if len(details) > 5 else None
+        return patient_id, details[0], details[1], details[2], details[3], details[4], result_date_time, record_id
+
+    def load_records(self):
+        # Records hold no reference cycles, so collecting during the load is wasted work.
+        # The shared lock keeps writers from replacing the files halfway through the load
+        with paused_gc(), self.lock.shared():
+            self.seen_state = self.lock.read_state()[:2]
+            self._load_records()
+        if self.split_pending:
+            self.split_record_file()
+
+    def _load_records(self):
+        self.store.load()
+
+    def load_shard_records(self):
+        paths = self.shard_files
+        # The first load with shards reads the single record file; load_records() then writes it out as shards
+        self.split_pending = not any(map(os.path.exists, paths)) and os.path.exists(self.record_file)
+        if self.split_pending:
+            paths = [self.record_file]
+        self.load_shard_files(paths)
+        self.replay_journal()
+        self.finish_record_ids()
+        self.drop_duplicates(self.patients.values())
+        self.records_loaded = True
+
+    def split_record_file(self):
+        """Write the single record file that was loaded out as shards, and remove it.
+
+        Runs under its own exclusive lock, taken after the load's shared one is
+        released (flock cannot upgrade a lock atomically). If another process
+        split or changed the file in between, the dataset is loaded again, which
+        splits it then if that is still needed.
+        """
+        with self.lock.locked():
+            self.split_pending = False
+            if (self.lock.read_state()[:2] != self.seen_state
+                    or file_identity(self.record_file) != self.files_seen.get(self.record_file)):
+                self.reload_records()
+                return
+            print(f"Splitting {self.record_file} into {self.shard_count} shards; it is removed once they are written.")
+            self.files_seen.pop(self.record_file, None)
+            self.dirty_shards.update(range(self.shard_count))
+            self.save_records()
+            # The shards are on disk now; the single file and its caches would only go stale
+            for path in (self.record_file, self.snapshot_file, self.record_file + ".idx"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def load_shard_files(self, paths):
+        # The shards are read and parsed in parallel threads, then added to the index in shard order
+        missing_ids = []
+        for path, (table, patients, identity, missing) in zip(paths, map_shards(self.read_shard, paths,
+                                                                               self.load_threads)):
+            placed = self.index.table.extend(table)  # this shard's rows, at the rows they got in the index's table
+            for patient_id, rows in patients:
+                self.get_or_create_patient(patient_id).add_rows(array(ROW_TYPE, map(placed.__getitem__, rows)))
+            self.snapshot_records += len(table)
+            missing_ids.extend(map(self.index.table.record, map(placed.__getitem__, missing)))
+            if identity is not None:
+                self.files_seen[path] = identity
+        self.number_records(missing_ids)
+
+    def read_shard(self, path):
+        """Read one shard into a RecordTable of its own: (table, (patient ID, rows sorted by test time) pairs,
+        file identity, rows of the lines without an ID in file order).
+
+        Runs in a loading thread, so it leaves the patients and the index alone.
+        A shard that was never written has no records.
+        """
+        identity = file_identity(path)
+        snapshot = self.read_snapshot(path)
+        if snapshot is not None:
+            columns, table = snapshot
+            return table, list(self.snapshot_patients(columns)), identity, []
+
+        table = RecordTable()
+        patients = {}
+        missing_ids = []
+        try:
+            with open(path, 'r') as file:
+                for line in file:
+                    fields = self.parse_record_line(line)
+                    row = table.append(record_fields(*fields))
+                    rows = patients.get(fields[0])
+                    if rows is None:
+                        rows = patients[fields[0]] = array(ROW_TYPE)
+                    rows.append(row)
+                    if fields[-1] is None:
+                        missing_ids.append(row)
+                identity = identity[:2] + (file.buffer.tell(),) + identity[3:]
+        except FileNotFoundError:
+            return table, [], None, []
+        for patient_id, rows in patients.items():
+            # Stable, so records tested at the same time keep their file order
+            patients[patient_id] = array(ROW_TYPE, sorted(rows, key=table.test_times.__getitem__))
+        if not missing_ids:
+            self.write_snapshot(path, table, patients.items())
+        return table, list(patients.items()), identity, missing_ids
+
+    def patient_shard(self, patient_id):
+        return shard_of(patient_id, self.shard_count)
+
+    def load_for_queries(self):
+        """Load the records for filters and reports, unless the store answers those itself."""
+        if not self.store.answers_queries:
+            self.load_records()
+
+    def record_row(self, record):
+        # A record as a storage row, in TestRecord.restore() order
+        return record.fields()
+
+    def row_record(self, row):
+        # The record a storage row holds (see record_row())
+        return TestRecord.restore(*row)
+
+    def entry_record(self, entry):
+        # The record a journal entry adds, deletes or updates to (its last line)
+        return TestRecord(*self.parse_record_line(entry.rstrip('\n').split('\t')[-1]))
+
+    def finish_record_ids(self):
+        # New IDs must come after the highest loaded one
+        self.record_id_floor = self.index.max_record_id() + 1
+
+    def number_records(self, records):
+        """Give records read without an ID (written before IDs existed) one, in memory.
+
+        They are numbered in the order given, which is file order, after the
+        highest ID loaded so far, so every process reading the same files gives
+        them the same IDs and journal entries written by one find the records in
+        another. The IDs are saved to the record file by the next change or compact.
+        """
+        if not records:
+            return
+        for record_id, record in enumerate(records, self.index.max_record_id() + 1):
+            record.record_id = record_id
+            self.dirty_shards.add(self.patient_shard(record.patient_id))
+        self.index.register_ids(records)
+        self.ids_unsaved = True
+
+    def new_record_id(self):
+        if self.next_record_id is None or self.next_record_id >= self.record_id_limit:
+            self.reserve_record_ids()
+        record_id = self.next_record_id
+        self.next_record_id += 1
+        return record_id
+
+    def reserve_record_ids(self, count=RECORD_ID_BLOCK):
+        # Take the next block from the ID counter shared with the other processes;
+        # bump_version() hands back what is left of it when a change is committed
+        with self.lock.locked():
+            state = self.lock.read_state()
+            if not state[2] and self.record_id_floor is None:
+                self.scan_record_ids()  # a new lock file: start after the highest stored ID
+            first = max(state[2], self.record_id_floor or 1)
+            state[2] = first + count
+            self.lock.write_state(state, sync=True)
+        self.next_record_id, self.record_id_limit = first, first + count
+
+    def ensure_record_ids(self, count):
+        # Bulk adds reserve all their IDs at once, rather than one synced block per RECORD_ID_BLOCK
+        if self.next_record_id is None or self.record_id_limit - self.next_record_id < count:
+            self.reserve_record_ids(max(count, RECORD_ID_BLOCK))
+
+    def hand_back_record_ids(self, state):
+        # Return the rest of the reserved ID block to the counter in state, unless another process
+        # reserved one since, so a short-lived process does not use up a whole block
+        if self.next_record_id is not None and state[2] == self.record_id_limit:
+            state[2] = self.record_id_limit = self.next_record_id
+
+    def release_record_ids(self):
+        """Hand the unused IDs of the reserved block back to the shared counter, as a bulk add ends.
+
+        A lost write only leaves a gap in the IDs, so it is not synced.
+        """
+        if self.next_record_id is None or self.next_record_id == self.record_id_limit:
+            return
+        with self.lock.locked():
+            state = self.lock.read_state()
+            self.hand_back_record_ids(state)
+            self.lock.write_state(state)
+
+    def scan_record_ids(self):
+        # Appending without loading: new IDs start after the highest stored one
+        self.record_id_floor = max(self.record_id_floor or 0, self.store.max_record_id() + 1)
+
+    def load_lazy_records(self):
+        # Only the offset index is read now; patients are parsed when accessed
+        self.patients.open()
+        self.remember_record_file(self.patients.size)
+        self.snapshot_records = sum(len(offsets) for offsets in self.patients.offsets.values())
+        max_record_id = self.patients.max_record_id
+        for entry in self.read_journal():
+            self.patients.add_pending(self.journal_patient_id(entry), entry)
+            self.journal_entries += 1
+            record_id = split_record_id(entry)[1]
+            if record_id is not None:
+                max_record_id = max(max_record_id, record_id)
+        self.journal_offset = self.journal_checked[1]
+        self.record_id_floor = max(self.record_id_floor or 0, max_record_id + 1)
+        self.ids_unsaved = bool(self.patients.missing_ids)
+        self.records_loaded = True
+
+    def save_records(self):
+        with self.lock.locked():
+            # Changes committed by other processes would be lost with the journal they are in
+            self.catch_up()
+            self.store.rewrite()
+
+    def save_shards(self):
+        # Only the shards whose patients changed are rewritten; call holding the exclusive lock
+        dirty = {number: [] for number in sorted(self.dirty_shards)}
+        for patient in self.patients.values():
+            patients = dirty.get(self.patient_shard(patient.patient_id))
+            if patients is not None:
+                patients.append(patient)
+
+        for number, patients in dirty.items():
+            path = self.shard_files[number]
+            temp_file = path + ".tmp"
+            with open(temp_file, 'w') as file:
+                for patient in patients:
+                    for record in patient.test_records:
+                        file.write(self.format_record_line(patient.patient_id, record) + '\n')
+            durable_replace(temp_file, path)
+            self.remember_record_file(path=path)
+            self.write_snapshot(path, self.index.table, ((patient.patient_id, patient.rows) for patient in patients))
+
+        self.dirty_shards.clear()
+        self.snapshot_records = len(self.index)
+        self.ids_unsaved = False
+        self.clear_journal()
+        self.bump_version(rewritten=True, journal_end=0)
+
+    def bump_version(self, rewritten=False, journal_end=None):
+        # Tell the other processes that the dataset changed, and where the journal's committed
+        # entries now end if it was written; call holding the exclusive lock
+        state = self.lock.read_state()
+        state[1] += 1
+        if rewritten:
+            state[0] += 1
+        if journal_end is not None:
+            state[3] = journal_end
+        self.hand_back_record_ids(state)
+        self.lock.write_state(state)
+        self.seen_state = state[:2]
+
+    def catch_up(self, entries=()):
+        """Apply what other processes committed since this one last read the dataset.
+
+        entries are this process's uncommitted journal entries, already applied
+        in memory. They are taken back, the other changes applied, and then
+        re-applied on top. If one no longer applies, because another process
+        changed or deleted its record first, all of them stay undone and False
+        is returned. Call holding the lock.
+
+        Lines other programs appended to a record file are parsed on their own
+        first, and a record file changed in any other way without a commit
+        saying so is read again in full, so a rewrite never drops them.
+        """
+        state = self.lock.read_state()
+        if not self.records_loaded:
+            return True
+        # After a rewrite the new files are read anyway
+        changed = self.store.changed_files() if state[0] == self.seen_state[0] else []
+        if state[:2] == self.seen_state and not changed:
+            return True
+
+        self.undo_journal_entries(entries)
+        if not all(appended for _, appended in changed):
+            # A record file was rewritten without a commit saying so: read everything again
+            self.reload_records()
+        elif state[0] == self.seen_state[0]:
+            # Only commits and appended lines since: apply them from where this process left off
+            self.store.apply_changes(changed)
+            self.seen_state = state[:2]
+        elif self.shard_count > 1:
+            # Some shards were rewritten and the journal started over: read those shards again
+            self.reload_shards()
+        else:
+            # The record file was rewritten: read everything again
+            self.reload_records()
+
+        applied = []
+        for entry in entries:
+            if not self.entry_applies(entry):
+                self.undo_journal_entries(applied)
+                line = entry.split('\t')[1]
+                print(f"Conflict: another process changed this record first, so the change was not saved: {line}")
+                return False
+            self.apply_journal_entries([entry])
+            applied.append(entry)
+        return True
+
+    def apply_journal_entries(self, entries):
+        # A lazy store keeps them as pending and re-parses the patients when next used
+        for entry in entries:
+            if self.lazy:
+                patient_id = self.journal_patient_id(entry)
+                self.patients.add_pending(patient_id, entry)
+                self.patients.cache.pop(patient_id, None)
+            else:
+                self.apply_journal_entry(entry)
+
+    def entry_applies(self, entry):
+        # Adds always apply; an update or delete only while its record is as this process saw it
+        operation, line = entry.split('\t')[:2]
+        if operation == 'A':
+            return True
+        patient = self.patients.get(self.journal_patient_id(entry))
+        record = self.find_record_by_line(patient, line) if patient is not None else None
+        if record is None:
+            return False
+        with_id = split_record_id(line)[1] is not None
+        return self.format_record_line(record.patient_id, record, with_id) == line
+
+    def reload_records(self):
+        """Drop the loaded records and load the dataset again."""
+        self.records_loaded = False
+        self.journal_entries = self.snapshot_records = 0
+        self.columns = None
+        self.dirty_shards.clear()
+        self.files_seen = {}
+        if not self.lazy:
+            self.index.clear()
+            self.patients = {}
+        self.load_records()
+
+    def reload_shards(self):
+        """Load the shards another process rewrote again, and the journal it started; call holding the lock.
+
+        The rewrite folded every journaled change into the shards it touched, so
+        the other shards are still as loaded and stay in memory.
+        """
+        changed = {number for number, path in enumerate(self.shard_files)
+                   if file_identity(path) != self.files_seen.get(path)}
+        patients = [patient for patient in self.patients.values() if self.patient_shard(patient.patient_id) in changed]
+        for patient in patients:
+            for row in patient.rows:
+                self.index.remove(row)
+            self.index.table.release(patient.rows)
+            del self.patients[patient.patient_id]
+        for number in changed:
+            self.files_seen.pop(self.shard_files[number], None)
+        self.columns = None
+        self.dirty_shards.clear()
+        self.journal_entries = self.journal_offset = 0
+
+        with paused_gc():
+            self.seen_state = self.lock.read_state()[:2]
+            self.load_shard_files([self.shard_files[number] for number in sorted(changed)])
+            self.snapshot_records = len(self.index)
+            self.replay_journal()
+        self.drop_duplicates(patient for patient in self.patients.values()
+                             if self.patient_shard(patient.patient_id) in changed)
+
+    def refresh(self):
+        """Bring the loaded records up to date with the changes other processes committed.
+
+        Not applied inside a batch, whose undo would then run over them.
+        """
+        if self.records_loaded and self.batch_entries is None:
+            with self.lock.shared():
+                self.catch_up()
+
+    def remember_record_file(self, size=None, path=None):
+        # Note which record file (or shard) the loaded records came from, and how many of its bytes
+        path = path or self.record_file
+        identity = file_identity(path)
+        if identity is not None and size is not None:
+            identity = identity[:2] + (size,) + identity[3:]
+        self.files_seen[path] = identity
+
+    def poll_changes(self):
+        """Bring the loaded records up to date with the files; True if anything changed.
+
+        Cheap enough to call every second: when nothing changed it costs a stat()
+        of each record file and a read of the lock file's counters. Lines other
+        programs appended to a record file are parsed on their own, commits of
+        other processes are applied from the journal as in refresh(), and the
+        records are loaded again in full only when a record file was rewritten
+        without a commit saying so; see catch_up().
+        """
+        if not self.records_loaded or self.batch_entries is not None:
+            return False
+        with self.lock.shared():
+            before = self.seen_state, self.journal_offset, dict(self.files_seen)
+            self.catch_up()
+            return (self.seen_state, self.journal_offset, self.files_seen) != before
+
+    def load_record_tail(self, path=None):
+        # Parse only the lines appended to the record file (or a shard) since it was read
+        path = path or self.record_file
+        start = self.files_seen[path][2]
+        with open(path, 'rb') as file:
+            file.seek(start)
+            data = file.read()
+            # A line still being written has no newline yet; it is read on the next poll
+            data = data[:data.rfind(b'\n') + 1]
+            identity = os.fstat(file.fileno())
+        self.files_seen[path] = (identity.st_dev, identity.st_ino, start + len(data), identity.st_mtime_ns)
+        if not data:
+            return
+
+        if self.lazy:
+            count = sum(1 for line in data.splitlines() if line.strip())
+            self.patients.add_lines(data)
+            self.record_id_floor = max(self.record_id_floor or 0, self.patients.max_record_id + 1)
+        else:
+            count = 0
+            patients = {}
+            for line in data.decode().splitlines():
+                if not line.strip():
+                    continue
+                patient_id, test_name, test_date_time, result_value, unit, status, result_date_time, \
+                    record_id = self.parse_record_line(line)
+                patient = patients[patient_id] = self.get_or_create_patient(patient_id)
+                patient.add_test_record(test_name, test_date_time, result_value, unit, status, result_date_time,
+                                        record_id)
+                if record_id is not None:
+                    self.record_id_floor = max(self.record_id_floor or 0, record_id + 1)
+                count += 1
+            self.drop_duplicates(patients.values())
+        self.snapshot_records += count
+
+    def follow(self, on_change=None, interval=1.0, stop=None):
+        """Keep the loaded records current, polling the files every interval seconds.
+
+        on_change() is called after each poll that changed the records. Runs until
+        stop() returns true, or until interrupted when there is no stop.
+        """
+        while stop is None or not stop():
+            if self.poll_changes() and on_change is not None:
+                on_change()
+            time.sleep(interval)
+
+    def snapshot_key(self, record_file=None):
+        """Identify the current record file (or a shard's) by size, mtime and a digest of its head and tail."""
+        record_file = record_file or self.record_file
+        stat = os.stat(record_file)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(record_file, 'rb') as file:
+            digest.update(file.read(65536))
+            if stat.st_size > 65536:
+                file.seek(max(65536, stat.st_size - 65536))
+                digest.update(file.read())
+        return stat.st_size, stat.st_mtime_ns, digest.digest()
+
+    def write_snapshot(self, record_file=None, table=None, patients=None):
+        # patients: (patient ID, rows of table) pairs of the record file, by default every loaded patient
+        if not self.use_snapshot_cache:
+            return
+        if table is None:
+            table = self.index.table
+            patients = ((patient.patient_id, patient.rows) for patient in self.patients.values())
+
+        # The table's columns, gathered in patient order; its string table is saved as it is
+        patient_ids, counts, rows = [], array('q'), array(ROW_TYPE)
+        for patient_id, patient_rows in patients:
+            patient_ids.append(patient_id)
+            counts.append(len(patient_rows))
+            rows.extend(patient_rows)
+
+        def gather(column):
+            return array(column.typecode, map(column.__getitem__, rows))
+
+        name_codes, test_times, record_ids, kinds = gather(table.names), gather(table.test_times), \
+            gather(table.record_ids), gather(table.kinds)
+        integer_positions = array('q', itertools.compress(range(len(rows)), map(VALUE_INT.__eq__, kinds)))
+        text_positions, text_values = array('q'), []
+        test_text_positions, test_texts, result_text_positions, result_texts = array('q'), [], array('q'), []
+        # The few rows with a text of their own, found without a loop over every row in Python
+        texts = table.other_values.keys() | table.test_texts.keys() | table.result_texts.keys()
+        for position in itertools.compress(range(len(rows)), map(texts.__contains__, rows)):
+            row = rows[position]
+            if row in table.other_values:
+                text_positions.append(position)
+                text_values.append(str(table.other_values[row]))
+            if row in table.test_texts:
+                test_text_positions.append(position)
+                test_texts.append(table.test_texts[row])
+            if row in table.result_texts:
+                result_text_positions.append(position)
+                result_texts.append(table.result_texts[row])
+
+        # The date order and the test name and status buckets, so loading restores the indexes as they are
+        date_order = sorted(range(len(rows)), key=record_ids.__getitem__)
+        date_order.sort(key=test_times.__getitem__)
+        status_codes = gather(table.statuses)
+        name_buckets = bucket_positions(name_codes, len(table.strings))
+        status_buckets = bucket_positions(status_codes, len(table.strings))
+        sections = {
+            "patient_ids": patient_ids, "counts": counts, "strings": table.strings,
+            "name_codes": name_codes, "unit_codes": gather(table.units), "status_codes": status_codes,
+            "test_times": test_times, "result_times": gather(table.result_times), "record_ids": record_ids,
+            "values": gather(table.values), "integer_positions": integer_positions,
+            "text_positions": text_positions, "text_values": text_values,
+            "test_text_positions": test_text_positions, "test_texts": test_texts,
+            "result_text_positions": result_text_positions, "result_texts": result_texts,
+            "date_order": array(ROW_TYPE, date_order),
+            "name_counts": array('q', map(len, name_buckets)),
+            "name_positions": array(ROW_TYPE, itertools.chain.from_iterable(name_buckets)),
+            "status_counts": array('q', map(len, status_buckets)),
+            "status_positions": array(ROW_TYPE, itertools.chain.from_iterable(status_buckets))
+        }
+        snapshot_file = self.snapshot_file if record_file is None else record_file + ".cache"
+        try:
+            header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, *self.snapshot_key(record_file))
+            temp_file = snapshot_file + ".tmp"
+            write_sections(temp_file, header, sections)
+            os.replace(temp_file, snapshot_file)
+        except OSError:
+            print("Warning: Could not write the record snapshot cache.")
+
+    def load_snapshot(self):
+        """Load the records from the snapshot cache if it matches the record file.
+
+        The sections become the columns of the index's table as they are, and
+        the indexes are restored from the date order and buckets saved with
+        them, rather than rebuilt.
+        """
+        snapshot = self.read_snapshot()
+        if snapshot is None:
+            return False
+        columns, table = snapshot
+        date_order = columns["date_order"]
+        try:
+            date_keys = array('q', map(table.test_times.__getitem__, date_order))
+        except IndexError:
+            return False  # damaged; the record file is parsed instead
+        self.index.restore(table, columns["record_ids"], date_order, date_keys,
+                           split_buckets(table.strings, columns["name_counts"], columns["name_positions"]),
+                           split_buckets(table.strings, columns["status_counts"], columns["status_positions"]))
+        for patient_id, rows in self.snapshot_patients(columns):
+            self.get_or_create_patient(patient_id).rows.extend(rows)
+        self.snapshot_records = len(table)
+        return True
+
+    def read_snapshot(self, record_file=None):
+        # (sections, RecordTable) of the snapshot cache, or None unless it matches the record file (or shard)
+        # and is whole
+        if not self.use_snapshot_cache:
+            return None
+        snapshot_file = self.snapshot_file if record_file is None else record_file + ".cache"
+        try:
+            header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, *self.snapshot_key(record_file))
+            columns = read_sections(snapshot_file, header)
+            return None if columns is None else (columns, self.snapshot_table(columns))
+        except (OSError, ValueError, KeyError, IndexError, OverflowError, struct.error):
+            return None
+
+    def snapshot_table(self, columns):
+        # The records of the snapshot sections as a RecordTable, rows in snapshot order; mostly array copies
+        table = RecordTable()
+        count = len(columns["record_ids"])
+        for patient_id in columns["patient_ids"]:
+            table.patient_code(patient_id)
+        table.patients = array('i', itertools.chain.from_iterable(
+            map(itertools.repeat, range(len(columns["patient_ids"])), columns["counts"])))
+        for text in columns["strings"]:
+            table.code(text)
+        table.names, table.units, table.statuses = columns["name_codes"], columns["unit_codes"], columns["status_codes"]
+        table.values, table.test_times = columns["values"], columns["test_times"]
+        table.result_times, table.record_ids = columns["result_times"], columns["record_ids"]
+        table.kinds = array('b', bytes(count))
+        for position in columns["integer_positions"]:
+            table.kinds[position] = VALUE_INT
+        for position, text in zip(columns["text_positions"], columns["text_values"]):
+            table.kinds[position] = VALUE_OTHER
+            table.other_values[position] = compact_number(text)
+        table.test_texts = dict(zip(columns["test_text_positions"], columns["test_texts"]))
+        table.result_texts = dict(zip(columns["result_text_positions"], columns["result_texts"]))
+        if not all(len(column) == count for column in (table.patients, table.names, table.units, table.statuses,
+                                                       table.values, table.test_times, table.result_times)):
+            raise ValueError("snapshot columns differ in length")
+        return table
+
+    def snapshot_patients(self, columns):
+        # Yield (patient ID, rows) for each patient of the snapshot sections, whose rows are consecutive
+        start = 0
+        for patient_id, count in zip(columns["patient_ids"], columns["counts"]):
+            if not count:
+                continue  # the text file has no line for patients without records
+            yield patient_id, array(ROW_TYPE, range(start, start + count))
+            start += count
+
+    def read_journal(self, start=0):
+        """Yield the journal entries from byte offset start, leaving out what a crash left half-written.
+
+        Afterwards journal_checked holds the file size read and where its
+        complete entries end, so the next append can cut off a torn tail first.
+        """
+        position = valid_end = start
+        try:
+            with open(self.journal_file, 'rb') as file:
+                file.seek(start)
+                block = None  # entries of the block being read
+                for line in file:
+                    position += len(line)
+                    if not line.endswith(b'\n'):
+                        break  # the last line was torn mid-append
+                    entry = line.decode().rstrip('\r\n')
+                    if not entry.strip():
+                        continue
+                    if entry == 'B':
+                        if block is not None:
+                            print(f"Warning: Skipping {len(block)} journal entries of an incomplete batch.")
+                        block = []
+                    elif entry.startswith('E\t'):
+                        if block is not None and entry == journal_block_end(block):
+                            yield from block
+                        else:
+                            print("Warning: Skipping a journal batch that does not match its checksum.")
+                        block = None
+                        valid_end = position
+                    elif block is not None:
+                        block.append(entry)
+                    else:
+                        yield entry
+                        valid_end = position
+                if block is not None:
+                    print(f"Warning: Skipping {len(block)} journal entries of an incomplete batch.")
+        except FileNotFoundError:
+            pass  # No changes since the last snapshot
+        self.journal_checked = (position, valid_end)
+
+    def replay_journal(self):
+        unnumbered = []  # records added by entries written before IDs existed
+        for entry in self.read_journal():
+            record = self.apply_journal_entry(entry)
+            if record is not None and record.record_id is None:
+                unnumbered.append(record)
+            self.journal_entries += 1
+        self.journal_offset = self.journal_checked[1]
+        self.number_records(unnumbered)
+
+    def journal_patient_id(self, entry):
+        return entry.split('\t', 2)[1].split(': ', 1)[0]
+
+    def apply_journal_entry(self, entry, patient=None):
+        # Entries are "A<TAB>line", "D<TAB>line" or "U<TAB>old line<TAB>new line";
+        # patient is passed when a lazy store replays entries for that patient.
+        # Returns the record an add created
+        parts = entry.rstrip('\n').split('\t')
+        operation = parts[0]
+
+        if operation == 'A':
+            patient_id, *fields = self.parse_record_line(parts[1])
+            self.dirty_shards.add(self.patient_shard(patient_id))
+            return (patient or self.get_or_create_patient(patient_id)).add_test_record(*fields)
+
+        elif operation in ('D', 'U'):
+            patient_id = parts[1].split(': ', 1)[0]
+            self.dirty_shards.add(self.patient_shard(patient_id))
+            patient = patient or self.patients.get(patient_id)
+            record = self.find_record_by_line(patient, parts[1]) if patient else None
+            if record is None:
+                print(f"Warning: Skipping journal entry for a missing record: {entry.strip()}")
+                return
+
+            if operation == 'D':
+                patient.delete_record(record)
+            else:
+                _, *fields = self.parse_record_line(parts[2])
+                keys = ("test_name", "test_date_time", "result_value", "unit", "status", "result_date_time")
+                patient.update_record(record, **dict(zip(keys, fields)))
+        else:
+            print(f"Warning: Skipping unknown journal entry: {entry.strip()}")
+
+    def find_record_by_line(self, patient, line):
+        content, record_id = split_record_id(line)
+        if record_id is not None:
+            if patient.index is not None:
+                return patient.index.get(record_id)
+            return next((record for record in patient.test_records if record.record_id == record_id), None)
+
+        # Entries written before records had IDs match on the fields
+        for record in patient.test_records:
+            if self.format_record_line(patient.patient_id, record, with_id=False) == content:
+                return record
+        return None
+
+    def record_by_id(self, record_id, patient_id=None):
+        """Look a record up by its ID; in lazy mode pass its patient ID to avoid a full scan.
+
+        With the records not loaded, the store reads the record (see
+        RecordStore.fetch_record()), so a database changes one row without
+        loading the others.
+        """
+        if not self.records_loaded:
+            record = self.index.get(record_id) if self.index is not None else None
+            return record if record is not None else self.store.fetch_record(record_id, patient_id)
+        if self.index is not None:
+            return self.index.get(record_id)
+        if patient_id is None:
+            patients = self.patients.values()
+        else:
+            patients = [self.patients[patient_id]] if patient_id in self.patients else []
+        for patient in patients:
+            for record in patient.test_records:
+                if record.record_id == record_id:
+                    return record
+        return None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Apply the adds, updates and deletes made inside the block in memory, and persist them once.
+
+        They are written when the block ends, as one journal block with a single
+        fsync (or one rewrite of the record file when journaling is off), and
+        undone if it raises. If another process changed one of the same records
+        first, nothing is saved and ConflictError is raised. A nested batch
+        joins the outer one.
+        """
+        if self.batch_entries is not None:
+            yield self
+            return
+
+        self.batch_entries = []
+        try:
+            yield self
+        except BaseException:
+            entries, self.batch_entries = self.batch_entries, None
+            self.undo_journal_entries(entries)
+            raise
+        entries, self.batch_entries = self.batch_entries, None
+        if entries and not self.persist_journal(entries):
+            raise ConflictError("The batch was not saved: another process changed some of its records first.")
+
+    def undo_journal_entries(self, entries):
+        # Roll back changes that were applied in memory but never persisted, newest first
+        if self.lazy:
+            # The store already holds them as pending entries: drop those and re-parse the patients
+            for entry in reversed(entries):
+                patient_id = self.journal_patient_id(entry)
+                pending = self.patients.pending[patient_id]
+                del pending[len(pending) - 1 - pending[::-1].index(entry)]
+                self.patients.cache.pop(patient_id, None)
+                if not pending and patient_id not in self.patients.offsets:
+                    # A patient the batch created
+                    del self.patients.pending[patient_id]
+                    self.patients.known.pop(patient_id, None)
+            return
+
+        for entry in reversed(entries):
+            operation, *lines = entry.split('\t')
+            if operation == 'A':
+                self.apply_journal_entry(f"D\t{lines[0]}")
+            elif operation == 'D':
+                self.apply_journal_entry(f"A\t{lines[0]}")
+            else:
+                self.apply_journal_entry(f"U\t{lines[1]}\t{lines[0]}")
+
+    def write_journal(self, entries):
+        """Append mutation entries to the journal, or rewrite the file when journaling is off.
+
+        Inside batch() they are only collected, and written when the batch ends.
+        """
+        # A lazy store re-applies these if the patient is evicted and parsed again,
+        # also during a batch, which may evict patients it changed
+        if self.lazy:
+            for entry in entries:
+                self.patients.add_pending(self.journal_patient_id(entry), entry)
+
+        if self.batch_entries is not None:
+            self.batch_entries.extend(entries)
+            return True
+        return self.persist_journal(entries)
+
+    def persist_journal(self, entries):
+        # Returns False, with the entries undone, when another process changed their records first
+        with self.lock.locked():
+            if not self.catch_up(entries):
+                return False
+            self.dirty_shards.update(self.patient_shard(self.journal_patient_id(entry)) for entry in entries)
+            if not self.store.commit(entries):
+                return True  # everything was rewritten instead
+        self.journal_entries += len(entries)
+
+        # Fold the journal back once it outgrows the snapshot, which keeps the
+        # amortized cost per write constant and bounds the replay time
+        if self.records_loaded and self.journal_entries >= max(self.compact_min_entries, self.snapshot_records):
+            self.compact_records()
+        return True
+
+    def check_journal_tail(self, file, size):
+        """Find where the complete entries of the open journal file end, into journal_checked.
+
+        Only what follows the end of the last commit, as kept in the lock file,
+        is read: at most what one crashed writer left. The whole journal is read
+        only when that end is unknown or does not fit this file. Call holding the
+        exclusive lock.
+        """
+        start = self.lock.read_state()[3]
+        if start > size:
+            start = 0
+        elif start:
+            file.seek(start - 1)
+            if file.read(1) != b'\n':
+                start = 0  # not an entry boundary: the lock file is older than the journal
+        for _ in self.read_journal(start):
+            pass
+
+    def check_journal_size(self, journal_size):
+        # Only a process with the records loaded can fold the journal back, so one that writes
+        # without loading them asks for a compaction once the journal outgrows the record file
+        record_size = sum(os.path.getsize(path) for path in self.shard_files if os.path.exists(path))
+        if journal_size >= max(record_size, self.compact_min_entries * JOURNAL_ENTRY_BYTES):
+            print(f"Note: the journal ({journal_size} bytes) has outgrown the record file; "
+                  f"run 'python main.py compact' to fold it back.")
+
+    def compact_records(self):
+        """Fold the journal into a fresh snapshot of the record file."""
+        self.store.compact()
+
+    def clear_journal(self):
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.journal_entries = 0
+        self.journal_checked = (0, 0)
+        self.journal_offset = 0
+
+    def is_valid_patient_id(self, patient_id):
+        return is_valid_patient_id(patient_id)
+
+    def is_valid_test_name(self, test_name):
+        # Assuming a fixed length of 20 characters for test name
+        return len(test_name) <= 20
+
+    def is_valid_date_time(self, date_time_str):
+        error = date_time_error(date_time_str)
+        if error:
+            print(error)
+            return False
+        return True
+
+    def is_valid_numeric(self, value):
+        return is_numeric(value)
+
+    def is_valid_unit(self, unit):
+        # Assuming a fixed length of 10 characters for unit
+        return len(unit) <= 10
+
+    def is_valid_status(self, status):
+        return status in self.valid_statuses
+
+    def add_test_record(self, patient_id, test_name, test_date_time, result_value, unit, status, result_date_time=None):
+        """Add a record; returns False when the duplicate policy turned it away."""
+        record = TestRecord(patient_id, test_name, test_date_time, result_value, unit, status, result_date_time)
+        duplicate = self.find_duplicate(record)
+        if duplicate is not None and self.duplicate_policy != "count":
+            if self.duplicate_policy == "reject":
+                print(f"Duplicate record: the same test is stored as record ID {duplicate.record_id}.")
+                return False
+            print(f"Test record already stored as record ID {duplicate.record_id}; not added again.")
+            return True
+
+        record.record_id = self.new_record_id()
+        self.get_or_create_patient(patient_id).add_record(record)
+        if not self.write_journal([f"A\t{self.format_record_line(patient_id, record)}"]):
+            return False
+        print(f"Test record added successfully (record ID {record.record_id}).")
+        if duplicate is not None:
+            print(f"Note: it duplicates record ID {duplicate.record_id}.")
+        return True
+
+    def find_duplicate(self, record, unsaved=()):
+        """A stored record with the same content as this one, or None.
+
+        unsaved are more records of the patient to compare with, added but not in memory.
+        """
+        key = record.content_key()
+        duplicates = self.duplicate_index()
+        if duplicates is not None and record not in duplicates and not unsaved:
+            return None  # the hash rules it out without looking at the patient
+        for other in itertools.chain(self.stored_records(record.patient_id), unsaved):
+            if other != record and other.content_key() == key:
+                return other
+        return None
+
+    def stored_records(self, patient_id):
+        # A patient's records, read on their own from the record file and journal when nothing is loaded
+        patient = self.patients.get(patient_id)
+        records = patient.test_records if patient is not None else []
+        if self.records_loaded:
+            return records
+        return records + self.store.patient_records(patient_id)
+
+    def duplicate_index(self):
+        """The DuplicateIndex of the loaded records, built once and then kept current by the index.
+
+        None in lazy mode or before the records are loaded.
+        """
+        if self.index is None or not self.records_loaded:
+            return None
+        if self.index.duplicates is None:
+            duplicates = DuplicateIndex(TestRecord.content_key)
+            duplicates.add_many(self.index)
+            self.index.duplicates = duplicates
+        return self.index.duplicates
+
+    def duplicate_count(self):
+        """Loaded records whose content repeats another loaded record, or None if not known."""
+        duplicates = self.duplicate_index()
+        return None if duplicates is None else duplicates.duplicates
+
+    def drop_duplicates(self, patients):
+        # Under the skip and reject policies, loaded copies of an earlier record are left out
+        if self.duplicate_policy == "count":
+            return
+        for patient in patients:
+            seen = set()
+            for record in list(patient.test_records):
+                key = record.content_key()
+                if key not in seen:
+                    seen.add(key)
+                    continue
+                patient.delete_record(record)
+                if self.duplicate_policy == "reject":
+                    print(f"Warning: Skipping duplicate record: {self.format_record_line(patient.patient_id, record)}")
+
+    def dedupe_records(self, max_entries=DEDUPE_MAX_ENTRIES):
+        """Remove the duplicate lines from the record file without loading it, in bounded memory."""
+        if self.records_loaded:
+            print("Remove duplicates before loading the records.")
+            return
+        result = self.store.dedupe(max_entries)
+        if result is not None:
+            kept, dropped = result
+            print(f"Duplicates removed: {dropped} dropped, {kept} records kept.")
+
+    def update_test_record(self, patient_id, test_name, **kwargs):
+        if patient_id not in self.patients:
+            print("Patient ID does not exist.")
+            return
+
+        # Retrieve the current record
+        patient = self.patients[patient_id]
+        record_found = False
+        for record in patient.test_records:
+            if record["test_name"] == test_name:
+                record_found = True
+                old_line = self.format_record_line(patient_id, record)
+                patient.update_record(record, **self.validated_changes(kwargs))
+
+                # Save changes after updating
+                if self.write_journal([f"U\t{old_line}\t{self.format_record_line(patient_id, record)}"]):
+                    print("Test record updated successfully.")
+                break
+
+        if not record_found:
+            print("Test record not found.")
+
+    def update_record_by_id(self, record_id, patient_id=None, **kwargs):
+        """Update the record with this ID; invalid new values are reported and left unchanged."""
+        record = self.record_by_id(record_id, patient_id)
+        if record is None:
+            print("Test record not found.")
+            return False
+
+        old_line = self.format_record_line(record.patient_id, record)
+        self.patients[record.patient_id].update_record(record, **self.validated_changes(kwargs))
+        if not self.write_journal([f"U\t{old_line}\t{self.format_record_line(record.patient_id, record)}"]):
+            return False
+        print("Test record updated successfully.")
+        return True
+
+    def delete_record_by_id(self, record_id, patient_id=None):
+        """Delete the record with this ID."""
+        record = self.record_by_id(record_id, patient_id)
+        if record is None:
+            print("No matching record found.")
+            return False
+
+        self.patients[record.patient_id].delete_record(record)
+        if not self.write_journal([f"D\t{self.format_record_line(record.patient_id, record)}"]):
+            return False
+        print("Record deleted successfully.")
+        return True
+
+    def validated_changes(self, kwargs):
+        # Keep the new field values that pass validation, reporting the others
+        changes = {}
+        if 'test_date_time' in kwargs:
+            if self.is_valid_date_time(kwargs['test_date_time']):
+                changes['test_date_time'] = kwargs['test_date_time']
+            else:
+                print("Invalid Test Date and Time format.")
+
+        if 'result_value' in kwargs:
+            if self.is_valid_numeric(kwargs['result_value']):
+                changes['result_value'] = kwargs['result_value']
+            else:
+                print("Invalid Result Value. It should be a numeric value.")
+
+        if 'unit' in kwargs:
+            if self.is_valid_unit(kwargs['unit']):
+                changes['unit'] = kwargs['unit']
+            else:
+                print("Invalid Unit. It should not exceed the maximum length.")
+
+        if 'status' in kwargs:
+            if self.is_valid_status(kwargs['status']):
+                changes['status'] = kwargs['status']
+            else:
+                print("Invalid Status. It should be one of 'Pending', 'Completed', 'Reviewed'.")
+
+        if 'result_date_time' in kwargs:
+            if kwargs['result_date_time'] == "" or self.is_valid_date_time(kwargs['result_date_time']):
+                changes['result_date_time'] = kwargs['result_date_time'] if kwargs['result_date_time'] else None
+            else:
+                print("Invalid Result Date and Time format.")
+        return changes
+
+    def delete_record(self, patient_id, test_name, test_date_time, result_value, unit, status, result_date_time):
+        # Check if the patient ID exists in the patients dictionary
+        if patient_id in self.patients:
+            patient = self.patients[patient_id]
+
+            # Flag to check if any record was found and deleted
+            record_found = False
+
+            # Remove every record with matching details
+            deleted_lines = []
+            for record in list(patient.test_records):
+                if (record['test_name'] == test_name and
+                        record['test_date_time'] == test_date_time and
+                        record['result_value'] == result_value and
+                        record['unit'] == unit and
+                        record['status'] == status and
+                        (record['result_date_time'] if record['result_date_time'] else '') == result_date_time):
+                    record_found = True
+                    deleted_lines.append(f"D\t{self.format_record_line(patient_id, record)}")
+                    patient.delete_record(record)
+
+            # Save the updated records
+            if deleted_lines and not self.write_journal(deleted_lines):
+                return
+
+            if record_found:
+                print("Record deleted successfully.")
+            else:
+                print("No matching record found.")
+        else:
+            print("Patient ID not found.")
+
+    #def search_by_patient_id(self, patient_id):
+    #   if patient_id in self.patients:
+    #       return self.patients[patient_id].test_records
+    #   return []
+
+    # def search_up_normal_tests(self, test_name):
+    # result = []
+    # for patient in self.patients.values():
+    #     for record in patient.test_records:
+    #         if record['test_name'] == test_name:
+    #             # Load normal ranges for the test
+    #             file = open(self.test_file, 'r')
+    #             try:
+    #                 for line in file:
+    #                     test_data = line.strip().split(';')
+    #                     if test_data[0] == test_name:
+    #                         normal_range = test_data[1]
+    #                         break
+    #             finally:
+    #                 file.close()
+    #             # Check if the result is abnormal
+    #             normal_ranges = normal_range.split(',')
+    #             is_up_normal = False
+    #             for condition in normal_ranges:
+    #                 operator = condition[0]
+    #                 value = float(condition[1:])
+    #                 if operator == '>' and float(record['result_value']) <= value:
+    #                     is_up_normal = True
+    #                     break
+    #                 elif operator == '<' and float(record['result_value']) >= value:
+    #                     is_up_normal = True
+    #                     break
+    #             if is_up_normal:
+    #                 result.append(record)
+    # return result
+
+    def compile_range(self, range_values):
+        # Turn '> 13.8, < 17.2' into (min, min_inclusive, max, max_inclusive)
+        min_range = max_range = None
+        min_inclusive = max_inclusive = False
+        for condition in range_values.split(','):
+            condition = condition.strip()
+            operator = condition[:2] if condition[:2] in ('>=', '<=') else condition[:1]
+            try:
+                value = float(condition[len(operator):].strip())
+            except ValueError:
+                print(f"Warning: Ignoring invalid range condition: {condition}")
+                continue
+
+            if operator in ('>', '>='):
+                min_range, min_inclusive = value, operator == '>='
+            elif operator in ('<', '<='):
+                max_range, max_inclusive = value, operator == '<='
+            else:
+                print(f"Warning: Ignoring invalid range condition: {condition}")
+        return min_range, min_inclusive, max_range, max_inclusive
+
+    def catalog_table(self, field):
+        """Map every catalog test name, and its abbreviation, to one field of the test."""
+        if not self.tests:
+            self.load_test()
+
+        table = {}
+        for name, test in self.tests.items():
+            table[name] = test[field]
+
+            # Records use the short name, e.g. 'LDL' for '... (LDL)'
+            abbreviation = re.search(r'\(([^()]+)\)\s*$', name)
+            if abbreviation:
+                table.setdefault(abbreviation.group(1).strip(), test[field])
+        return table
+
+    def load_test_ranges(self):
+        """Return the compiled range table, building it from the catalog only once."""
+        if self.test_ranges is None:
+            self.test_ranges = self.catalog_table("bounds")
+        return self.test_ranges
+
+    def load_test_turnarounds(self):
+        """Return the expected turnaround in minutes per test name, building it only once."""
+        if self.test_turnarounds is None:
+            self.test_turnarounds = self.catalog_table("turnaround_minutes")
+        return self.test_turnarounds
+
+    def is_abnormal(self, test_name, result_value, test_ranges=None):
+        """Check a numeric result against the compiled range of its test."""
+        bounds = (test_ranges if test_ranges is not None else self.load_test_ranges()).get(test_name)
+        if bounds is None:
+            return False  # Tests without a reference range cannot be abnormal
+
+        min_range, min_inclusive, max_range, max_inclusive = bounds
+        if min_range is not None and (result_value < min_range if min_inclusive else result_value <= min_range):
+            return True
+        if max_range is not None and (result_value > max_range if max_inclusive else result_value >= max_range):
+            return True
+        return False
+
+    def filter_medical_tests(self, return_records=False):
+        filtered_records = self.find_records(self.prompt_filter_query())
+
+        # Return or display the filtered records
+        if return_records:
+            return filtered_records
+        else:
+            if filtered_records:
+                self.display_records(filtered_records)
+            else:
+                print("No matching records found.")
+
+    def prompt_filter_query(self):
+        """Ask which filters to apply and their values; returns the Query."""
+        print("\nFilter Medical Tests - Options:")
+        print("1. Filter by Patient ID")
+        print("2. Filter by Test Name")
+        print("3. Filter by Abnormal Tests")
+        print("4. Filter by Date Range")
+        print("5. Filter by Test Status")
+        print("6. Filter by Turnaround Time Range")
+
+        # Collect user choices for each filter
+        filter_options = {
+            'patient_id': int(input("Apply Filter by Patient ID? (1/0): ")),
+            'test_name': int(input("Apply Filter by Test Name? (1/0): ")),
+            'abnormal_tests': int(input("Apply Filter by Abnormal Tests? (1/0): ")),
+            'date_range': int(input("Apply Filter by Date Range? (1/0): ")),
+            'test_status': int(input("Apply Filter by Test Status? (1/0): ")),
+            'turnaround_time': int(input("Apply Filter by Turnaround Time Range? (1/0): "))
+        }
+
+        criteria = {'abnormal': bool(filter_options['abnormal_tests'])}
+        if filter_options['patient_id']:
+            criteria['patient_id'] = input("Enter Patient ID: ").strip() or None
+
+        if filter_options['test_name']:
+            criteria['test_name'] = input("Enter Test Name: ").strip() or None
+
+        if filter_options['date_range']:
+            start_date = input("Enter start date (YYYY-MM-DD): ").strip()
+            end_date = input("Enter end date (YYYY-MM-DD): ").strip()
+            if start_date and end_date:
+                criteria['start_date'], criteria['end_date'] = start_date, end_date
+
+        if filter_options['test_status']:
+            criteria['status'] = input("Enter Test Status: ").strip() or None
+
+        if filter_options['turnaround_time']:
+            criteria['min_turnaround'] = float(input("Enter minimum turnaround time (in minutes): ").strip())
+            criteria['max_turnaround'] = float(input("Enter maximum turnaround time (in minutes): ").strip())
+        return Query(**criteria)
+
+    def plan_candidates(self, patient_id, test_name, start_time, end_time, status):
+        """Pick the smallest candidate set among the indexes that apply to the query.
+
+        Returns (size, candidates); size is None when every record has to be scanned.
+        The candidates come in result order (see record_order()), except for the
+        scan of a lazy store, which goes patient by patient.
+        """
+        plans = []
+        if patient_id is not None:
+            patient = self.patients.get(patient_id)
+            records = patient.test_records if patient else []
+            if patient and start_time is not None:
+                # A patient's records are sorted by test time, so narrow them by bisect
+                records = patient.records_between(start_time, end_time)
+            plans.append((len(records), lambda: in_record_order(records)))
+
+        # Lazy mode has no global indexes: use the patient's records or scan everything
+        if self.index is None:
+            if plans:
+                return plans[0][0], plans[0][1]()
+            return None, (record for patient in self.patients.values() for record in patient.test_records)
+
+        # A bucket's size counts the records removed since the last compaction too; close enough to plan with
+        if test_name is not None:
+            plans.append((len(self.index.by_test_name.get(test_name, ())),
+                          lambda: self.index.ordered_bucket("test_name", test_name)))
+        if status is not None:
+            plans.append((len(self.index.by_status.get(status, ())), lambda: self.index.ordered_bucket("status", status)))
+        if start_time is not None:
+            low, high = self.index.date_bounds(start_time, end_time)
+            plans.append((high - low, lambda: self.index.records_in_date_range(start_time, end_time)))
+
+        if not plans:
+            return len(self.index), self.index.iter_date_order()
+        size, candidates = min(plans, key=lambda plan: plan[0])
+        return size, candidates()
+
+    def find_records(self, query=None, **criteria):
+        """Return dict copies (with 'patient_id') of the records matching a Query and every given criterion."""
+        if query is not None:
+            if query.operator is not None or criteria:
+                return [record.copy() for record in self.select(query, **criteria)]
+            criteria = query.criteria
+        records = self.cached_query("filter", (), criteria, lambda: list(self.iter_records(**criteria)))
+        return [record.copy() for record in records]
+
+    def query_key(self, kind, group_by, criteria):
+        """Cache key of a query: equivalent criteria (defaults, date spellings, number types) share one."""
+        criteria = {**QUERY_DEFAULTS, **criteria}
+        dates = None
+        if criteria['start_date'] is not None and criteria['end_date'] is not None:
+            dates = date_range_minutes(criteria['start_date'], criteria['end_date'])
+            if None in dates:
+                return None  # invalid dates are reported by the query itself
+        turnaround = tuple(None if bound is None else float(bound)
+                           for bound in (criteria['min_turnaround'], criteria['max_turnaround']))
+        return (kind, tuple(group_by), criteria['patient_id'], criteria['test_name'], bool(criteria['abnormal']),
+                dates, criteria['status']) + turnaround
+
+    def cached_query(self, kind, group_by, criteria, compute):
+        """Return compute()'s result for this query from the query cache, computing it on a miss."""
+        key = self.query_key(kind, group_by, criteria) if self.query_cache is not None and self.records_loaded else None
+        if key is None:
+            return compute()
+        result = self.query_cache.get(key, MISSING)
+        if result is MISSING:
+            result = compute()
+            self.query_cache.put(key, result, criteria.get('patient_id'), criteria.get('test_name'),
+                                 bool(criteria.get('abnormal')))
+        return result
+
+    def query_plan(self, **criteria):
+        """Plan a filter: (candidate count, candidates, record_matcher() arguments), or None if invalid."""
+        query = self.planned_criteria(**criteria)
+        if query is None:
+            return None
+        size, candidates = self.plan_candidates(query['patient_id'], query['test_name'], query['start_time'],
+                                                query['end_time'], query['status'])
+        return size, candidates, query
+
+    def planned_criteria(self, patient_id=None, test_name=None, abnormal=False, start_date=None, end_date=None,
+                         status=None, min_turnaround=None, max_turnaround=None):
+        """Turn filter criteria into record_matcher() arguments, with the dates in epoch minutes; None if invalid."""
+        start_time = end_time = None
+        if start_date is not None and end_date is not None:
+            start_time, end_time = date_range_minutes(start_date, end_date)
+            if start_time is None or end_time is None:
+                print("Invalid date range. Please use YYYY-MM-DD.")
+                return None
+        return dict(patient_id=patient_id, test_name=test_name, status=status, start_time=start_time,
+                    end_time=end_time, abnormal=abnormal, min_turnaround=min_turnaround,
+                    max_turnaround=max_turnaround)
+
+    def record_matcher(self, **query):
+        """Compile the predicate checking one record against every criterion of a planned query."""
+        planned = {**QUERY_DEFAULTS, 'start_time': None, 'end_time': None, **query}
+        return compile_matcher(Query(), lambda leaf: planned, self.abnormal_check() if planned['abnormal'] else None)
+
+    def abnormal_check(self):
+        """The abnormal-result criterion of compiled queries, with the reference ranges compiled once."""
+        test_ranges = self.load_test_ranges()
+        is_abnormal = self.is_abnormal
+
+        def abnormal(record):
+            test_name, result_value = record.test_name, record.result_value
+            if not (test_name and result_value):
+                return False
+            try:
+                return is_abnormal(test_name, float(result_value), test_ranges)
+            except ValueError:
+                print(f"Invalid result value for test '{record.test_name}' in record: {record}")
+                return False
+
+        return abnormal
+
+    def select(self, query=None, **criteria):
+        """Lazily yield the stored records matching a Query and every given criterion, without copying them.
+
+        Plain criteria take the fastest path of iter_records(). A combined query is
+        compiled into one predicate and checked against the candidates its parts
+        narrow it to: an AND needs those of its most selective part, an OR the
+        union of all its parts' ones, and a NOT scans every record.
+        """
+        if criteria:
+            query = Query(**criteria) if query is None else query & Query(**criteria)
+        if query is None or query.operator is None:
+            yield from self.iter_records(**(query.criteria if query is not None else {}))
+            return
+        if not self.records_loaded:
+            yield from self.select_stored(query)
+            return
+
+        planned = self.plan_leaves(query)
+        if planned is None:
+            return
+        narrowed = self.narrow_query(query, planned)
+        candidates = narrowed[1] if narrowed is not None else self.plan_candidates(None, None, None, None, None)[1]
+        matches = filter(self.query_matcher(query, planned), candidates)
+        if narrowed is None and self.index is None:
+            matches = self.sort_records(matches)  # a lazy scan goes patient by patient
+        yield from matches
+
+    def sort_records(self, records):
+        """Sort records into result order (see record_order()) in bounded memory.
+
+        Past SORT_RUN_ITEMS records, sorted runs spill to temporary files as record
+        lines, so the records merged back from them are copies.
+        """
+        return sorted_in_runs(records, record_order,
+                              lambda record: self.format_record_line(record.patient_id, record),
+                              lambda line: TestRecord(*self.parse_record_line(line)))
+
+    def plan_leaves(self, query):
+        # planned_criteria() of each plain-criteria part of a query, by id(); None if one is invalid
+        planned = {}
+        for leaf in query.leaves():
+            planned[id(leaf)] = self.planned_criteria(**leaf.criteria)
+            if planned[id(leaf)] is None:
+                return None
+        return planned
+
+    def query_matcher(self, query, planned):
+        uses_ranges = any(criteria['abnormal'] for criteria in planned.values())
+        return compile_matcher(query, lambda leaf: planned[id(leaf)], self.abnormal_check() if uses_ranges else None)
+
+    def select_stored(self, query):
+        # Without loaded records the store reads the matches itself (see RecordStore.select())
+        planned = self.plan_leaves(query)
+        if planned is not None:
+            yield from self.store.select(query, planned)
+
+    def narrow_query(self, query, planned):
+        # (size, candidates) the indexes narrow a combined query to, or None when every record has to be checked
+        if query.operator is None:
+            criteria = planned[id(query)]
+            if all(criteria[field] is None for field in ('patient_id', 'test_name', 'status', 'start_time')):
+                return None
+            size, candidates = self.plan_candidates(criteria['patient_id'], criteria['test_name'],
+                                                    criteria['start_time'], criteria['end_time'], criteria['status'])
+            return None if size is None else (size, candidates)
+        if query.operator == 'not':
+            return None
+
+        plans = [self.narrow_query(part, planned) for part in query.parts]
+        if query.operator == 'and':
+            return min((plan for plan in plans if plan is not None), key=lambda plan: plan[0], default=None)
+        if None in plans:
+            return None
+        # Each part's candidates are in result order, so merging them keeps it; a record several
+        # parts share comes out of the merge once per part, one after the other (as equal views of its row)
+        merged = heapq.merge(*(candidates for _, candidates in plans), key=record_order)
+        union = (next(copies) for _, copies in itertools.groupby(merged))
+        return sum(size for size, _ in plans), union
+
+    def iter_records(self, **criteria):
+        """Yield the stored records matching every given criterion (see query_plan), without copying them.
+
+        Every path yields them in the same order: by test time, then by record ID.
+        """
+        if not self.records_loaded:
+            yield from self.select_stored(Query(**criteria))
+            return
+
+        # Start from the most selective index; checking the remaining criteria
+        # on its candidates intersects it with the other indexes
+        plan = self.query_plan(**criteria)
+        if plan is None:
+            return
+        size, candidates, query = plan
+
+        # Too many candidates to check one by one: evaluate the criteria as column masks
+        columns = self.column_view() if size is not None and size >= COLUMN_SCAN_MIN else None
+        if columns is not None:
+            test_ranges = self.load_test_ranges() if query['abnormal'] else None
+            positions = columns.select(query['patient_id'], query['test_name'], query['status'],
+                                       query['start_time'], query['end_time'], test_ranges,
+                                       query['min_turnaround'], query['max_turnaround'])
+            yield from columns.records(positions)
+            return
+
+        # Or split the candidates across worker processes; the slices come back in candidate order
+        if self.use_shards(size):
+            candidates = list(candidates)
+            for position in itertools.chain.from_iterable(self.run_sharded(query, candidates)):
+                yield candidates[position]
+            return
+
+        matches = filter(self.record_matcher(**query), candidates)
+        if size is None and self.index is None:
+            matches = self.sort_records(matches)  # a lazy scan goes patient by patient
+        yield from matches
+
+    def use_shards(self, size):
+        # Forked workers share the loaded records; lazy stores and small scans stay in this process
+        return (self.query_workers > 1 and self.index is not None and size is not None
+                and size >= SHARD_SCAN_MIN and 'fork' in multiprocessing.get_all_start_methods())
+
+    def run_sharded(self, query, candidates, group_by=None):
+        """Run a planned query on its candidate records in a fork-based pool; one run_shard() result per slice.
+
+        Only the candidates are checked, so an indexed criterion narrows the
+        work of every worker, not just of this process.
+        """
+        global shard_system, shard_candidates
+        # One slice per worker: every extra slice is one more partial result to merge here
+        step = max(1, -(-len(candidates) // self.query_workers))
+        starts = range(0, len(candidates), step)
+        shard_system, shard_candidates = self, candidates
+        gc.freeze()  # keep the collector from touching (and so copying) the shared pages
+        try:
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=self.query_workers, mp_context=context) as executor:
+                return list(executor.map(run_shard, starts, [min(start + step, len(candidates)) for start in starts],
+                                         itertools.repeat(query), itertools.repeat(group_by)))
+        finally:
+            gc.unfreeze()
+            shard_system = shard_candidates = None
+
+    def column_view(self):
+        """The NumPy column view of the loaded records, or None without NumPy or in lazy mode."""
+        if not self.use_columns:
+            return None
+        if self.columns is None or self.columns.version != self.index.version:
+            # The date index already holds every record in test-time order
+            self.columns = RecordColumns(self.index.table, self.index.date_rows(), NO_TIME, self.index.version)
+        return self.columns
+
+    def test_deadline(self, record):
+        """When a pending test is due: test time plus the catalog turnaround, or None."""
+        if record.status.lower() != 'pending' or record.test_time is None:
+            return None
+        expected = self.load_test_turnarounds().get(record.test_name)
+        return None if expected is None else record.test_time + expected
+
+    def sla_monitor(self):
+        """The SlaMonitor of the pending tests, built once and then kept current by the index."""
+        self.load_test_turnarounds()
+        if self.index is None:
+            # Lazy mode has no index to keep a monitor current, so scan for a fresh one
+            monitor = SlaMonitor(self.test_deadline)
+            monitor.add_many(record for patient in self.patients.values() for record in patient.test_records)
+            return monitor
+
+        if self.index.monitor is None:
+            monitor = SlaMonitor(self.test_deadline)
+            for status in self.index.by_status:
+                if status.lower() == 'pending':
+                    monitor.add_many(self.index.with_status(status))
+            self.index.monitor = monitor
+        return self.index.monitor
+
+    def overdue_tests(self, now=None):
+        """(deadline, record) of the pending tests past their expected turnaround, most overdue first."""
+        return self.sla_monitor().overdue(now_minutes() if now is None else now)
+
+    def display_records(self, records):
+        if records:
+            for record in records:
+                # Print each record's details
+                print(f"Record ID: {record.get('record_id', 'N/A')}, "
+                      f"Patient ID: {record.get('patient_id', 'N/A')}, "
+                      f"Test Name: {record.get('test_name', 'N/A')}, "
+                      f"Date/Time: {record.get('test_date_time', 'N/A')}, "
+                      f"Result: {record.get('result_value', 'N/A')}, "
+                      f"Unit: {record.get('unit', 'N/A')}, "
+                      f"Status: {record.get('status', 'N/A')}, "
+                      f"Result Date/Time: {record.get('result_date_time', 'N/A')}")
+        else:
+            print("No records found matching the criteria.")
+
+    def calculate_turnaround_time(self, record):
+        """Calculate turnaround time in minutes based on test and result dates."""
+        # Records carry epoch-minute timestamps parsed at load time
+        test_time = record['test_time'] if 'test_time' in record else to_epoch_minutes(record.get('test_date_time'))
+        result_time = record['result_time'] if 'result_time' in record else to_epoch_minutes(record.get('result_date_time'))
+
+        # Check if both date-times are present and valid
+        if record.get('test_date_time') and record.get('result_date_time'):
+            if test_time is None or result_time is None:
+                print(f"Skipping record due to invalid date format: {record}")
+                return None
+
+            # Calculate turnaround time in minutes
+            return float(result_time - test_time)
+        else:
+            print(f"Skipping record due to missing date information: {record}")
+            return None
+
+    def generate_summary_report(self, records):
+        """Generate descriptive statistics for the filtered records."""
+        if not records:
+            print("No records found for the summary report.")
+            return
+
+        # Initialize variables for statistics
+        result_values = []
+        turnaround_times = []
+
+        # Extract relevant data from records
+        for record in records:
+            if 'result_value' in record and record['result_value'] is not None:
+                try:
+                    result_values.append(float(record['result_value']))
+                except ValueError:
+                    print(f"Skipping record due to invalid result value: {record}")
+                    continue  # Skip invalid result values
+
+            turnaround_time = self.calculate_turnaround_time(record)
+            if turnaround_time is not None:
+                turnaround_times.append(turnaround_time)
+
+        # Compute statistics for result values
+        if result_values:
+            min_value = min(result_values)
+            max_value = max(result_values)
+            avg_value = sum(result_values) / len(result_values)
+            print(f"\nTest Value Statistics:")
+            print(f"Minimum Value: {min_value}")
+            print(f"Maximum Value: {max_value}")
+            print(f"Average Value: {avg_value:.2f}")
+        else:
+            print("No valid test result values found.")
+
+        # Compute statistics for turnaround times
+        if turnaround_times:
+            min_turnaround = min(turnaround_times)
+            max_turnaround = max(turnaround_times)
+            avg_turnaround = sum(turnaround_times) / len(turnaround_times)
+            print(f"\nTurnaround Time Statistics (in minutes):")
+            print(f"Minimum Turnaround Time: {min_turnaround}")
+            print(f"Maximum Turnaround Time: {max_turnaround}")
+            print(f"Average Turnaround Time: {avg_turnaround:.2f}")
+        else:
+            print("No valid turnaround times found.")
+
+    def summary_statistics(self, **criteria):
+        """Statistics of all matching records as one report row, or None when nothing matches."""
+        row = self.cached_query("summary", (), criteria, lambda: self._summary_statistics(**criteria))
+        return copy.deepcopy(row)
+
+    def _summary_statistics(self, **criteria):
+        columns = self.column_view()
+        if columns is None or len(columns) < COLUMN_SCAN_MIN:
+            rows = self._grouped_report((), **criteria)
+            return rows[0] if rows else None
+
+        # Vectorized: select by masks, then reduce the selected columns
+        start_time = end_time = None
+        if criteria.get('start_date') is not None and criteria.get('end_date') is not None:
+            start_time, end_time = date_range_minutes(criteria['start_date'], criteria['end_date'])
+            if start_time is None or end_time is None:
+                print("Invalid date range. Please use YYYY-MM-DD.")
+                return None
+        positions = columns.select(
+            criteria.get('patient_id'), criteria.get('test_name'), criteria.get('status'), start_time, end_time,
+            self.load_test_ranges() if criteria.get('abnormal') else None,
+            criteria.get('min_turnaround'), criteria.get('max_turnaround')
+        )
+        return columns.statistics(positions) if len(positions) else None
+
+    def print_summary_statistics(self, row):
+        """Print a summary_statistics() row in the format of generate_summary_report()."""
+        if row is None:
+            print("No records found for the summary report.")
+            return
+
+        values = row["result_value"]
+        if values["count"]:
+            print(f"\nTest Value Statistics:")
+            print(f"Minimum Value: {values['min']}")
+            print(f"Maximum Value: {values['max']}")
+            print(f"Average Value: {values['mean']:.2f}")
+        else:
+            print("No valid test result values found.")
+
+        turnaround = row["turnaround"]
+        if turnaround["count"]:
+            print(f"\nTurnaround Time Statistics (in minutes):")
+            print(f"Minimum Turnaround Time: {turnaround['min']}")
+            print(f"Maximum Turnaround Time: {turnaround['max']}")
+            print(f"Average Turnaround Time: {turnaround['mean']:.2f}")
+        else:
+            print("No valid turnaround times found.")
+
+    def grouped_report(self, group_by=("test_name", "unit"), **criteria):
+        """Statistics of the matching records per group, computed in one pass; see reports.GroupedReport."""
+        rows = self.cached_query("report", group_by, criteria, lambda: self._grouped_report(group_by, **criteria))
+        return copy.deepcopy(rows)
+
+    def _grouped_report(self, group_by, **criteria):
+        report = GroupedReport(group_by)
+        plan = self.query_plan(**criteria)
+        if plan is not None and self.use_shards(plan[0]):
+            # Each worker aggregates its slice of the candidates; the partial statistics merge exactly
+            for partial in self.run_sharded(plan[2], list(plan[1]), report.group_by):
+                report.merge(partial)
+            return report.results()
+
+        for record in self.iter_records(**criteria):
+            report.add(record)
+        return report.results()
+
+    def generate_summary_report_option(self):
+        filtered_records = self.filter_medical_tests(return_records=True)
+        self.generate_summary_report(filtered_records)
+
+    def print_all_records(self):
+        if not self.patients:
+            print("No records found.")
+            return
+        for patient_id, patient in self.patients.items():
+            print(f"\nPatient ID: {patient_id}")
+            for record in patient.test_records:
+                print(f"  Record ID: {record['record_id']}")
+                print(f"  Test Name: {record['test_name']}")
+                print(f"  Test Date & Time: {record['test_date_time']}")
+                print(f"  Result Value: {record['result_value']} {record['unit']}")
+                print(f"  Status: {record['status']}")
+                if record['result_date_time']:
+                    print(f"  Result Date & Time: {record['result_date_time']}")
+                print()  # Add a blank line between records for clarity
+
+    def validate_range_values(self,range_values):
+        #Validates the range values. Ensures they are in the correct format (e.g., '> 13.8, < 17.2').
+
+            # Remove any leading/trailing whitespace
+            range_values = range_values.strip()
+
+            # Split the string by a comma (if present) to handle up to two conditions
+            conditions = range_values.split(',')
+
+            # We can only have one or two conditions
+            if len(conditions) > 2:
+                print("Invalid range values: Too many conditions.")
+                return False
+
+            # Validate each condition
+            for condition in conditions:
+                # Strip any whitespace from the condition
+                condition = condition.strip()
+
+                # Check if the condition starts with a valid operator
+                if condition.startswith(('>=', '<=', '>', '<')):
+                    operator = condition[:2] if condition[:2] in ('>=', '<=') else condition[:1]
+                    number_str = condition[len(operator):].strip()
+
+                    # Check if the remaining part is a valid number
+                    try:
+                        float(number_str)  # Try to convert to a float
+                    except ValueError:
+                        print(f"Invalid range value: '{number_str}' is not a number.")
+                        return False
+                else:
+                    print(f"Invalid range value: '{condition}' does not start with a valid operator.")
+                    return False
+
+            # If all conditions are valid
+            return True
+
+    def validate_unit(self,unit):
+        #Validates the unit. Ensures it is not empty and in the expected format.
+        if not unit.strip():
+            print("Unit cannot be empty.")
+            return False
+        elif unit.isdigit():
+            print("Unit cannot has digite.")
+            return False
+        return True
+
+
+    def validate_turnaround_time(self,turnaround_time):
+        #Validates the turnaround time. Ensures it is in the correct format DD-hh-mm
+        #and that days, hours, and minutes are valid.
+        try:
+            days, hours, minutes = turnaround_time.split('-')
+            if int(days) < 0 or int(hours) < 0 or int(hours) > 23 or int(minutes) < 0 or int(minutes) > 59:
+                print("Invalid turnaround time values. Please ensure hours are between 0-23 and minutes between 0-59.")
+                return False
+            return True
+        except ValueError:
+            print("Invalid turnaround time format. Please enter in the format DD-hh-mm.")
+            return False
+
+    def validate_test_name(self,test_name, existing_tests):
+        # Validates the test name. Ensures it is not empty and not a duplicate.
+        if not test_name.strip():
+            print("Test name cannot be empty.")
+            return False
+        if test_name in existing_tests:
+            print("Test name already exists.")
+            return False
+        return True
+
+    def add_new_medical_test(self, existing_tests):
+        test_name = input("Enter test name: ")
+        if not self.validate_test_name(test_name, existing_tests):
+            return
+
+        range_values = input("Enter range values (e.g., '> 13.8, < 17.2'): ")
+        if not self.validate_range_values(range_values):
+            return
+
+        unit = input("Enter unit: ")
+        if not self.validate_unit(unit):
+            return
+
+        turnaround_time = input("Enter turnaround time (format DD-hh-mm): ")
+        if not self.validate_turnaround_time(turnaround_time):
+            return
+
+        self.save_medical_test(test_name, range_values, unit, turnaround_time)
+        print("Test added successfully!")
+
+    def save_medical_test(self, test_name, range_values, unit, turnaround_time):
+        try:
+            file = open(self.test_file, 'a+')  # Open the file in append mode
+            try:
+                # Start on a new line if the last test has no line break
+                if file.tell() > 0:
+                    file.seek(file.tell() - 1)
+                    if file.read(1) not in ('\n', '\r'):
+                        file.write('\n')
+                file.write(f"{test_name}; {range_values}; {unit}; {turnaround_time}\n")
+                print("Test added successfully.")
+            finally:
+                file.close()  # Make sure to close the file
+        except IOError:
+            print("Error saving the test to the file.")
+            return
+
+        # The catalog changed, so the cached ranges are stale
+        self.reload_tests()
+
+
+    def update_medical_test(self, old_test_name, new_test_name, new_range_values, new_unit, new_turnaround_time):
+        if not self.validate_test_name(new_test_name, self.tests):
+            print("Invalid new test name. Update aborted.")
+            return
+
+        if not self.validate_range_values(new_range_values):
+            print("Invalid new range values. Update aborted.")
+            return
+
+        if not self.validate_unit(new_unit):
+            print("Invalid new unit. Update aborted.")
+            return
+
+        if not self.validate_turnaround_time(new_turnaround_time):
+            print("Invalid new turnaround time. Update aborted.")
+            return
+
+        try:
+            # Open the test file in read mode
+            with open(self.test_file, 'r') as file:
+                lines = file.readlines()
+
+            # Flag to check if the test was found
+            test_found = False
+
+            # Prepare a list to hold updated lines
+            updated_lines = []
+
+            # Iterate through the lines to find and update the test
+            for line in lines:
+                parts = line.strip().split('; ')
+                if parts[0] == old_test_name:
+                    # Test found, prompt for new details
+                    test_found = True
+                    # Prepare the updated line
+                    updated_line = f"{new_test_name}; {new_range_values}; {new_unit}; {new_turnaround_time}\n"
+                    updated_lines.append(updated_line)
+                else:
+                    # Keep the line as is if it doesn't match the old test name
+                    updated_lines.append(line)
+
+            # Open the test file in write mode to overwrite the content
+            with open(self.test_file, 'w') as file:
+                file.writelines(updated_lines)
+
+            if test_found:
+                # The catalog changed, so the cached ranges are stale
+                self.reload_tests()
+                print("Medical test updated successfully.")
+            else:
+                print("Test not found. No updates made.")
+
+        except IOError:
+            print("Error handling the file.")
+
+    def import_records(self, filename, chunk_size=10000, workers=None, reject_file=None):
+        """Stream a CSV file in chunks, validating them in worker processes.
+
+        Rejected lines go to reject_file (default '<filename>.rejects') with
+        their line number and reason; accepted rows are committed one chunk at a time.
+        Rows that duplicate a stored record are handled by the duplicate policy.
+        Unless the records are loaded, the imported rows are only written, not kept.
+        """
+        workers = workers or os.cpu_count() or 1
+        reject_file = reject_file or filename + ".rejects"
+        valid_statuses = tuple(sorted(self.valid_statuses))
+        imported = rejected = duplicates = 0
+        keep = self.records_loaded
+
+        # Without a journal each write rewrites the record file, so the import is written as one batch
+        transaction = contextlib.nullcontext() if self.use_journal or not keep else self.batch()
+        try:
+            with transaction, open(filename, 'r') as file, open(reject_file, 'w') as rejects:
+                chunks = iter(lambda: list(itertools.islice(file, chunk_size)), [])
+                line_number = 0
+
+                for lines, results in self.validate_chunks(chunks, workers, valid_statuses):
+                    batch, accepted = [], []  # journal entries, and (line number, line) of each
+                    unsaved = {}  # the chunk's rows by patient, when they are not kept
+                    for position, (line, (fields, reason)) in enumerate(zip(lines, results)):
+                        line_number += 1
+
+                        # The header line written by export_records is not a record
+                        if line_number == 1 and line.startswith("Patient ID,"):
+                            continue
+                        if not line.strip():
+                            continue
+                        if fields is None:
+                            rejects.write(f"{line_number}: {reason}: {line.rstrip()}\n")
+                            rejected += 1
+                            continue
+
+                        # Earlier rows of this file count as stored, so repeats within it are caught too
+                        record = TestRecord(*fields)
+                        duplicate = self.find_duplicate(record, unsaved.get(record.patient_id, ()))
+                        if duplicate is not None:
+                            duplicates += 1
+                            if self.duplicate_policy == "reject":
+                                rejects.write(f"{line_number}: Duplicate of record ID {duplicate.record_id}: "
+                                              f"{line.rstrip()}\n")
+                                rejected += 1
+                                continue
+                            if self.duplicate_policy == "skip":
+                                continue
+
+                        # Add the test record to the patient, creating the Patient if needed; IDs
+                        # for the rest of the chunk are reserved at its first row actually added
+                        if not batch:
+                            self.ensure_record_ids(len(lines) - position)
+                        record.record_id = self.new_record_id()
+                        if keep:
+                            self.get_or_create_patient(record.patient_id).add_record(record)
+                        else:
+                            unsaved.setdefault(record.patient_id, []).append(record)
+                        batch.append(f"A\t{self.format_record_line(record.patient_id, record)}")
+                        accepted.append((line_number, line))
+
+                    # Commit the accepted rows of this chunk; rows rolled back by a conflict are rejected
+                    if not batch:
+                        continue
+                    if not self.write_journal(batch):
+                        for number, line in accepted:
+                            rejects.write(f"{number}: Not saved, another process changed the dataset first: "
+                                          f"{line.rstrip()}\n")
+                        rejected += len(batch)
+                        continue
+                    if not keep:
+                        self.store.add_committed(batch)
+                    imported += len(batch)
+
+            print(f"Records imported successfully: {imported} imported, {rejected} rejected.")
+            if duplicates:
+                handled = {"count": "imported anyway", "skip": "skipped", "reject": "rejected"}
+                print(f"Rows duplicating a stored record: {duplicates} ({handled[self.duplicate_policy]}).")
+            if rejected:
+                print(f"Rejected lines were written to {reject_file}.")
+            else:
+                os.remove(reject_file)
+
+        except IOError:
+            print("Error importing records from the file.")
+        finally:
+            self.release_record_ids()
+
+    def validate_chunks(self, chunks, workers, valid_statuses):
+        """Yield (lines, results) per chunk, in file order, keeping at most 2 chunks per worker in flight."""
+        first = next(chunks, None)
+        if first is None:
+            return
+        second = next(chunks, None)
+
+        # Small files and single-worker runs are not worth starting a pool for
+        if second is None or workers == 1:
+            for lines in itertools.chain([first], [second] if second else [], chunks):
+                yield lines, validate_import_chunk(lines, valid_statuses)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for lines in itertools.chain([first, second], chunks):
+                pending.append((lines, executor.submit(validate_import_chunk, lines, valid_statuses)))
+                if len(pending) >= workers * 2:
+                    lines, future = pending.popleft()
+                    yield lines, future.result()
+            while pending:
+                lines, future = pending.popleft()
+                yield lines, future.result()
+
+    def export_records(self, filename, query=None, compression=None, part_records=None, **criteria):
+        """Write the records, or those matching a Query and the given criteria, to a CSV file.
+
+        Records are formatted and written in batches as they are read, so memory
+        stays flat, and a filter only reads the records its indexes narrow it to.
+        compression defaults to the codec the file extension names (.gz, .bz2,
+        .xz); part_records splits the output into numbered files of that many records.
+        """
+        records = self.select(query, **criteria)
+        if compression is None:
+            compression = compression_for(filename)
+
+        try:
+            with ExportWriter(filename, compression, part_records) as writer:
+                count = writer.write(map(self.export_line, records))
+            if len(writer.files) > 1:
+                print(f"Records exported successfully: {count} records in {len(writer.files)} files.")
+            else:
+                print(f"Records exported successfully: {count} records.")
+        except IOError:
+            print("Error exporting records to the file.")
+
+    def export_columns(self, directory, query=None, **criteria):
+        """Write the records, or those matching a Query and the given criteria, as a column bundle.
+
+        The directory gets one .npy file per typed column and a manifest.json (see
+        columnar.write_bundle), so numpy.load(path, mmap_mode='r') maps any column
+        without parsing. Records are streamed, like export_records().
+        """
+        try:
+            count = write_bundle(directory, self.select(query, **criteria))
+            print(f"Records exported successfully: {count} records in {directory}.")
+        except IOError:
+            print("Error exporting records to the directory.")
+
+    def import_columns(self, directory, chunk_size=10000):
+        """Import the records of a column bundle written by export_columns(), without parsing text.
+
+        The records get new IDs; copies of stored records follow the duplicate policy.
+        As in import_records(), the records are only kept when the records are loaded.
+        """
+        imported = rejected = duplicates = 0
+        keep = self.records_loaded
+        restore = TestRecord.restore
+        transaction = contextlib.nullcontext() if self.use_journal or not keep else self.batch()
+
+        def commit(batch):
+            # Commit chunk by chunk, as import_records() does; a chunk rolled back by a conflict is rejected
+            nonlocal imported, rejected
+            if not self.write_journal(batch):
+                rejected += len(batch)
+                return
+            if not keep:
+                self.store.add_committed(batch)
+            imported += len(batch)
+
+        try:
+            with transaction:
+                batch = []
+                unsaved = {}
+                for fields in read_bundle(directory):
+                    record = restore(*fields)
+                    duplicate = self.find_duplicate(record, unsaved.get(record.patient_id, ()))
+                    if duplicate is not None:
+                        duplicates += 1
+                        if self.duplicate_policy != "count":
+                            continue
+                    if not batch:
+                        self.ensure_record_ids(chunk_size)
+                    record.record_id = self.new_record_id()
+                    if keep:
+                        self.get_or_create_patient(record.patient_id).add_record(record)
+                    else:
+                        unsaved.setdefault(record.patient_id, []).append(record)
+                    batch.append(f"A\t{self.format_record_line(record.patient_id, record)}")
+
+                    if len(batch) >= chunk_size:
+                        commit(batch)
+                        batch, unsaved = [], {}
+                if batch:
+                    commit(batch)
+
+            print(f"Records imported successfully: {imported} imported, {rejected} rejected.")
+            if duplicates:
+                handled = {"count": "imported anyway", "skip": "skipped", "reject": "rejected"}
+                print(f"Records duplicating a stored record: {duplicates} ({handled[self.duplicate_policy]}).")
+        except (IOError, ValueError, KeyError) as error:
+            print(f"Error importing records from {directory}: {error}")
+        finally:
+            self.release_record_ids()
+
+    def export_line(self, record):
+        # One CSV line, fields in the order of the export header; dates in the
+        # canonical spelling, so import_records() takes the file back
+        patient_id, test_name, unit, status, value, test_time, result_time, test_text, result_text, _ = record.fields()
+        test_date_time = format_minutes(test_time) if test_time is not None else test_text
+        result_date_time = format_minutes(result_time) if result_time is not None else result_text or ''
+        return (
+            f"{patient_id},{test_name},"
+            f"{test_date_time},{value},"
+            f"{unit},{status},"
+            f"{result_date_time}\n"
+        )
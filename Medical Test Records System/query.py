@@ -0,0 +1,115 @@
+# Every filter criterion with the value that means "not filtered"
+QUERY_DEFAULTS = dict(patient_id=None, test_name=None, abnormal=False, start_date=None, end_date=None,
+                      status=None, min_turnaround=None, max_turnaround=None)
+
+
+class Query:
+    """Filter criteria that combine with & (and), | (or) and ~ (not).
+
+    Query(**criteria) matches the records meeting every given criterion; the
+    criteria are those of MedicalTestSystem.find_records(). A query holds no
+    records, so it can be built once and run with MedicalTestSystem.select()
+    as often as needed.
+    """
+
+    __slots__ = ("operator", "parts", "criteria")
+
+    def __init__(self, **criteria):
+        unknown = criteria.keys() - QUERY_DEFAULTS.keys()
+        if unknown:
+            raise TypeError(f"Unknown query criteria: {', '.join(sorted(unknown))}")
+        self.operator = None  # "and", "or" or "not" for a combination, None for plain criteria
+        self.parts = ()
+        self.criteria = {name: value for name, value in criteria.items() if value != QUERY_DEFAULTS[name]}
+
+    @classmethod
+    def combine(cls, operator, parts):
+        query = cls.__new__(cls)
+        query.operator = operator
+        query.parts = tuple(parts)
+        query.criteria = {}
+        return query
+
+    def __and__(self, other):
+        if not isinstance(other, Query):
+            return NotImplemented
+        return Query.combine("and", self.flatten("and") + other.flatten("and"))
+
+    def __or__(self, other):
+        if not isinstance(other, Query):
+            return NotImplemented
+        return Query.combine("or", self.flatten("or") + other.flatten("or"))
+
+    def __invert__(self):
+        if self.operator == "not":
+            return self.parts[0]
+        return Query.combine("not", (self,))
+
+    def flatten(self, operator):
+        # (a & b) & c becomes one AND of three parts
+        return self.parts if self.operator == operator else (self,)
+
+    def leaves(self):
+        """Yield the plain-criteria queries this one is combined from."""
+        if self.operator is None:
+            yield self
+        else:
+            for part in self.parts:
+                yield from part.leaves()
+
+    def __repr__(self):
+        if self.operator is None:
+            return f"Query({', '.join(f'{name}={value!r}' for name, value in self.criteria.items())})"
+        if self.operator == "not":
+            return f"~{self.parts[0]!r}"
+        joiner = " & " if self.operator == "and" else " | "
+        return f"({joiner.join(map(repr, self.parts))})"
+
+
+def compile_matcher(query, plan, abnormal=None):
+    """Compile a query into a single function of a record that returns whether it matches.
+
+    plan(leaf) gives the record_matcher() arguments of each plain-criteria part
+    (dates as epoch minutes); abnormal(record) checks a result against its
+    reference range. Only the criteria in use become code, with their values
+    as constants, so checking a record never looks up which filters are on.
+    """
+    constants = {"abnormal": abnormal}
+
+    def constant(value):
+        name = f"c{len(constants)}"
+        constants[name] = value
+        return name
+
+    def source(node):
+        if node.operator is None:
+            return criteria_source(plan(node), constant)
+        if node.operator == "not":
+            return f"not {source(node.parts[0])}"
+        return f"({f' {node.operator} '.join(map(source, node.parts))})"
+
+    exec(f"def matches(record):\n    return {source(query)}\n", constants)
+    return constants["matches"]
+
+
+def criteria_source(criteria, constant):
+    # One condition per criterion in use, in the order the old filter checked them
+    conditions = []
+    for field in ("patient_id", "test_name", "status"):
+        if criteria[field] is not None:
+            conditions.append(f"record.{field} == {constant(criteria[field])}")
+    if criteria["start_time"] is not None:
+        conditions.append(f"record.test_time is not None and "
+                          f"{constant(criteria['start_time'])} <= record.test_time <= {constant(criteria['end_time'])}")
+    if criteria["abnormal"]:
+        conditions.append("abnormal(record)")
+
+    min_turnaround, max_turnaround = criteria["min_turnaround"], criteria["max_turnaround"]
+    if min_turnaround is not None or max_turnaround is not None:
+        # Records without a result time have no turnaround yet
+        conditions.append("record.test_time is not None and record.result_time is not None")
+        if min_turnaround is not None:
+            conditions.append(f"record.result_time - record.test_time >= {constant(min_turnaround)}")
+        if max_turnaround is not None:
+            conditions.append(f"record.result_time - record.test_time <= {constant(max_turnaround)}")
+    return f"({' and '.join(conditions)})" if conditions else "True"
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+
+MISSING = object()  # returned by QueryCache.get() on a miss when asked to, as None can be a cached result
+
+
+class QueryCache:
+    """Bounded LRU cache of query results, invalidated only by the changes that can affect them.
+
+    Each entry remembers the patient and test its query was restricted to (None
+    for any) and whether it used the test catalog, so a changed record drops
+    just the entries that could contain it.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (result, patient_id, test_name, uses_catalog)
+        self.by_patient = {}          # patient ID -> keys of the queries restricted to it
+        self.by_test = {}             # test name -> keys restricted to it but to no patient
+        self.unrestricted = set()     # keys of the queries over every patient and test
+        self.catalog = set()          # keys of the queries that used the reference ranges
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, result, patient_id=None, test_name=None, uses_catalog=False):
+        if self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self.discard(key)
+        self.entries[key] = (result, patient_id, test_name, uses_catalog)
+        if patient_id is not None:
+            self.by_patient.setdefault(patient_id, set()).add(key)
+        elif test_name is not None:
+            self.by_test.setdefault(test_name, set()).add(key)
+        else:
+            self.unrestricted.add(key)
+        if uses_catalog:
+            self.catalog.add(key)
+
+        while len(self.entries) > self.max_entries:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        _, patient_id, test_name, _ = self.entries.pop(key)
+        if patient_id is not None:
+            keys = self.by_patient[patient_id]
+            keys.discard(key)
+            if not keys:
+                del self.by_patient[patient_id]
+        elif test_name is not None:
+            keys = self.by_test[test_name]
+            keys.discard(key)
+            if not keys:
+                del self.by_test[test_name]
+        else:
+            self.unrestricted.discard(key)
+        self.catalog.discard(key)
+
+    def invalidate(self, keys):
+        for key in keys:
+            self.discard(key)
+        self.invalidations += len(keys)
+
+    def record_changed(self, patient_id, test_name):
+        """Drop the results a record of this patient and test could be part of."""
+        if not self.entries:
+            return
+        entries = self.entries
+        stale = set(self.unrestricted)
+        stale.update(key for key in self.by_patient.get(patient_id, ()) if entries[key][2] in (None, test_name))
+        stale.update(self.by_test.get(test_name, ()))
+        self.invalidate(stale)
+
+    def catalog_changed(self):
+        """Drop the results that depend on the reference ranges."""
+        self.invalidate(set(self.catalog))
+
+    def clear(self):
+        self.invalidate(set(self.entries))
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
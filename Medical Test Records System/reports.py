@@ -0,0 +1,332 @@
+import bisect
+import functools
+import math
+from _datetime import date
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+GROUP_FIELDS = ("test_name", "unit", "status", "patient_id", "month", "week")
+
+# Default histogram bin edges: result values on a rough 1-2-5 scale, turnaround in minutes
+VALUE_BIN_EDGES = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+TURNAROUND_BIN_EDGES = (15, 30, 60, 120, 240, 480, 1440, 2880, 10080)
+QUANTILES = (("median", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+
+@functools.lru_cache(maxsize=65536)
+def day_buckets(epoch_day):
+    # Month ('2024-03') and ISO week ('2024-W09') of a day since 1970-01-01
+    day = date.fromordinal(EPOCH_ORDINAL + epoch_day)
+    year, week, _ = day.isocalendar()
+    return f"{day.year:04d}-{day.month:02d}", f"{year:04d}-W{week:02d}"
+
+
+class RunningStats:
+    """Count, min, max, mean and standard deviation in one pass (Welford), mergeable across chunks."""
+
+    __slots__ = ("count", "minimum", "maximum", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """Fold in statistics gathered elsewhere (Chan et al. parallel update)."""
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.minimum, self.maximum = other.count, other.minimum, other.maximum
+            self.mean, self.m2 = other.mean, other.m2
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    @property
+    def stddev(self):
+        # Sample standard deviation; a single value has no spread
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        if not self.count:
+            return {"count": 0, "min": None, "max": None, "mean": None, "stddev": None}
+        return {"count": self.count, "min": self.minimum, "max": self.maximum,
+                "mean": self.mean, "stddev": self.stddev}
+
+
+class TDigest:
+    """Merging t-digest: approximate quantiles in bounded memory, mergeable across chunks.
+
+    Values are buffered and periodically merged into roughly compression / 2
+    centroids, which stay small near the tails so p99 stays accurate.
+    """
+
+    __slots__ = ("compression", "centroids", "buffer", "count", "minimum", "maximum")
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.centroids = []  # sorted (mean, weight) pairs
+        self.buffer = []
+        self.count = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        self.count += weight
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        if len(self.buffer) >= self.compression * 5:
+            self.compress()
+
+    @classmethod
+    def from_centroids(cls, means, weights, minimum, maximum, compression=200):
+        """A digest built elsewhere in bulk, from centroids cut on the same scale as compress()."""
+        digest = cls(compression)
+        digest.centroids = list(zip(means, weights))
+        digest.count = sum(weights)
+        digest.minimum, digest.maximum = minimum, maximum
+        return digest
+
+    def merge(self, other):
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        if len(self.buffer) >= self.compression * 5:
+            self.compress()
+        return self
+
+    def compress(self):
+        if not self.buffer:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+
+        # Merge neighbours while a centroid spans at most one unit of the arcsine scale
+        total = self.count
+        scale = self.compression / (2 * math.pi)
+        merged = []
+        cumulative = 0
+        k_left = -scale * math.pi / 2
+        mean, weight = points[0]
+        for point_mean, point_weight in points[1:]:
+            k_right = scale * math.asin(min(1.0, 2 * (cumulative + weight + point_weight) / total - 1))
+            if k_right - k_left <= 1:
+                mean += (point_mean - mean) * point_weight / (weight + point_weight)
+                weight += point_weight
+            else:
+                merged.append((mean, weight))
+                cumulative += weight
+                k_left = scale * math.asin(min(1.0, 2 * cumulative / total - 1))
+                mean, weight = point_mean, point_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q):
+        """Approximate value below which a fraction q of the values fall, or None when empty."""
+        self.compress()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        # Interpolate between centroid centres, using min/max for the outer halves
+        target = q * self.count
+        cumulative = 0
+        previous_center, previous_mean = 0, self.minimum
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target <= center:
+                span = center - previous_center
+                fraction = (target - previous_center) / span if span else 0
+                return previous_mean + (mean - previous_mean) * fraction
+            cumulative += weight
+            previous_center, previous_mean = center, mean
+        span = self.count - previous_center
+        fraction = (target - previous_center) / span if span else 1
+        return previous_mean + (self.maximum - previous_mean) * fraction
+
+
+class Histogram:
+    """Counts per fixed bin; bin i holds edges[i-1] <= value < edges[i], plus under/overflow bins."""
+
+    __slots__ = ("edges", "counts")
+
+    def __init__(self, edges):
+        self.edges = tuple(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_right(self.edges, value)] += 1
+
+    def merge(self, other):
+        if other.edges != self.edges:
+            raise ValueError("Cannot merge histograms with different bins")
+        for position, count in enumerate(other.counts):
+            self.counts[position] += count
+        return self
+
+    def as_list(self):
+        bounds = (None,) + self.edges + (None,)
+        return [{"low": bounds[position], "high": bounds[position + 1], "count": count}
+                for position, count in enumerate(self.counts)]
+
+
+class Distribution:
+    """Moments, quantile sketch and histogram of one measure, all in constant memory."""
+
+    __slots__ = ("stats", "digest", "histogram")
+
+    def __init__(self, edges):
+        self.stats = RunningStats()
+        self.digest = TDigest()
+        self.histogram = Histogram(edges)
+
+    def add(self, value):
+        self.stats.add(value)
+        self.digest.add(value)
+        self.histogram.add(value)
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+        self.digest.merge(other.digest)
+        self.histogram.merge(other.histogram)
+        return self
+
+    def as_dict(self):
+        result = self.stats.as_dict()
+        for name, q in QUANTILES:
+            result[name] = self.digest.quantile(q)
+        result["histogram"] = self.histogram.as_list()
+        return result
+
+
+class GroupStats:
+    """Statistics for one group: result values and turnaround times (minutes)."""
+
+    __slots__ = ("records", "result_value", "turnaround")
+
+    def __init__(self, value_edges=VALUE_BIN_EDGES, turnaround_edges=TURNAROUND_BIN_EDGES):
+        self.records = 0
+        self.result_value = Distribution(value_edges)
+        self.turnaround = Distribution(turnaround_edges)
+
+    def add(self, record):
+        self.records += 1
+        try:
+            self.result_value.add(float(record["result_value"]))
+        except (TypeError, ValueError):
+            pass  # non-numeric results still count as records
+        test_time, result_time = record["test_time"], record["result_time"]
+        if test_time is not None and result_time is not None:
+            self.turnaround.add(float(result_time - test_time))  # floats, as in the NumPy column view
+
+    def merge(self, other):
+        self.records += other.records
+        self.result_value.merge(other.result_value)
+        self.turnaround.merge(other.turnaround)
+        return self
+
+
+class GroupedReport:
+    """Streaming report grouped by any combination of GROUP_FIELDS.
+
+    Feed records (TestRecord objects or their dict copies) to add(), then
+    call results(); partial reports built on separate chunks can be merged.
+    """
+
+    def __init__(self, group_by=("test_name", "unit"), value_edges=VALUE_BIN_EDGES,
+                 turnaround_edges=TURNAROUND_BIN_EDGES):
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"Cannot group by {', '.join(unknown)}; use {', '.join(GROUP_FIELDS)}")
+        self.group_by = tuple(group_by)
+        self.value_edges = tuple(value_edges)
+        self.turnaround_edges = tuple(turnaround_edges)
+        self.groups = {}
+
+    def key(self, record):
+        key = []
+        for field in self.group_by:
+            if field in ("month", "week"):
+                test_time = record["test_time"]
+                if test_time is None:
+                    key.append(None)
+                else:
+                    month, week = day_buckets(test_time // 1440)
+                    key.append(month if field == "month" else week)
+            else:
+                key.append(record[field])
+        return tuple(key)
+
+    def add(self, record):
+        key = self.key(record)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = GroupStats(self.value_edges, self.turnaround_edges)
+        group.add(record)
+
+    def merge(self, other):
+        for key, stats in other.groups.items():
+            if key in self.groups:
+                self.groups[key].merge(stats)
+            else:
+                self.groups[key] = stats
+        return self
+
+    def results(self):
+        """One dict per group, sorted by group key."""
+        rows = []
+        for key in sorted(self.groups, key=lambda key: tuple("" if part is None else str(part) for part in key)):
+            stats = self.groups[key]
+            rows.append({
+                "group": dict(zip(self.group_by, key)),
+                "records": stats.records,
+                "result_value": stats.result_value.as_dict(),
+                "turnaround": stats.turnaround.as_dict()
+            })
+        return rows
+
+
+def format_grouped_report(rows):
+    """Render grouped report rows as text lines."""
+    if not rows:
+        return ["No records found for the summary report."]
+
+    def number(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    lines = []
+    for row in rows:
+        group = ", ".join(f"{field}={value}" for field, value in row["group"].items())
+        lines.append(f"{group or 'all records'}: {row['records']} records")
+        for label, stats in (("Result Value", row["result_value"]), ("Turnaround (min)", row["turnaround"])):
+            lines.append(f"  {label}: n={stats['count']} min={number(stats['min'])} max={number(stats['max'])} "
+                         f"mean={number(stats['mean'])} stddev={number(stats['stddev'])} "
+                         f"median={number(stats['median'])} p90={number(stats['p90'])} p99={number(stats['p99'])}")
+            bins = [f"[{'' if bin['low'] is None else bin['low']},{'' if bin['high'] is None else bin['high']}):"
+                    f"{bin['count']}" for bin in stats["histogram"] if bin["count"]]
+            if bins:
+                lines.append(f"    histogram: {' '.join(bins)}")
+    return lines
@@ -0,0 +1,50 @@
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+def shard_files(record_file, count):
+    """The record files of a dataset split into count shards by patient ID.
+
+    medicalRecord.txt -> medicalRecord.shard1of4.txt ... medicalRecord.shard4of4.txt;
+    a dataset of one shard is the record file itself.
+    """
+    if count == 1:
+        return [record_file]
+    stem, extension = os.path.splitext(record_file)
+    width = len(str(count))
+    return [f"{stem}.shard{number:0{width}d}of{count}{extension}" for number in range(1, count + 1)]
+
+
+def stored_shard_count(record_file):
+    # The shard count in the names of the record file's shards on disk, or None if there are none
+    directory, name = os.path.split(record_file)
+    stem, extension = os.path.splitext(name)
+    pattern = re.compile(rf"{re.escape(stem)}\.shard\d+of(\d+){re.escape(extension)}")
+    try:
+        names = os.listdir(directory or '.')
+    except FileNotFoundError:
+        return None
+    counts = {int(match.group(1)) for match in map(pattern.fullmatch, names) if match is not None}
+    if len(counts) > 1:
+        raise ValueError(f"Shards of {record_file} with different shard counts exist: "
+                         f"{', '.join(map(str, sorted(counts)))}")
+    return counts.pop() if counts else None
+
+
+def shard_of(patient_id, count):
+    # 7-digit IDs spread evenly by value; any other ID by a checksum of its text
+    if count == 1:
+        return 0
+    if len(patient_id) == 7 and patient_id.isdigit():
+        return int(patient_id) % count
+    return zlib.crc32(patient_id.encode()) % count
+
+
+def map_shards(function, items, threads):
+    """function(item) for each item, on up to threads threads; the results in item order."""
+    if threads <= 1 or len(items) <= 1:
+        return list(map(function, items))
+    with ThreadPoolExecutor(max_workers=min(threads, len(items))) as pool:
+        return list(pool.map(function, items))
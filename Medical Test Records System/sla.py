@@ -0,0 +1,68 @@
+import heapq
+import itertools
+
+
+class SlaMonitor:
+    """Pending tests in a min-heap keyed by deadline, so overdue tests are found without a full scan.
+
+    Removals are lazy: the heap keeps stale entries, which are skipped when
+    reading and dropped once they outnumber the live ones.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline  # record -> deadline in epoch minutes, or None if it has none
+        self.heap = []            # (deadline, sequence, record)
+        self.live = {}            # record -> (deadline, sequence) of its current heap entry
+        self.sequence = itertools.count()  # breaks deadline ties without comparing records
+
+    def __len__(self):
+        return len(self.live)
+
+    def entry(self, record):
+        deadline = self.deadline(record)
+        if deadline is None:
+            return None
+        sequence = next(self.sequence)
+        self.live[record] = (deadline, sequence)
+        return deadline, sequence, record
+
+    def add(self, record):
+        entry = self.entry(record)
+        if entry is not None:
+            heapq.heappush(self.heap, entry)
+
+    def add_many(self, records):
+        # One heapify instead of a push per record
+        self.heap.extend(entry for entry in map(self.entry, records) if entry is not None)
+        heapq.heapify(self.heap)
+
+    def remove(self, record):
+        if self.live.pop(record, None) is not None and len(self.heap) > 2 * len(self.live) + 64:
+            self.compact()
+
+    def compact(self):
+        live = self.live
+        self.heap = [entry for entry in self.heap if live.get(entry[2]) == entry[:2]]
+        heapq.heapify(self.heap)
+
+    def clear(self):
+        self.heap = []
+        self.live = {}
+
+    def overdue(self, now):
+        """(deadline, record) of every test due at or before now, earliest deadline first.
+
+        Only the heap nodes that are due get visited, so k overdue tests cost O(k log k).
+        """
+        heap, live = self.heap, self.live
+        result = []
+        frontier = [(heap[0][0], heap[0][1], 0)] if heap and heap[0][0] <= now else []
+        while frontier:
+            deadline, sequence, position = heapq.heappop(frontier)
+            record = heap[position][2]
+            if live.get(record) == (deadline, sequence):
+                result.append((deadline, record))
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(heap) and heap[child][0] <= now:
+                    heapq.heappush(frontier, (heap[child][0], heap[child][1], child))
+        return result
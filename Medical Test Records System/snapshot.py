@@ -0,0 +1,84 @@
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+# Section table entry: name, array typecode ('s' for a string table), CRC-32 of the data,
+# byte offset, byte size, item count
+SECTION = struct.Struct("<32s1s3xIQQQ")
+SECTION_COUNT = struct.Struct("<Q")
+ITEM_SIZES = {"q": 8, "d": 8, "i": 4}
+
+
+def padded(size):
+    # Sections start 8-byte aligned, so a mapped section can be cast to its type in place
+    return (size + 7) & ~7
+
+
+def write_sections(path, header, sections):
+    """Write a fixed-layout binary file: header bytes, a section table, then the sections.
+
+    sections maps a name to an array (typecode q, d or i), stored little-endian,
+    or to a list of strings, stored as UTF-8 one per line: the record fields
+    these files hold never contain a line break.
+    """
+    encoded = []
+    for name, values in sections.items():
+        if len(name.encode()) > 32:
+            raise ValueError(f"Section name {name!r} is longer than 32 bytes")
+        if isinstance(values, array):
+            if sys.byteorder == "big":
+                values = array(values.typecode, values)
+                values.byteswap()
+            encoded.append((name, values.typecode, len(values), values.tobytes()))
+        else:
+            encoded.append((name, "s", len(values), "\n".join(values).encode()))
+
+    offset = padded(len(header)) + SECTION_COUNT.size + SECTION.size * len(encoded)
+    with open(path, 'wb') as file:
+        file.write(header.ljust(padded(len(header)), b"\0"))
+        file.write(SECTION_COUNT.pack(len(encoded)))
+        for name, typecode, count, data in encoded:
+            file.write(SECTION.pack(name.encode(), typecode.encode(), zlib.crc32(data), offset, len(data), count))
+            offset += padded(len(data))
+        for _, _, _, data in encoded:
+            file.write(data.ljust(padded(len(data)), b"\0"))
+
+
+def read_sections(path, header):
+    """The sections of a file written by write_sections(), or None unless it starts with these header bytes.
+
+    The file is memory-mapped and each section checked against its CRC and
+    copied out once; nothing in the file is executed. Raises ValueError or
+    struct.error if it is damaged.
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(header)) != header:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = padded(len(header))
+            count, = SECTION_COUNT.unpack_from(mapped, start)
+            sections = {}
+            for entry in range(count):
+                name, typecode, checksum, offset, size, count = SECTION.unpack_from(
+                    mapped, start + SECTION_COUNT.size + entry * SECTION.size)
+                typecode = typecode.decode()
+                if typecode != "s" and size != count * ITEM_SIZES.get(typecode, -1):
+                    raise ValueError(f"{path} has a damaged section table")
+                end = offset + size
+                if end > len(mapped):
+                    raise ValueError(f"{path} is truncated")
+                if zlib.crc32(mapped[offset:end]) != checksum:
+                    raise ValueError(f"{path} is damaged")
+                if typecode == "s":
+                    values = mapped[offset:end].decode().split("\n") if count else []
+                    if len(values) != count:
+                        raise ValueError(f"{path} has a damaged string table")
+                else:
+                    values = array(typecode)
+                    values.frombytes(mapped[offset:end])
+                    if sys.byteorder == "big":
+                        values.byteswap()
+                sections[name.rstrip(b"\0").decode()] = values
+    return sections
@@ -0,0 +1,346 @@
+import itertools
+import sqlite3
+import sys
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+STORAGE_ENGINES = ("text", "sqlite")
+
+# Columns in TestRecord.restore() order; the result keeps its stored type (int, float or text)
+RECORD_COLUMNS = ("patient_id", "test_name", "unit", "status", "result_value", "test_time", "result_time",
+                  "test_text", "result_text", "record_id")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    record_id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result_value NOT NULL,
+    test_time INTEGER,
+    result_time INTEGER,
+    test_text TEXT,
+    result_text TEXT
+);
+CREATE INDEX IF NOT EXISTS records_patient ON records (patient_id, test_time);
+CREATE INDEX IF NOT EXISTS records_test ON records (test_name, test_time);
+CREATE INDEX IF NOT EXISTS records_status ON records (status, test_time);
+CREATE INDEX IF NOT EXISTS records_time ON records (test_time);
+CREATE TABLE IF NOT EXISTS changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry TEXT NOT NULL
+);
+"""
+SELECT_RECORDS = f"SELECT {', '.join(RECORD_COLUMNS)} FROM records"
+INSERT_RECORD = f"INSERT INTO records ({', '.join(RECORD_COLUMNS)}) VALUES ({', '.join('?' * len(RECORD_COLUMNS))})"
+UPDATE_RECORD = (f"UPDATE records SET {', '.join(f'{column} = ?' for column in RECORD_COLUMNS[:-1])} "
+                 f"WHERE record_id = ?")
+DELETE_RECORD = "DELETE FROM records WHERE record_id = ?"
+CHANGE_STATEMENTS = {'A': INSERT_RECORD, 'U': UPDATE_RECORD, 'D': DELETE_RECORD}
+INSERT_CHANGE = "INSERT INTO changes (entry) VALUES (?)"
+
+
+def storage_for(record_file):
+    # The engine a record file name implies: a database by extension, the text format otherwise
+    return "sqlite" if record_file.lower().endswith(SQLITE_EXTENSIONS) else "text"
+
+
+class RecordStore:
+    """Where a MedicalTestSystem keeps its records: it loads them, persists changes and answers without loading.
+
+    The system holds one store and calls it for everything that depends on the
+    storage format; the text format (record file or shards, journal and snapshot
+    cache) is TextRecordStore in medical_records.py. Changes reach a store as
+    journal entries: 'A\t<line>' add, 'U\t<old line>\t<new line>' update and
+    'D\t<line>' delete.
+    """
+
+    answers_queries = False  # select() narrows by the store's own indexes, so loading would not speed filters up
+
+    def __init__(self, system):
+        self.system = system
+
+    def load(self):
+        """Load every stored record into the system."""
+        raise NotImplementedError
+
+    def select(self, query, planned):
+        """Yield the stored records matching a Query in result order, without loading them.
+
+        planned maps id(leaf) to the leaf's planned criteria (see MedicalTestSystem.plan_leaves).
+        """
+        raise NotImplementedError
+
+    def patient_records(self, patient_id):
+        """A patient's stored records, read on their own."""
+        raise NotImplementedError
+
+    def fetch_record(self, record_id, patient_id=None):
+        """Make the record with this ID available for a change, with as little loading as possible; or None."""
+        raise NotImplementedError
+
+    def commit(self, entries):
+        """Persist journal entries applied in memory; call holding the exclusive lock, after catch_up().
+
+        Returns False when everything was rewritten instead, so the entries need no compaction.
+        """
+        raise NotImplementedError
+
+    def apply_changes(self, changed):
+        """Apply what other processes committed since this one last read the store.
+
+        changed are the (path, appended) pairs of changed_files(), all appended.
+        Call holding the lock.
+        """
+        raise NotImplementedError
+
+    def changed_files(self):
+        """(path, True if lines were only appended) of each file changed since it was read."""
+        return []
+
+    def rewrite(self):
+        """Replace everything stored by the loaded records; call holding the exclusive lock."""
+        raise NotImplementedError
+
+    def compact(self):
+        """Fold whatever the store keeps on the side back into its main file."""
+
+    def dedupe(self, max_entries):
+        """Drop the records whose content repeats an older one; returns (kept, dropped), or None if it cannot."""
+        raise NotImplementedError
+
+    def max_record_id(self):
+        raise NotImplementedError
+
+    def add_committed(self, entries):
+        """Note entries a bulk add committed without keeping their records in memory."""
+
+    def close(self):
+        pass
+
+
+class SqliteRecordStore(RecordStore):
+    """Records in an SQLite database: WAL mode, indexed by patient, test, status and test time.
+
+    The store replaces the text record file, journal and snapshot cache of a
+    MedicalTestSystem. Records travel as row tuples in TestRecord.restore()
+    order, and changes as (operation, row) pairs, with the operations of the
+    journal. Filters are pushed down as WHERE clauses (see query_sql), so a
+    query reads only the index ranges it needs.
+
+    Each commit is one transaction that also appends the journal entries to the
+    changes table, which other processes read to catch up without a reload.
+    """
+
+    answers_queries = True
+
+    def __init__(self, system, path):
+        super().__init__(system)
+        self.path = path
+        # Transactions are begun explicitly; the module caches the prepared statements
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")  # every commit is on disk, like a journal write
+        self.connection.executescript(SCHEMA)
+
+    def load(self):
+        # Rows come sorted by patient and test time, so each patient's records are added at once.
+        # The change log position is read first: a change committed meanwhile is applied again by
+        # catch_up(), which finds it already there
+        system = self.system
+        system.journal_offset, system.journal_entries = self.last_change(), self.change_count()
+        intern = sys.intern
+        for patient_id, rows in itertools.groupby(self.rows(), key=lambda row: row[0]):
+            system.get_or_create_patient(patient_id).add_restored_records([
+                system.row_record((patient_id, intern(test_name), intern(unit), intern(status), *fields))
+                for _, test_name, unit, status, *fields in rows
+            ])
+        system.finish_record_ids()
+        system.drop_duplicates(system.patients.values())
+        system.snapshot_records = len(system.index)
+        system.records_loaded = True
+
+    def select(self, query, planned):
+        # The database evaluates what it can from its indexes; the abnormal
+        # criterion needs the catalog, so its rows are checked here
+        where, params, exact = query_sql(query, lambda leaf: planned[id(leaf)])
+        rows = self.rows(None if where in (None, "1") else where, params, by_time=True)
+        records = map(self.system.row_record, rows)
+        if not exact:
+            records = filter(self.system.query_matcher(query, planned), records)
+        yield from records
+
+    def patient_records(self, patient_id):
+        return [self.system.row_record(row) for row in self.rows("patient_id = ?", (patient_id,))]
+
+    def fetch_record(self, record_id, patient_id=None):
+        # Only the one row is read, and added to its patient in memory so it can be changed
+        row = next(self.rows("record_id = ?", (record_id,)), None)
+        if row is None:
+            return None
+        record = self.system.row_record(row)
+        self.system.get_or_create_patient(record.patient_id).add_record(record)
+        return record
+
+    def commit(self, entries):
+        # The entries go in the change log in the same transaction, for the others to apply
+        system = self.system
+        last_change = self.write_changes([(entry[0], system.record_row(system.entry_record(entry)))
+                                          for entry in entries], entries)
+        if system.records_loaded:
+            system.journal_offset = last_change
+        system.bump_version()
+        return True
+
+    def apply_changes(self, changed):
+        # Apply the change log from where this process left off
+        system = self.system
+        changes = self.changes(system.journal_offset)
+        system.apply_journal_entries([entry for _, entry in changes])
+        system.journal_entries += len(changes)
+        if changes:
+            system.journal_offset = changes[-1][0]
+
+    def rewrite(self):
+        system = self.system
+        self.replace(system.record_row(record) for patient in system.patients.values()
+                     for record in patient.test_records)
+        system.bump_version(rewritten=True)
+
+    def compact(self):
+        """Clear the change log and fold the write-ahead log back into the database file."""
+        # Processes that had not read the cleared change log yet load the records again
+        with self.system.lock.locked():
+            self.transaction([("DELETE FROM changes", [()])])
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.system.bump_version(rewritten=True)
+            self.system.journal_entries = 0
+
+    def dedupe(self, max_entries):
+        # The database groups the contents itself, so max_entries does not apply
+        content = ", ".join(column for column in RECORD_COLUMNS if column != "record_id")
+        with self.system.lock.locked():
+            before = self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            self.transaction([(f"DELETE FROM records WHERE record_id NOT IN "
+                               f"(SELECT MIN(record_id) FROM records GROUP BY {content})", [()]),
+                              ("DELETE FROM changes", [()])])
+            kept = self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            self.system.bump_version(rewritten=True)
+        return kept, before - kept
+
+    def rows(self, where=None, params=(), by_time=False):
+        """Yield the rows matching an SQL condition (every row without one) by patient and test time,
+        or by test time and record ID with by_time."""
+        sql = SELECT_RECORDS if where is None else f"{SELECT_RECORDS} WHERE {where}"
+        order = "test_time, record_id" if by_time else "patient_id, test_time, record_id"
+        yield from self.connection.execute(f"{sql} ORDER BY {order}", params)
+
+    def transaction(self, statements):
+        # statements: (sql, list of parameter tuples) run with executemany in one transaction
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, parameters in statements:
+                cursor.executemany(sql, parameters)
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+    def write_changes(self, changes, entries):
+        """Apply the changes and log the journal entries they came from, in one transaction.
+
+        Returns the change ID of the last entry. Runs of the same operation go
+        to the database as one batch.
+        """
+        statements = []
+        for operation, row in changes:
+            parameters = (row[-1],) if operation == 'D' else row  # the record ID is last, as UPDATE needs it
+            if statements and statements[-1][0] == CHANGE_STATEMENTS[operation]:
+                statements[-1][1].append(parameters)
+            else:
+                statements.append((CHANGE_STATEMENTS[operation], [parameters]))
+        statements.append((INSERT_CHANGE, [(entry,) for entry in entries]))
+        self.transaction(statements)
+        # The caller holds the dataset lock, so no other commit can come in between
+        return self.last_change()
+
+    def changes(self, after):
+        # The logged journal entries after a change ID, as (change ID, entry) in commit order
+        return self.connection.execute("SELECT change_id, entry FROM changes WHERE change_id > ? "
+                                       "ORDER BY change_id", (after,)).fetchall()
+
+    def last_change(self):
+        # Change IDs are never reused (AUTOINCREMENT), also after the log is cleared
+        return self.connection.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence "
+                                       "WHERE name = 'changes'), 0)").fetchone()[0]
+
+    def change_count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+
+    def replace(self, rows):
+        """Replace every stored record by these rows; the change log starts over."""
+        self.transaction([("DELETE FROM records", [()]), ("DELETE FROM changes", [()]), (INSERT_RECORD, rows)])
+
+    def max_record_id(self):
+        return self.connection.execute("SELECT MAX(record_id) FROM records").fetchone()[0] or 0
+
+    def close(self):
+        self.connection.close()
+
+
+def criteria_sql(criteria, params, negated=False):
+    # One condition per criterion, like query.criteria_source(); abnormal results are left to the caller
+    conditions = []
+    for field in ("patient_id", "test_name", "status"):
+        if criteria[field] is not None:
+            conditions.append(f"{field} = ?")
+            params.append(criteria[field])
+    if criteria["start_time"] is not None:
+        conditions.append("test_time BETWEEN ? AND ?")
+        params.extend((criteria["start_time"], criteria["end_time"]))
+    if criteria["min_turnaround"] is not None:
+        conditions.append("result_time - test_time >= ?")
+        params.append(criteria["min_turnaround"])
+    if criteria["max_turnaround"] is not None:
+        conditions.append("result_time - test_time <= ?")
+        params.append(criteria["max_turnaround"])
+    if not conditions:
+        return "1"
+    # Under a NOT, SQL's unknown (from a NULL time) must count as false, as it does in Python;
+    # elsewhere the bare condition keeps the indexes usable
+    if negated:
+        return f"COALESCE(({' AND '.join(conditions)}), 0)"
+    return f"({' AND '.join(conditions)})"
+
+
+def query_sql(query, plan):
+    """Translate a Query into a WHERE condition: (sql, params, exact).
+
+    plan(leaf) gives a leaf's record_matcher() arguments. The abnormal criterion
+    needs the catalog's ranges, so where it is used the condition only narrows
+    the rows (exact is False) and the caller checks them; under a NOT it cannot
+    narrow at all, and sql is None.
+    """
+    params = []
+    exact = True
+
+    def condition(node, negated):
+        nonlocal exact
+        if node.operator is None:
+            criteria = plan(node)
+            if criteria["abnormal"]:
+                exact = False
+                if negated:
+                    return None
+            return criteria_sql(criteria, params, negated)
+        if node.operator == "not":
+            inner = condition(node.parts[0], not negated)
+            return None if inner is None else f"NOT {inner}"
+        parts = [condition(part, negated) for part in node.parts]
+        if None in parts:
+            return None
+        return f"({f' {node.operator.upper()} '.join(parts)})"
+
+    sql = condition(query, False)
+    return sql, (params if sql is not None else []), exact
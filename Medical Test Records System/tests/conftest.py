@@ -0,0 +1,72 @@
+import os
+import random
+import sys
+
+import pytest
+
+# The modules live next to main.py, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from medical_records import MedicalTestSystem  # noqa: E402
+
+TEST_CATALOG = (
+    "Hemoglobin (Hgb); > 13.8, < 17.2; g/dL; 00-03-04\n"
+    "LDL Cholesterol Low-Density Lipoprotein (LDL); < 100; mg/dL; 00-17-06\n"
+)
+
+RECORD_LINES = [
+    "1300500: Hgb, 2024-01-01 14:10, 13.40, g/dL, Completed, 2024-01-01 15:30 #1",
+    "1300500: LDL, 2024-03-2 07:30, 110, mg/dL, Pending #2",
+    "1300511: LDL, 2024-03-04 04:40, 95.5, mg/dL, pending #3",
+    "1300511: Hgb, 2024-03-04 04:40, 18, g/dL, Reviewed, 2024-03-05 08:00 #4",
+    "1300520: Hgb, 2024-02-10 09:00, 12.9, g/dL, Completed, 2024-02-10 11:15 #5",
+]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """Paths of a small record file and test catalog in a temporary directory."""
+    record_file = tmp_path / "medicalRecord.txt"
+    record_file.write_text("\n".join(RECORD_LINES) + "\n")
+    test_file = tmp_path / "medicalTest.txt"
+    test_file.write_text(TEST_CATALOG)
+    return str(record_file), str(test_file)
+
+
+@pytest.fixture
+def open_system(dataset):
+    """Factory for systems on the dataset; keyword arguments go to MedicalTestSystem."""
+    record_file, test_file = dataset
+
+    def open_system(load=True, record_file=record_file, **options):
+        system = MedicalTestSystem(record_file, test_file, **options)
+        if load:
+            system.load_records()
+        return system
+
+    return open_system
+
+
+@pytest.fixture
+def generated_system(open_system, dataset):
+    """Factory for systems on a few thousand generated records, in place of the small dataset.
+
+    Two thirds are Hgb and a third LDL, all Completed, spread over 97 patients
+    and March 2024, with random results and turnarounds of 10 to 2000 minutes.
+    """
+    record_file, _ = dataset
+    generator = random.Random(7)
+    with open(record_file, 'w') as file:
+        for number in range(1, 3001):
+            test_name, unit = ("Hgb", "g/dL") if number % 3 else ("LDL", "mg/dL")
+            minutes = generator.randint(10, 2000)
+            file.write(f"{1300000 + number % 97}: {test_name}, 2024-03-{1 + number % 28:02d} 06:00, "
+                       f"{generator.lognormvariate(3, 0.8):.2f}, {unit}, Completed, "
+                       f"2024-03-{1 + number % 28:02d} {6 + minutes // 60:02d}:{minutes % 60:02d} #{number}\n")
+    return open_system
+
+
+def record_lines(system):
+    """The loaded records as formatted lines, sorted, for comparing two loads."""
+    return sorted(system.format_record_line(record.patient_id, record)
+                  for patient in system.patients.values() for record in patient.test_records)
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from conftest import RECORD_LINES
+
+# Values the typed columns cannot hold as they are: a text result, a number spelled with
+# extra zeros, unpadded dates and a patient ID that is not 7 digits
+ODD_LINES = [
+    "1300530: LDL, 2024-03-04 4:05, not measured, mg/dL, Pending #6",
+    "130053: Hgb, 2024-03-04 04:05, 013.0, g/dL, Completed, 2024-3-4 05:00 #7",
+]
+
+
+def content(system):
+    # Each record's line without its ID, which an import assigns anew
+    return sorted(system.format_record_line(record.patient_id, record, with_id=False) for record in system.index)
+
+
+@pytest.fixture
+def odd_system(open_system, dataset):
+    with open(dataset[0], 'a') as file:
+        file.write("\n".join(ODD_LINES) + "\n")
+    return open_system
+
+
+def test_bundle_round_trip(odd_system, tmp_path):
+    source = odd_system()
+    bundle = str(tmp_path / "bundle")
+    source.export_columns(bundle)
+
+    target = odd_system(record_file=str(tmp_path / "copy.txt"))
+    target.import_columns(bundle, chunk_size=3)
+    assert content(target) == content(source)
+    assert sorted(record.record_id for record in target.index) == list(range(1, 8))
+    # The import was saved, not just kept in memory
+    assert content(odd_system(record_file=str(tmp_path / "copy.txt"))) == content(source)
+
+
+def test_bundle_columns_are_typed(odd_system, tmp_path):
+    numpy = pytest.importorskip("numpy")
+    source = odd_system()
+    bundle = tmp_path / "ldl"
+    source.export_columns(str(bundle), test_name="LDL")
+    manifest = json.loads((bundle / "manifest.json").read_text())
+    assert manifest["records"] == 3
+
+    records = list(source.iter_records(test_name="LDL"))
+    columns = {name: numpy.load(bundle / column["file"], mmap_mode="r")
+               for name, column in manifest["columns"].items()}
+    assert columns["test_time"].dtype == numpy.int64
+    assert list(columns["test_time"]) == [record.test_time for record in records]
+    # In test time order, as exports are
+    assert list(columns["record_id"]) == [2, 6, 3]
+    assert [manifest["columns"]["status"]["dictionary"][code] for code in columns["status"]] == [
+        "Pending", "Pending", "pending"]
+    values = columns["result_value"]
+    assert (values[0], values[2]) == (110.0, 95.5) and numpy.isnan(values[1])
+    assert manifest["texts"]["result_value"] == {"1": "not measured"}
+
+
+def test_bundle_import_follows_the_duplicate_policy(open_system, dataset, tmp_path):
+    bundle = str(tmp_path / "bundle")
+    open_system().export_columns(bundle)
+
+    # Without loaded records the import only writes, and still sees the copies of stored records
+    open_system(load=False, duplicates="skip").import_columns(bundle)
+    with open(dataset[0]) as file:
+        assert file.read().splitlines() == RECORD_LINES
+    counting = open_system(duplicates="count")
+    counting.import_columns(bundle)
+    assert len(counting.index) == 10 and counting.duplicate_count() == 5
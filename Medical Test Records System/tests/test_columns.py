@@ -0,0 +1,40 @@
+import pytest
+
+import medical_records
+
+pytest.importorskip("numpy")
+
+CRITERIA = [dict(), dict(abnormal=True), dict(test_name="LDL", abnormal=True), dict(status="Reviewed"),
+            dict(patient_id="1300005"), dict(start_date="2024-03-03", end_date="2024-03-12 12:00"),
+            dict(min_turnaround=120, max_turnaround=600), dict(test_name="Hgb", max_turnaround=60),
+            dict(abnormal=True, status="Completed", start_date="2024-03-01", end_date="2024-03-15")]
+
+
+def both_paths(system, monkeypatch, **criteria):
+    monkeypatch.setattr(medical_records, "COLUMN_SCAN_MIN", 0)
+    columns = list(system.iter_records(**criteria))
+    monkeypatch.setattr(medical_records, "COLUMN_SCAN_MIN", 10 ** 9)
+    return columns, list(system.iter_records(**criteria))
+
+
+@pytest.mark.parametrize("criteria", CRITERIA)
+def test_column_masks_match_the_python_predicates(generated_system, monkeypatch, criteria):
+    system = generated_system()
+    columns, python = both_paths(system, monkeypatch, **criteria)
+    assert columns == python
+    assert system.columns is not None
+
+
+def test_column_view_follows_changes(generated_system, monkeypatch):
+    system = generated_system()
+    both_paths(system, monkeypatch, status="Reviewed")
+    for record_id in range(1, 3001, 9):
+        system.update_record_by_id(record_id, status="Reviewed", result_value="250")
+    for record_id in range(3, 3001, 13):
+        system.delete_record_by_id(record_id)
+    assert system.add_test_record("1300005", "LDL", "2024-03-05 10:00", "not measured", "mg/dL", "Reviewed")
+
+    for criteria in (dict(status="Reviewed"), dict(abnormal=True), dict(test_name="LDL", status="Reviewed")):
+        columns, python = both_paths(system, monkeypatch, **criteria)
+        assert columns == python
+    assert "not measured" in [record.result_value for record in columns]
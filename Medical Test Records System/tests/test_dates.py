@@ -0,0 +1,59 @@
+import pytest
+
+import medical_records
+from medical_records import RecordTable, to_epoch_minutes
+
+
+def test_times_parse_with_or_without_padding():
+    assert to_epoch_minutes("2024-03-2 07:30") == to_epoch_minutes("2024-03-02 07:30")
+    assert to_epoch_minutes("1970-01-02 01:05") == 24 * 60 + 65
+    for text in ("2022-03 02:03", "2024-03-02 24:00", "2024-03-02 7h30", "", None):
+        assert to_epoch_minutes(text) is None
+
+
+def test_records_keep_their_text_and_sort_by_time(open_system):
+    system = open_system()
+    patient = system.patients["1300500"]
+    assert patient.add_test_record("Hgb", "2024-02-15 09:00", "14", "g/dL", "Pending").test_time is not None
+    assert patient.add_test_record("Hgb", "2023-12-31 23:59", "14", "g/dL", "Pending")
+
+    times = [record.test_time for record in patient.test_records]
+    assert times == sorted(times)
+    record = system.record_by_id(2)
+    assert record.test_date_time == "2024-03-2 07:30"
+    assert record.test_time == to_epoch_minutes("2024-03-02 07:30")
+
+
+@pytest.mark.parametrize("start, end, ids", [
+    ("2024-01-01", "2024-01-01", [1]),
+    ("2024-01-02", "2024-03-02", [2]),
+    ("2024-03-02", "2024-03-03", [2]),
+    ("2024-01-01 15:00", "2024-12-31", [2]),
+    ("2025-01-01", "2025-12-31", []),
+])
+def test_date_ranges_cover_whole_days(open_system, start, end, ids):
+    patient = open_system().patients["1300500"]
+    assert [record.record_id for record in patient.get_records_by_date_range(start, end)] == ids
+
+
+def test_date_range_reads_only_the_matching_records(generated_system, monkeypatch):
+    patient = generated_system().patients["1300005"]
+    built = []
+    record = RecordTable.record
+    monkeypatch.setattr(RecordTable, "record", lambda table, row: (built.append(row), record(table, row))[1])
+
+    found = patient.get_records_by_date_range("2024-03-10", "2024-03-11")
+    assert found and len(built) == len(found) < len(patient.rows)
+    assert all(record.test_date_time.startswith(("2024-03-10", "2024-03-11")) for record in found)
+
+
+def test_reports_do_not_parse_dates(generated_system, monkeypatch):
+    system = generated_system()
+    expected = system._summary_statistics(test_name="Hgb")
+    system.query_cache.clear()
+
+    def no_parsing(text):
+        raise AssertionError(f"parsed {text!r} again")
+    monkeypatch.setattr(medical_records, "to_epoch_minutes", no_parsing)
+    assert system._summary_statistics(test_name="Hgb") == expected
+    assert system.grouped_report(["status"])
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from conftest import RECORD_LINES
+from dedupe import dedupe_file, dedupe_in_memory
+from medical_records import record_content
+
+
+def write_with_copies(record_file):
+    # Each stored line once, then copies of the first two under new IDs
+    with open(record_file, 'w') as file:
+        file.write("\n".join(RECORD_LINES) + "\n")
+        file.write(RECORD_LINES[0].replace("#1", "#6") + "\n" + RECORD_LINES[1].replace("#2", "#7") + "\n")
+
+
+@pytest.mark.parametrize("max_entries", [50, 300, 10 ** 6])
+def test_partitions_keep_the_same_lines_as_memory(tmp_path, max_entries):
+    generator = random.Random(3)
+    contents = [f"{1300000 + number % 40}: Hgb, 2024-03-{1 + number % 28:02d} 06:00, {number % 17}, g/dL, Completed"
+                for number in range(400)]
+    source = tmp_path / "records.txt"
+    with open(source, 'w') as file:
+        for number in range(2000):
+            file.write(f"{generator.choice(contents)} #{number + 1}\n" if number % 50 else "\n")
+
+    expected, result = tmp_path / "memory.txt", tmp_path / "partitioned.txt"
+    counts = dedupe_in_memory(str(source), str(expected), record_content)
+    assert dedupe_file(str(source), str(result), record_content, max_entries) == counts
+    assert result.read_text() == expected.read_text()
+
+    # The first copy of each content stays, in file order; blank lines are copied as they are
+    lines = result.read_text().splitlines()
+    kept = [record_content(line) for line in lines if line]
+    assert len(kept) == len(set(kept)) == len(set(map(record_content, source.read_text().splitlines())) - {None})
+    assert lines.count("") == 40 and counts == (len(lines), 2000 - len(lines))
+
+
+def test_dedupe_job_compacts_the_record_file(open_system, dataset):
+    record_file, _ = dataset
+    write_with_copies(record_file)
+    open_system(load=False).dedupe_records(max_entries=1)
+    with open(record_file) as file:
+        assert file.read().splitlines() == RECORD_LINES
+
+
+@pytest.mark.parametrize("policy, stored", [("count", 7), ("skip", 5), ("reject", 5)])
+def test_duplicate_policies_at_load_and_add(open_system, dataset, policy, stored):
+    write_with_copies(dataset[0])
+    system = open_system(duplicates=policy)
+    assert len(system.index) == stored
+    assert system.duplicate_count() == stored - 5
+
+    added = system.add_test_record("1300511", "LDL", "2024-03-04 04:40", "95.5", "mg/dL", "pending")
+    assert added is (policy != "reject")
+    assert len(system.index) == stored + (policy == "count")
@@ -0,0 +1,107 @@
+import functools
+import importlib
+
+import pytest
+
+import export
+import medical_records
+from conftest import record_lines
+
+
+def content(system):
+    # The records without their IDs, which an import assigns anew
+    return sorted(line.rsplit(" #", 1)[0] for line in record_lines(system))
+
+
+def test_export_writes_canonical_dates(open_system, tmp_path):
+    system = open_system()
+    export_file = str(tmp_path / "out.csv")
+    system.export_records(export_file)
+
+    with open(export_file) as file:
+        lines = file.read().splitlines()
+    assert "1300500,LDL,2024-03-02 07:30,110,mg/dL,Pending," in lines
+
+
+def test_export_import_round_trip(open_system, tmp_path):
+    source = open_system()
+    export_file = str(tmp_path / "out.csv")
+    source.export_records(export_file)
+
+    target = open_system(record_file=str(tmp_path / "copy.txt"))
+    target.import_records(export_file, workers=1)
+
+    rejects = tmp_path / "out.csv.rejects"
+    assert not rejects.exists() or not rejects.read_text()
+    assert len(target.index) == len(source.index)
+    # Dates come back in the canonical spelling and statuses in the valid one
+    expected = [line.replace("2024-03-2 07:30", "2024-03-02 07:30").replace("pending", "Pending")
+                for line in content(source)]
+    assert content(target) == sorted(expected)
+
+    # And the imported dataset exports to the same file, the status spelling aside
+    second_export = str(tmp_path / "again.csv")
+    target.export_records(second_export)
+    with open(export_file) as first, open(second_export) as second:
+        assert [line.replace("pending", "Pending") for line in first] == list(second)
+
+
+def test_import_without_loading_only_writes(open_system, tmp_path):
+    import_file = tmp_path / "new.csv"
+    import_file.write_text(
+        "1300600,LDL,2024-04-01 08:00,90,mg/dL,Pending,\n"
+        "1300601,Hgb,2024-04-01 09:00,14,g/dL,Completed,2024-04-01 10:00\n"
+        "1300600,LDL,2024-04-01 08:00,90,mg/dL,Pending,\n"
+        "1300500,Hgb,2024-01-01 14:10,13.40,g/dL,Completed,2024-01-01 15:30\n"
+    )
+    system = open_system(load=False, duplicates="skip")
+    system.import_records(str(import_file), chunk_size=2, workers=1)
+
+    # Nothing was kept in memory, and repeats of stored rows and of an earlier chunk were still caught
+    assert not system.patients and not len(system.index)
+    loaded = open_system()
+    assert len(loaded.index) == 7
+    assert len(list(loaded.select(patient_id="1300600"))) == 1
+
+
+@pytest.mark.parametrize("criteria", [dict(), dict(test_name="LDL"), dict(patient_id="1300005"),
+                                      dict(start_date="2024-03-05", end_date="2024-03-09", abnormal=True)])
+def test_export_without_loading_streams_the_files(generated_system, tmp_path, monkeypatch, criteria):
+    loaded = generated_system()
+    loaded.update_record_by_id(5, status="Pending")
+    loaded.delete_record_by_id(6)
+    loaded.export_records(str(tmp_path / "loaded.csv"), **criteria)
+
+    # Runs of 500 records spill to temporary files; the journal's changes are applied patient by patient
+    monkeypatch.setattr(export, "sorted_in_runs", functools.partial(export.sorted_in_runs, run_size=500))
+    monkeypatch.setattr(medical_records, "sorted_in_runs", export.sorted_in_runs)
+    streamed = generated_system(load=False)
+    streamed.export_records(str(tmp_path / "streamed.csv"), **criteria)
+
+    assert not streamed.patients and not len(streamed.index)
+    assert (tmp_path / "streamed.csv").read_text() == (tmp_path / "loaded.csv").read_text()
+
+
+@pytest.mark.parametrize("compression", sorted(export.COMPRESSIONS))
+def test_compressed_export_in_parts(generated_system, tmp_path, compression):
+    system = generated_system()
+    system.export_records(str(tmp_path / "plain.csv"), test_name="Hgb")
+    extension = export.COMPRESSIONS[compression][0]
+    system.export_records(str(tmp_path / f"hgb.csv{extension}"), part_records=700, test_name="Hgb")
+
+    codec = importlib.import_module({"xz": "lzma"}.get(compression, compression))
+    parts = []
+    for number in (1, 2, 3):
+        with codec.open(str(tmp_path / f"hgb.{number:04d}.csv{extension}"), 'rt') as file:
+            parts.append(file.read().splitlines(keepends=True))
+    assert not (tmp_path / f"hgb.0004.csv{extension}").exists()
+    # Every part has the header and its share of the records, in export order
+    assert [len(part) for part in parts] == [701, 701, 601]
+    assert all(part[0] == export.EXPORT_HEADER for part in parts)
+    plain = (tmp_path / "plain.csv").read_text().splitlines(keepends=True)
+    assert [line for part in parts for line in part[1:]] == plain[1:]
+
+
+def test_export_names_an_unknown_codec(open_system, tmp_path):
+    with pytest.raises(ValueError):
+        open_system().export_records(str(tmp_path / "out.csv.zst"), compression="zstd")
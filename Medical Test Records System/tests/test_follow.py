@@ -0,0 +1,51 @@
+import os
+
+from conftest import record_lines
+
+APPENDED_LINE = "1300600: LDL, 2024-03-03 07:30, 90, mg/dL, Pending #6"
+
+
+def append_line(record_file, line):
+    with open(record_file, 'a') as file:
+        file.write(line + '\n')
+
+
+def test_appended_lines_survive_a_stale_rewrite(open_system, dataset):
+    record_file, _ = dataset
+    writer = open_system()
+
+    # Another program appends a line after the writer loaded the records
+    append_line(record_file, APPENDED_LINE)
+    assert writer.add_test_record("1300530", "LDL", "2024-04-01 08:00", "80", "mg/dL", "Pending")
+    writer.compact_records()
+
+    with open(record_file) as file:
+        assert APPENDED_LINE in file.read().splitlines()
+    assert not os.path.exists(writer.journal_file)
+    assert record_lines(open_system()) == record_lines(writer)
+
+
+def test_poll_parses_only_the_appended_tail(open_system, dataset):
+    record_file, _ = dataset
+    reader = open_system()
+    loaded = reader.snapshot_records
+
+    assert not reader.poll_changes()
+    append_line(record_file, APPENDED_LINE)
+    assert reader.poll_changes()
+    assert reader.snapshot_records == loaded + 1
+    assert [record.record_id for record in reader.select(patient_id="1300600")] == [6]
+
+
+def test_poll_sees_commits_and_rewrites(open_system):
+    reader, writer = open_system(), open_system()
+
+    assert writer.update_record_by_id(2, status="Completed", result_date_time="2024-03-03 07:30")
+    assert reader.poll_changes()
+    assert record_lines(reader) == record_lines(writer)
+
+    writer.delete_record_by_id(5)
+    writer.compact_records()
+    assert reader.poll_changes()
+    assert record_lines(reader) == record_lines(writer)
+    assert not reader.poll_changes()
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from conftest import record_lines
+from medical_records import ConflictError
+
+
+def test_changes_are_journaled_and_replayed(open_system, dataset):
+    record_file, _ = dataset
+    with open(record_file) as file:
+        original = file.read()
+    system = open_system()
+
+    assert system.add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    assert system.update_record_by_id(2, status="Completed", result_date_time="2024-03-03 07:30")
+    assert system.delete_record_by_id(5)
+
+    # Only the journal was written; loading again replays it
+    with open(record_file) as file:
+        assert file.read() == original
+    assert os.path.getsize(system.journal_file) > 0
+    assert record_lines(open_system()) == record_lines(system)
+
+
+def test_torn_batch_is_skipped_on_replay(open_system):
+    system = open_system()
+    assert system.add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    committed = record_lines(system)
+    with system.batch():
+        system.add_test_record("1300531", "LDL", "2024-04-02 08:00", "80", "mg/dL", "Pending")
+        system.update_record_by_id(1, result_value="14.1")
+
+    # A crash in the middle of writing the batch: its end marker never reached the disk
+    with open(system.journal_file, 'rb+') as file:
+        data = file.read()
+        file.truncate(data.rindex(b"\nE\t") + 1)
+
+    reopened = open_system()
+    assert record_lines(reopened) == committed
+    # The next commit cuts the torn batch off before appending
+    assert reopened.delete_record_by_id(3)
+    assert record_lines(open_system()) == record_lines(reopened)
+
+
+def test_batch_rolls_back_when_it_raises(open_system):
+    system = open_system()
+    before = record_lines(system)
+
+    with pytest.raises(ValueError):
+        with system.batch():
+            system.add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+            system.update_record_by_id(1, status="Reviewed")
+            system.delete_record_by_id(4)
+            raise ValueError("stop")
+
+    assert record_lines(system) == before
+    assert not os.path.exists(system.journal_file)
+    assert record_lines(open_system()) == before
+
+
+def test_conflicting_batch_is_not_saved(open_system):
+    first, second = open_system(), open_system()
+    assert first.update_record_by_id(2, status="Completed", result_date_time="2024-03-03 07:30")
+
+    with pytest.raises(ConflictError):
+        with second.batch():
+            second.add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+            second.update_record_by_id(2, status="Reviewed")
+
+    # The other process's change stands and nothing of the batch was written
+    assert record_lines(open_system()) == record_lines(first)
+
+
+def test_writer_checks_only_the_journal_tail(open_system, monkeypatch):
+    system = open_system()
+    assert system.add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    committed_end = os.path.getsize(system.journal_file)
+    # A crash left half a line after the last commit
+    with open(system.journal_file, 'ab') as file:
+        file.write(b"A\t1300531: LDL, 2024-04-02")
+
+    writer = open_system(load=False)
+    starts = []
+    read_journal = writer.read_journal
+    monkeypatch.setattr(writer, "read_journal", lambda start=0: (starts.append(start), read_journal(start))[1])
+    assert writer.write_journal(["A\t1300532: Hgb, 2024-04-03 08:00, 14, g/dL, Pending #7"])
+
+    # Before appending it read only what followed the last commit, and cut the torn line off
+    assert starts == [committed_end]
+    assert len(open_system().index) == len(system.index) + 1
@@ -0,0 +1,39 @@
+from conftest import record_lines
+from medical_records import LazyPatientStore
+
+
+def test_only_looked_up_patients_are_parsed(generated_system):
+    system = generated_system(lazy=True, max_cached_patients=3)
+    assert len(system.patients) == 97 and not system.patients.cache
+
+    assert len(system.patients["1300005"].test_records) == 31
+    assert list(system.patients.cache) == ["1300005"]
+    for patient_id in ("1300006", "1300007", "1300005", "1300008"):
+        system.patients[patient_id]
+    # The least recently used patient went first
+    assert list(system.patients.cache) == ["1300007", "1300005", "1300008"]
+    assert "1300006" in system.patients and system.patients.get("1309999") is None
+
+
+def test_changes_survive_eviction(generated_system):
+    system = generated_system(lazy=True, max_cached_patients=2)
+    assert system.update_record_by_id(5, patient_id="1300005", status="Reviewed")
+    assert system.delete_record_by_id(102, patient_id="1300005")
+    for patient_id in ("1300001", "1300002", "1300003"):
+        system.patients[patient_id]
+    assert "1300005" not in system.patients.cache
+
+    records = system.patients["1300005"].test_records
+    assert len(records) == 30
+    assert [record.status for record in records if record.record_id == 5] == ["Reviewed"]
+    assert record_lines(system) == record_lines(generated_system())
+
+
+def test_offset_index_is_reused(generated_system, monkeypatch):
+    first = generated_system(lazy=True)
+    expected = record_lines(first)
+
+    def no_scan(store):
+        raise AssertionError("scanned the record file again")
+    monkeypatch.setattr(LazyPatientStore, "build_offsets", no_scan)
+    assert record_lines(generated_system(lazy=True)) == expected
@@ -0,0 +1,50 @@
+import multiprocessing
+
+import pytest
+
+import medical_records
+
+pytestmark = pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                                reason="sharded queries fork their workers")
+
+CRITERIA = [dict(), dict(abnormal=True), dict(test_name="LDL", min_turnaround=100),
+            dict(status="Completed", start_date="2024-03-04", end_date="2024-03-20")]
+
+
+@pytest.fixture
+def sharded(generated_system, monkeypatch):
+    """A single-process system and one scanning in two worker processes, on the Python path."""
+    monkeypatch.setattr(medical_records, "COLUMN_SCAN_MIN", 10 ** 9)
+    monkeypatch.setattr(medical_records, "SHARD_SCAN_MIN", 0)
+    runs = []
+    run_sharded = medical_records.MedicalTestSystem.run_sharded
+
+    def counting(system, *args):
+        runs.append(args)
+        return run_sharded(system, *args)
+    monkeypatch.setattr(medical_records.MedicalTestSystem, "run_sharded", counting)
+    return generated_system(), generated_system(query_workers=2), runs
+
+
+@pytest.mark.parametrize("criteria", CRITERIA)
+def test_sharded_filters_match_one_process(sharded, criteria):
+    single, workers, runs = sharded
+    expected = [record.fields() for record in single.iter_records(**criteria)]
+    assert expected and not runs
+    assert [record.fields() for record in workers.iter_records(**criteria)] == expected
+    assert len(runs) == 1
+
+
+def test_sharded_reports_merge_exactly(sharded):
+    single, workers, runs = sharded
+    expected = single.grouped_report(["test_name", "week"], abnormal=True)
+    rows = workers.grouped_report(["test_name", "week"], abnormal=True)
+    assert len(runs) == 1
+    assert [row["group"] for row in rows] == [row["group"] for row in expected]
+    for row, expected_row in zip(rows, expected):
+        assert row["records"] == expected_row["records"]
+        for measure in ("result_value", "turnaround"):
+            for name in ("count", "min", "max", "histogram"):
+                assert row[measure][name] == expected_row[measure][name]
+            for name in ("mean", "stddev"):
+                assert row[measure][name] == pytest.approx(expected_row[measure][name])
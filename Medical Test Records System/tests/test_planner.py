@@ -0,0 +1,47 @@
+import pytest
+
+from medical_records import record_order
+
+CRITERIA = [dict(test_name="LDL"), dict(status="Reviewed"), dict(patient_id="1300005"),
+            dict(start_date="2024-03-05", end_date="2024-03-06"), dict(test_name="Hgb", status="Reviewed"),
+            dict(patient_id="1300005", start_date="2024-03-01", end_date="2024-03-10", test_name="LDL")]
+
+
+def scanned(system, test_name=None, status=None, patient_id=None, start_date=None, end_date=None):
+    # The same filter as a plain scan of every record
+    records = [record for record in system.index
+               if (test_name is None or record.test_name == test_name)
+               and (status is None or record.status == status)
+               and (patient_id is None or record.patient_id == patient_id)
+               and (start_date is None or start_date <= record.test_date_time[:10] <= end_date)]
+    return sorted(records, key=record_order)
+
+
+@pytest.mark.parametrize("criteria, size", [
+    (dict(test_name="LDL", status="Completed"), 1000),
+    (dict(test_name="Hgb", patient_id="1300005"), 31),
+    (dict(status="Completed", start_date="2024-03-05", end_date="2024-03-05"), 108),
+    (dict(), 3000),
+])
+def test_planner_starts_from_the_smallest_index(generated_system, criteria, size):
+    system = generated_system()
+    planned_size, candidates, _ = system.query_plan(**criteria)
+    assert planned_size == size
+    assert len(list(candidates)) == size
+
+
+def test_indexes_follow_every_change(generated_system, tmp_path):
+    system = generated_system()
+    for record_id in range(1, 3001, 5):
+        system.update_record_by_id(record_id, status="Reviewed", test_date_time="2024-03-06 07:00")
+    for record_id in range(2, 3001, 11):
+        system.delete_record_by_id(record_id)
+    assert system.add_test_record("1300005", "LDL", "2024-03-05 10:00", "120", "mg/dL", "Reviewed")
+    import_file = tmp_path / "more.csv"
+    import_file.write_text("1300005,Hgb,2024-03-05 11:00,15,g/dL,Reviewed,\n"
+                           "1300099,LDL,2024-03-06 12:00,80,mg/dL,Pending,\n")
+    system.import_records(str(import_file), workers=1)
+
+    for criteria in CRITERIA:
+        assert list(system.iter_records(**criteria)) == scanned(system, **criteria)
+    assert [record.patient_id for record in system.iter_records(status="Pending")] == ["1300099"]
@@ -0,0 +1,38 @@
+import pytest
+
+from medical_records import record_order
+from query import Query
+
+
+def test_combined_query_is_lazy_and_ordered(generated_system, monkeypatch):
+    system = generated_system()
+    checked = []
+    query_matcher = system.query_matcher
+
+    def counting_matcher(query, planned):
+        matches = query_matcher(query, planned)
+        return lambda record: (checked.append(record), matches(record))[1]
+    monkeypatch.setattr(system, "query_matcher", counting_matcher)
+
+    query = Query(test_name="LDL") | Query(patient_id="1300005")
+    results = system.select(query)
+    first = next(results)
+    # Only the first few candidates were checked to find the first result
+    assert len(checked) < 10
+    rest = list(results)
+    assert [first] + rest == sorted([first] + rest, key=record_order)
+    assert len({id(record) for record in [first] + rest}) == len(rest) + 1
+    assert len(rest) + 1 == sum(1 for record in system.index
+                                if record.test_name == "LDL" or record.patient_id == "1300005")
+
+
+@pytest.mark.parametrize("criteria", [dict(test_name="Hgb"), dict(status="Completed"), dict(patient_id="1300005"),
+                                      dict(start_date="2024-03-05", end_date="2024-03-09"), dict()])
+def test_results_come_in_record_order(generated_system, criteria):
+    system = generated_system()
+    # Updates put records out of insertion order
+    for record_id in range(1, 3001, 7):
+        system.update_record_by_id(record_id, test_date_time="2024-03-07 06:00")
+    results = list(system.iter_records(**criteria))
+    assert results
+    assert results == sorted(results, key=record_order)
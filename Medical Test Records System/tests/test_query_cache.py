@@ -0,0 +1,50 @@
+def cached(system):
+    # (patient, test name) of the cached queries
+    return {key[2:4] for key in system.query_cache.entries}
+
+
+def test_equivalent_queries_share_an_entry(open_system):
+    system = open_system()
+    first = system.find_records(test_name="LDL", start_date="2024-03-02", end_date="2024-03-04")
+    again = system.find_records(test_name="LDL", start_date="2024-03-2", end_date="2024-03-04 23:59", status=None)
+    assert again == first and len(first) == 2
+    assert len(system.find_records(min_turnaround=60)) == len(system.find_records(min_turnaround=60.0)) == 3
+    assert system.query_cache.stats() == {"entries": 2, "hits": 2, "misses": 2, "evictions": 0,
+                                          "invalidations": 0}
+
+    # Callers get copies, so changing one leaves the cached result alone
+    first[0]["status"] = "Changed"
+    again = system.find_records(test_name="LDL", start_date="2024-03-02", end_date="2024-03-04")
+    assert again[0]["status"] != "Changed"
+
+
+def test_changes_drop_only_the_results_they_affect(open_system):
+    system = open_system()
+    for criteria in (dict(patient_id="1300500"), dict(patient_id="1300520", test_name="Hgb"),
+                     dict(test_name="Hgb"), dict(test_name="LDL"), dict(status="Pending")):
+        system.find_records(**criteria)
+    assert len(system.query_cache) == 5
+
+    assert system.add_test_record("1300520", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    assert cached(system) == {("1300500", None), ("1300520", "Hgb"), (None, "Hgb")}
+    assert [record["record_id"] for record in system.find_records(status="Pending")] == [2, 6]
+
+    assert system.update_record_by_id(1, test_name="LDL")
+    assert cached(system) == {("1300520", "Hgb")}
+
+    system.grouped_report(["status"])
+    system.find_records(test_name="Hgb", abnormal=True)
+    system.update_medical_test("Hemoglobin (Hgb)", "Hemoglobin A (Hgb)", "> 1", "g/dL", "00-03-04")
+    # Only the query that used the reference ranges is gone
+    assert cached(system) == {("1300520", "Hgb"), (None, None)}
+    assert system.find_records(test_name="Hgb", abnormal=True) == []
+
+
+def test_cache_is_bounded(open_system):
+    system = open_system()
+    system.query_cache.max_entries = 2
+    for patient_id in ("1300500", "1300511", "1300520", "1300511"):
+        system.find_records(patient_id=patient_id)
+    assert cached(system) == {("1300511", None), ("1300520", None)}
+    stats = system.query_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
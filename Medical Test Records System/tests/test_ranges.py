@@ -0,0 +1,53 @@
+import pytest
+
+
+def abnormal_ids(system):
+    return sorted(record.record_id for record in system.iter_records(abnormal=True))
+
+
+@pytest.mark.parametrize("range_values, expected", [
+    ("> 13.8, < 17.2", (13.8, False, 17.2, False)),
+    (">= 70, <= 99", (70.0, True, 99.0, True)),
+    ("<80", (None, False, 80.0, False)),
+    ("> 5, x 9", (5.0, False, None, False)),
+])
+def test_ranges_compile_to_bounds(open_system, range_values, expected):
+    assert open_system(load=False).compile_range(range_values) == expected
+
+
+def test_bounds_are_inclusive_only_when_asked(open_system):
+    system = open_system(load=False)
+    exclusive = {"T": system.compile_range("> 10, < 20")}
+    inclusive = {"T": system.compile_range(">= 10, <= 20")}
+    for value, outside in ((9.9, True), (10, True), (15, False), (20, True), (20.1, True)):
+        assert system.is_abnormal("T", value, exclusive) is outside
+    for value, outside in ((9.9, True), (10, False), (15, False), (20, False), (20.1, True)):
+        assert system.is_abnormal("T", value, inclusive) is outside
+    # A test without a range is never abnormal
+    assert system.is_abnormal("BGT", 1000, inclusive) is False
+
+
+def test_ranges_are_read_once(open_system, dataset):
+    system = open_system()
+    assert abnormal_ids(system) == [1, 2, 4, 5]
+    ranges = system.load_test_ranges()
+
+    # Further filters use the compiled table, not the catalog file
+    open(dataset[1], "w").close()
+    assert abnormal_ids(system) == [1, 2, 4, 5]
+    assert system.load_test_ranges() is ranges
+
+
+def test_catalog_changes_rebuild_the_ranges(open_system):
+    system = open_system()
+    system.load_test()
+    assert abnormal_ids(system) == [1, 2, 4, 5]
+
+    system.update_medical_test("LDL Cholesterol Low-Density Lipoprotein (LDL)", "LDL Cholesterol (LDL)",
+                               "< 90", "mg/dL", "00-17-06")
+    assert abnormal_ids(system) == [1, 2, 3, 4, 5]
+
+    # A test added to the catalog has a range at once
+    system.save_medical_test("Hemoglobin A (HgbA)", ">= 1", "g/dL", "00-03-04")
+    assert "Hemoglobin A (HgbA)" in system.tests
+    assert system.load_test_ranges()["HgbA"] == (1.0, True, None, False)
@@ -0,0 +1,48 @@
+from conftest import RECORD_LINES, record_lines
+
+
+def test_update_and_delete_by_id_touch_only_that_record(open_system):
+    system = open_system()
+    # Two LDL records of the same patient: the ID picks one
+    assert system.add_test_record("1300500", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    assert system.update_record_by_id(6, status="Completed", result_date_time="2024-04-02 08:00")
+    assert system.delete_record_by_id(2)
+
+    assert system.record_by_id(2) is None
+    assert system.record_by_id(6).status == "Completed"
+    reopened = open_system()
+    assert record_lines(reopened) == record_lines(system)
+    assert [record.record_id for record in reopened.select(patient_id="1300500")] == [1, 6]
+
+
+def test_ids_are_unique_across_processes(open_system):
+    first, second = open_system(), open_system(load=False)
+    assert first.add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    assert second.add_test_record("1300531", "LDL", "2024-04-01 09:00", "80", "mg/dL", "Pending")
+    assert first.add_test_record("1300532", "LDL", "2024-04-01 10:00", "70", "mg/dL", "Pending")
+
+    ids = [record.record_id for record in open_system().index]
+    assert sorted(ids) == list(range(1, 9))
+
+
+def test_lines_without_ids_are_numbered_the_same_everywhere(open_system, dataset):
+    record_file, _ = dataset
+    with open(record_file, 'w') as file:
+        file.write("".join(line.rsplit(" #", 1)[0] + "\n" for line in RECORD_LINES))
+
+    first, second = open_system(), open_system()
+    assert record_lines(first) == record_lines(second)
+    assert sorted(record.record_id for record in first.index) == [1, 2, 3, 4, 5]
+    # A change saves the IDs into the file
+    assert first.delete_record_by_id(5)
+    assert record_lines(open_system()) == record_lines(first)
+
+
+def test_import_without_new_rows_uses_no_ids(open_system, tmp_path):
+    import_file = tmp_path / "again.csv"
+    import_file.write_text("1300500,Hgb,2024-01-01 14:10,13.40,g/dL,Completed,2024-01-01 15:30\n")
+    system = open_system(load=False, duplicates="skip")
+    system.import_records(str(import_file), workers=1)
+
+    assert open_system(load=False).add_test_record("1300530", "LDL", "2024-04-01 08:00", "90", "mg/dL", "Pending")
+    assert max(record.record_id for record in open_system().index) == 6
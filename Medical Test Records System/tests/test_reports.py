@@ -0,0 +1,80 @@
+import statistics
+from datetime import date
+
+import pytest
+
+import medical_records
+import reports
+
+STATISTICS = ("count", "min", "max", "mean", "stddev", "median", "p90", "p99")
+
+
+def test_summary_is_the_same_on_both_paths(generated_system, monkeypatch):
+    pytest.importorskip("numpy")
+    system = generated_system()
+    monkeypatch.setattr(medical_records, "COLUMN_SCAN_MIN", 0)
+    columns = system._summary_statistics(test_name="Hgb")
+    monkeypatch.setattr(medical_records, "COLUMN_SCAN_MIN", 10 ** 9)
+    streamed = system._summary_statistics(test_name="Hgb")
+
+    assert columns["records"] == streamed["records"] == 2000
+    for measure in ("result_value", "turnaround"):
+        for name in STATISTICS:
+            assert type(columns[measure][name]) is type(streamed[measure][name])
+            assert columns[measure][name] == pytest.approx(streamed[measure][name], rel=0.01)
+        assert columns[measure]["histogram"] == streamed[measure]["histogram"]
+
+
+def test_grouped_report_matches_a_plain_computation(generated_system):
+    system = generated_system()
+    rows = system.grouped_report(["test_name", "unit", "week"], start_date="2024-03-01", end_date="2024-03-20")
+
+    groups = {}
+    for record in system.iter_records(start_date="2024-03-01", end_date="2024-03-20"):
+        week = date.fromisoformat(record.test_date_time[:10]).isocalendar()
+        key = (record.test_name, record.unit, f"{week[0]}-W{week[1]:02d}")
+        groups.setdefault(key, []).append(record)
+    assert [tuple(row["group"].values()) for row in rows] == sorted(groups)
+
+    for row in rows:
+        records = groups[tuple(row["group"].values())]
+        values = [float(record.result_value) for record in records]
+        # Results past midnight are written as hour 24 and later, which does not parse
+        turnarounds = [float(record.turnaround) for record in records if record.turnaround is not None]
+        assert row["records"] == row["result_value"]["count"] == len(records)
+        for stats, numbers in ((row["result_value"], values), (row["turnaround"], turnarounds)):
+            assert (stats["min"], stats["max"]) == (min(numbers), max(numbers))
+            assert stats["mean"] == pytest.approx(statistics.mean(numbers))
+            assert stats["stddev"] == pytest.approx(statistics.stdev(numbers))
+            assert sum(bin["count"] for bin in stats["histogram"]) == len(numbers)
+
+
+def test_grouped_report_keys_and_missing_values(open_system):
+    rows = open_system().grouped_report(["test_name", "status", "month"])
+    assert [tuple(row["group"].values()) for row in rows] == [
+        ("Hgb", "Completed", "2024-01"), ("Hgb", "Completed", "2024-02"), ("Hgb", "Reviewed", "2024-03"),
+        ("LDL", "Pending", "2024-03"), ("LDL", "pending", "2024-03")]
+    pending = rows[3]
+    # A record without a result date counts, with no turnaround
+    assert pending["records"] == 1 and pending["result_value"]["mean"] == 110
+    assert pending["turnaround"]["count"] == 0 and pending["turnaround"]["mean"] is None
+    assert rows[0]["turnaround"]["min"] == 80
+
+
+def test_partial_reports_merge_into_the_whole(generated_system):
+    system = generated_system()
+    records = list(system.iter_records())
+    whole, first, second = (reports.GroupedReport(["status"]) for _ in range(3))
+    for number, record in enumerate(records):
+        whole.add(record)
+        (first if number % 2 else second).add(record)
+    merged = first.merge(second).results()[0]
+    expected = whole.results()[0]
+    assert merged["records"] == expected["records"] == 3000
+    for measure in ("result_value", "turnaround"):
+        for name in ("count", "min", "max", "mean", "stddev"):
+            assert merged[measure][name] == pytest.approx(expected[measure][name])
+        assert merged[measure]["histogram"] == expected[measure]["histogram"]
+
+    with pytest.raises(ValueError):
+        reports.GroupedReport(["clinic"])
@@ -0,0 +1,69 @@
+import os
+
+from conftest import record_lines
+from shards import shard_files, shard_of
+
+
+def test_split_writes_shards_and_removes_record_file(open_system, dataset):
+    record_file, _ = dataset
+    single = record_lines(open_system())
+
+    sharded = open_system(shards=2)
+    paths = shard_files(record_file, 2)
+    assert all(map(os.path.exists, paths))
+    assert not os.path.exists(record_file)
+    assert not os.path.exists(record_file + ".cache")
+    assert record_lines(sharded) == single
+
+    # Each patient is in the shard the shard function picks
+    for number, path in enumerate(paths):
+        with open(path) as file:
+            assert {shard_of(line.split(":")[0], 2) for line in file} <= {number}
+
+    # Later runs find the shards without being told
+    reopened = open_system()
+    assert reopened.shard_count == 2
+    assert record_lines(reopened) == single
+
+
+def test_compact_rewrites_only_changed_shards(open_system, dataset):
+    record_file, _ = dataset
+    system = open_system(shards=2)
+    record = next(record for record in system.index if record.patient_id == "1300511")
+    changed = shard_files(record_file, 2)[shard_of("1300511", 2)]
+    unchanged = shard_files(record_file, 2)[1 - shard_of("1300511", 2)]
+    before = os.stat(unchanged).st_mtime_ns, os.stat(unchanged).st_ino
+
+    assert system.update_record_by_id(record.record_id, status="Completed", result_value="101")
+    system.compact_records()
+
+    assert not os.path.exists(system.journal_file)
+    assert (os.stat(unchanged).st_mtime_ns, os.stat(unchanged).st_ino) == before
+    with open(changed) as file:
+        assert system.format_record_line(record.patient_id, record) in file.read().splitlines()
+    assert record_lines(open_system()) == record_lines(system)
+
+
+def test_split_takes_a_fresh_exclusive_lock(open_system, dataset, monkeypatch):
+    record_file, _ = dataset
+    system = open_system(load=False, shards=2)
+    upgrades = []
+    acquire = system.lock.acquire
+    monkeypatch.setattr(system.lock, "acquire",
+                        lambda exclusive: (upgrades.append(exclusive and system.lock.depth > 0), acquire(exclusive)))
+
+    # Another program appends a line after the first load read the file, before the split
+    load = system._load_records
+
+    def load_then_append():
+        load()
+        monkeypatch.setattr(system, "_load_records", load)
+        with open(record_file, 'a') as file:
+            file.write("1300600: LDL, 2024-03-03 07:30, 90, mg/dL, Pending #6\n")
+    monkeypatch.setattr(system, "_load_records", load_then_append)
+    system.load_records()
+
+    assert not any(upgrades)
+    assert not os.path.exists(record_file)
+    assert system.record_by_id(6) is not None
+    assert record_lines(open_system()) == record_lines(system)
@@ -0,0 +1,46 @@
+from medical_records import to_epoch_minutes
+
+LDL_TURNAROUND = 17 * 60 + 6  # 00-17-06 in the catalog
+
+
+def overdue_ids(system, now):
+    return [record.record_id for _, record in system.overdue_tests(to_epoch_minutes(now))]
+
+
+def test_pending_tests_are_due_after_their_turnaround(open_system):
+    system = open_system()
+    due = to_epoch_minutes("2024-03-02 07:30") + LDL_TURNAROUND
+    assert system.overdue_tests(due - 1) == []
+    assert [(deadline, record.record_id) for deadline, record in system.overdue_tests(due)] == [(due, 2)]
+    # Any spelling of Pending counts; earliest deadline first
+    assert overdue_ids(system, "2025-01-01 00:00") == [2, 3]
+
+
+def test_monitor_follows_changes(open_system):
+    system = open_system()
+    assert overdue_ids(system, "2025-01-01 00:00") == [2, 3]
+
+    assert system.update_record_by_id(2, status="Completed", result_date_time="2024-03-03 08:00")
+    assert system.delete_record_by_id(3)
+    # The new record fills the deleted record's row, with a deadline of its own
+    assert system.add_test_record("1300520", "LDL", "2024-06-01 08:00", "90", "mg/dL", "Pending")
+    assert system.add_test_record("1300520", "Hgb", "2024-05-01 08:00", "14", "g/dL", "Pending")
+    assert overdue_ids(system, "2024-06-01 23:59") == [7]
+    assert overdue_ids(system, "2024-06-02 01:06") == [7, 6]
+
+
+def test_overdue_matches_a_full_scan(generated_system):
+    system = generated_system()
+    for record_id in range(1, 3001, 4):
+        system.update_record_by_id(record_id, status="Pending", result_date_time="")
+    system.overdue_tests(0)
+    for record_id in range(1, 3001, 12):
+        system.update_record_by_id(record_id, status="Completed")
+
+    turnarounds = system.load_test_turnarounds()
+    for now in ("2024-03-02 00:00", "2024-03-15 12:00", "2024-04-01 00:00"):
+        now = to_epoch_minutes(now)
+        expected = sorted((record.test_time + turnarounds[record.test_name], record.record_id)
+                          for record in system.index
+                          if record.status == "Pending" and record.test_time + turnarounds[record.test_name] <= now)
+        assert [(deadline, record.record_id) for deadline, record in system.overdue_tests(now)] == expected
@@ -0,0 +1,38 @@
+import os
+
+from conftest import record_lines
+
+
+def test_snapshot_is_used_until_the_record_file_changes(open_system, dataset):
+    record_file, _ = dataset
+    parsed = open_system()
+    assert os.path.exists(parsed.snapshot_file)
+
+    cached = open_system(load=False)
+    assert cached.read_snapshot() is not None
+    cached.load_records()
+    assert record_lines(cached) == record_lines(parsed)
+
+    # Rewritten by another program, with the same size: the snapshot no longer matches
+    with open(record_file) as file:
+        text = file.read()
+    with open(record_file, 'w') as file:
+        file.write(text.replace("LDL, 2024-03-2 07:30, 110,", "LDL, 2024-03-2 07:30, 111,"))
+    stat = os.stat(record_file)
+    os.utime(record_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert open_system(load=False).read_snapshot() is None
+    reloaded = open_system()
+    assert any(", 111, mg/dL" in line for line in record_lines(reloaded))
+
+
+def test_damaged_snapshot_falls_back_to_the_record_file(open_system):
+    expected = record_lines(open_system())
+    system = open_system(load=False)
+    with open(system.snapshot_file, 'rb+') as file:
+        file.seek(-16, os.SEEK_END)
+        file.write(b"\xff" * 16)
+
+    assert system.read_snapshot() is None
+    system.load_records()
+    assert record_lines(system) == expected
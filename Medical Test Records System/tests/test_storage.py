@@ -0,0 +1,83 @@
+import pytest
+
+from conftest import record_lines
+from query import Query
+
+
+def content(lines):
+    # Records without their IDs, which an import assigns anew
+    return sorted(line.rsplit(" #", 1)[0] for line in lines)
+
+
+@pytest.fixture
+def stored(open_system, tmp_path):
+    """The text dataset, loaded, and the path of a database with the same records."""
+    text = open_system()
+    text.export_columns(str(tmp_path / "bundle"))
+    database = str(tmp_path / "records.db")
+    open_system(load=False, record_file=database).import_columns(str(tmp_path / "bundle"))
+    return text, database
+
+
+QUERIES = [
+    Query(),
+    Query(patient_id="1300500"),
+    Query(test_name="Hgb", status="Completed"),
+    Query(start_date="2024-02-01", end_date="2024-03-31"),
+    Query(test_name="Hgb", abnormal=True),
+    Query(status="Reviewed") | Query(test_name="LDL"),
+    ~Query(abnormal=True),
+    Query(min_turnaround=60) & ~Query(patient_id="1300520"),
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_store_query_matches_text(stored, open_system, query):
+    text, database = stored
+    store = open_system(load=False, record_file=database)
+
+    found = [store.format_record_line(record.patient_id, record) for record in store.select(query)]
+    expected = [text.format_record_line(record.patient_id, record) for record in text.select(query)]
+    assert content(found) == content(expected)
+    assert not store.records_loaded  # answered in SQL
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_text_store_query_without_loading(open_system, query):
+    loaded = open_system()
+    unloaded = open_system(load=False)
+
+    found = [unloaded.format_record_line(record.patient_id, record) for record in unloaded.select(query)]
+    assert found == [loaded.format_record_line(record.patient_id, record) for record in loaded.select(query)]
+    assert not unloaded.records_loaded  # read from the files, patient by patient
+
+
+def test_update_and_delete_without_loading(stored, open_system):
+    _, database = stored
+    reader = open_system(record_file=database)
+    first, second = sorted(record.record_id for record in reader.index)[:2]
+    version = reader.lock.read_state()[0]
+
+    writer = open_system(load=False, record_file=database)
+    assert writer.update_record_by_id(first, status="Reviewed")
+    assert writer.delete_record_by_id(second)
+    assert not writer.records_loaded
+    # Committed as changes, not as a rewrite that makes every reader load again
+    assert writer.lock.read_state()[0] == version
+
+    with reader.lock.locked():
+        assert reader.catch_up()
+    assert reader.index.get(first).status == "Reviewed"
+    assert reader.index.get(second) is None
+    assert record_lines(reader) == record_lines(open_system(record_file=database))
+
+
+def test_text_update_and_delete_without_loading(open_system):
+    # The text store loads the records to find one by ID; the caller need not
+    system = open_system(load=False)
+    assert system.update_record_by_id(2, status="Completed", result_date_time="2024-03-03 07:30")
+    assert system.delete_record_by_id(5)
+
+    reopened = open_system()
+    assert reopened.record_by_id(2).status == "Completed"
+    assert reopened.record_by_id(5) is None